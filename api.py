@@ -1,10 +1,20 @@
 # api.py
-import requests, time, os, re
+import requests, time, os, re, hashlib, tempfile
 from datetime import datetime
 from logger_config import logger
-from file_utils import sanitize_filename, truncate_name, iso_to_mes_ano, safe_move_folder, count_files_in_folder, monta_caminho_contabil, monta_caminho_fiscal, extract_all_archives, extract_archive
-from config import DEBUG_MODE, DOWNLOAD_BASE_DIR, GESTTA_EMAIL, GESTTA_PASSWORD
+from file_utils import sanitize_filename, truncate_name, iso_to_mes_ano, set_mtime_from_iso, safe_move_folder, count_files_in_folder, monta_caminho_contabil, monta_caminho_fiscal, extract_all_archives, extract_archive, write_archive_manifest, ExtractionLimitExceeded
+from config import DEBUG_MODE, DOWNLOAD_BASE_DIR, GESTTA_EMAIL, GESTTA_PASSWORD, REQUEST_TIMEOUT, DOWNLOAD_TIMEOUT, DESTINATION_POLICIES
+from deadline import DeadlineExceeded, ensure_deadline
+from http_utils import hedged_get, single_flight, iter_json_array_items, warm_cache
+from api_metrics import SessaoMedida, api_metrics
+from task_records import TaskRecord
+from download_strategy import listar_arquivos_tarefa, get_download_history
+from download_governor import get_download_governor
+from scratch import get_scratch_manager, ScratchFull
+from concurrent.futures import ThreadPoolExecutor
 import shutil
+import threading
+import config as config_module
 
 # Desativar avisos SSL e configurar o ambiente para ignorar certificados problemáticos
 # Isto é necessário quando o Fiddler ou outros proxies SSL estão instalados
@@ -12,23 +22,59 @@ import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 os.environ['PYTHONHTTPSVERIFY'] = '0'  # Para subprocessos 
 
+_session = None
+_session_lock = threading.Lock()
+
+# Conta (e-mail e hash da senha) de cada token obtido: os catálogos em cache são separados por conta
+_conta_do_token = {}
+
+# Loggers ruidosos, com limite de mensagens por minuto (LOG_RATE_LIMITS)
+_token_logger = logger.getChild("token")
+_documentos_logger = logger.getChild("documentos")
+
 # Função para criar uma sessão com verificação SSL desativada
 def create_session():
-    session = requests.Session()
-    session.verify = False  # Desabilita verificação SSL
-    return session
+    """
+    Sessão HTTP do processo, compartilhada por todas as threads (as etapas do pipeline são
+    recriadas a cada execução; o pool de conexões keep-alive com a API continua aquecido no
+    worker daemon). Cada chamada é medida por endpoint (api_metrics).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = SessaoMedida()
+            session.verify = False  # Desabilita verificação SSL
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=config_module.HTTP_POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
 
-def get_token(email=None, password=None):
+def get_token(email=None, password=None, deadline=None, max_age=None):
     """
     Faz login na API do Gestta e retorna o token de autorização.
     Aceita credenciais como parâmetros ou usa as variáveis globais como backup.
+    Logins simultâneos com as mesmas credenciais compartilham uma única chamada.
+    Um token obtido há menos de `max_age` segundos (padrão config.TOKEN_REUSE_SECONDS) é reaproveitado.
     """
     # Usar parâmetros fornecidos ou recorrer às variáveis globais
     use_email = email if email is not None else GESTTA_EMAIL
     use_password = password if password is not None else GESTTA_PASSWORD
-    
-    logger.info(f"Tentando login com email: {use_email}")
-    logger.info(f"Senha possui {len(use_password)} caracteres")
+    key = ("login", use_email, hashlib.sha256(use_password.encode("utf-8")).hexdigest())
+    max_age = config_module.TOKEN_REUSE_SECONDS if max_age is None else max_age
+    token = warm_cache.get(key, max_age, single_flight.do, key, _login, use_email, use_password,
+                           ensure_deadline(deadline))
+    if token:
+        _conta_do_token[token] = key[1:]
+    return token
+
+def _conta(token):
+    """Chave da conta dona do token (o próprio token se ele não veio de get_token)."""
+    return _conta_do_token.get(token, token)
+
+def _login(use_email, use_password, deadline):
+    _token_logger.info(f"Tentando login com email: {use_email}")
+    _token_logger.info(f"Senha possui {len(use_password)} caracteres")
     
     login_url = "https://api.gestta.com.br/core/login"
     payload = {"email": use_email, "password": use_password}
@@ -37,16 +83,18 @@ def get_token(email=None, password=None):
     try:
         # Usar sessão com verificação SSL desativada
         session = create_session()
-        response = session.post(login_url, json=payload, headers=headers, timeout=30)
-        logger.info(f"Request Body: {response.request.body}")
-        logger.info(f"Request Headers: {response.request.headers}")
-        logger.info(f"Response Status: {response.status_code}")
-        logger.info(f"Response Text: {response.text}")
+        with deadline.stage("login"):
+            response = session.post(login_url, json=payload, headers=headers, timeout=deadline.timeout("login", 30))
+        # Corpo e cabeçalhos trazem senha e token: só em DEBUG
+        _token_logger.debug(f"Request Body: {response.request.body}")
+        _token_logger.debug(f"Request Headers: {response.request.headers}")
+        _token_logger.info(f"Response Status: {response.status_code}")
+        _token_logger.debug(f"Response Text: {response.text}")
 
         if response.status_code == 200:
             token = response.headers.get("authorization") or response.headers.get("Authorization")
             if token:
-                logger.info("Token obtido com sucesso.")
+                _token_logger.info("Token obtido com sucesso.")
                 return token
             else:
                 logger.error("Token não encontrado na resposta.")
@@ -58,20 +106,33 @@ def get_token(email=None, password=None):
         logger.error(f"Exceção ao obter token: {str(e)}")
         return None
 
-def get_all_companies(token, company_ids=None):
+def get_all_companies(token, company_ids=None, deadline=None):
+    """
+    Retorna as empresas (customers) do Gestta, opcionalmente filtradas por company_ids.
+    Requisições simultâneas com o mesmo token compartilham uma única chamada à API, e o
+    catálogo de cada conta é reaproveitado por config.CATALOG_CACHE_SECONDS (processos de longa duração).
+    """
+    companies = warm_cache.get(("customer", _conta(token)), config_module.CATALOG_CACHE_SECONDS, single_flight.do,
+                               ("customer", token), _fetch_companies, token, ensure_deadline(deadline))
+    if company_ids:
+        companies = [c for c in companies if c.get("_id") in company_ids]
+    else:
+        companies = list(companies)
+    if companies:
+        logger.info(f"{len(companies)} empresas carregadas.")
+    return companies
+
+def _fetch_companies(token, deadline):
     url = "https://api.gestta.com.br/core/customer"
     headers = {"Authorization": token, "Accept": "application/json, text/plain, */*"}
     try:
         session = create_session()
-        response = session.get(url, headers=headers)
+        with deadline.stage("catalogo"):
+            response = session.get(url, headers=headers, timeout=deadline.timeout("catalogo", REQUEST_TIMEOUT))
         if response.status_code == 200:
             data = response.json()
             if isinstance(data, dict) and "docs" in data:
-                companies = data["docs"]
-                if company_ids:
-                    companies = [c for c in companies if c.get("_id") in company_ids]
-                logger.info(f"{len(companies)} empresas carregadas.")
-                return companies
+                return data["docs"]
             else:
                 logger.error("Chave 'docs' não encontrada no retorno de empresas.")
                 return []
@@ -82,7 +143,22 @@ def get_all_companies(token, company_ids=None):
         logger.error(f"Exceção ao buscar empresas: {str(e)}")
         return []
 
-def get_all_users(token, user_ids=None):
+def get_all_users(token, user_ids=None, deadline=None):
+    """
+    Retorna os usuários da empresa no Gestta, opcionalmente filtrados por user_ids.
+    Requisições simultâneas com o mesmo token compartilham uma única paginação na API, e o
+    catálogo de cada conta é reaproveitado por config.CATALOG_CACHE_SECONDS (processos de longa duração).
+    """
+    all_users = warm_cache.get(("company/user", _conta(token)), config_module.CATALOG_CACHE_SECONDS, single_flight.do,
+                               ("company/user", token), _fetch_users, token, ensure_deadline(deadline))
+    if user_ids:
+        all_users = [u for u in all_users if u.get("_id") in user_ids]
+    else:
+        all_users = list(all_users)
+    logger.info(f"Total de usuários: {len(all_users)}")
+    return all_users
+
+def _fetch_users(token, deadline):
     url = "https://api.gestta.com.br/core/company/user"
     headers = {"Authorization": token, "Accept": "application/json, text/plain, */*"}
     all_users = []
@@ -91,7 +167,9 @@ def get_all_users(token, user_ids=None):
         session = create_session()
         while True:
             params = {"page": page, "limit": 1000}
-            response = session.get(url, headers=headers, params=params)
+            with deadline.stage("catalogo"):
+                response = session.get(url, headers=headers, params=params,
+                                       timeout=deadline.timeout("catalogo", REQUEST_TIMEOUT))
             if response.status_code != 200:
                 if response.status_code == 401:
                     logger.error(f"Token expirado ou inválido ao buscar usuários na página {page}: {response.status_code}")
@@ -107,66 +185,108 @@ def get_all_users(token, user_ids=None):
                 break
             page += 1
             time.sleep(0.5)
-        if user_ids:
-            all_users = [u for u in all_users if u.get("_id") in user_ids]
-        logger.info(f"Total de usuários: {len(all_users)}")
         return all_users
     except Exception as e:
         logger.error(f"Exceção ao buscar usuários: {str(e)}")
         return []
 
-def search_all_customer_tasks(token, customer_ids, company_user_ids, start_date, end_date):
+def search_all_customer_tasks(token, customer_ids, company_user_ids, start_date, end_date, deadline=None, compact=True):
+    """
+    Busca todas as tarefas (paginadas) dos clientes/usuários no período informado.
+
+    Com compact=True (padrão) cada tarefa vira um TaskRecord com apenas os campos usados
+    no processamento; o JSON completo pode ser obtido depois com `TaskRecord.raw()`.
+    Com compact=False retorna os dicionários originais da API.
+    """
+    try:
+        all_tasks = list(iter_customer_tasks(token, customer_ids, company_user_ids, start_date, end_date,
+                                             deadline=deadline, compact=compact))
+        logger.info(f"Total de tarefas coletadas: {len(all_tasks)}")
+        return all_tasks
+    except Exception as e:
+        logger.error(f"Exceção ao buscar tarefas: {str(e)}")
+        return []
+
+def _search_page_docs(session, url, payload, headers, page, deadline):
+    """Tarefas de uma página da pesquisa, decodificadas enquanto a resposta é baixada (nenhuma em caso de erro)."""
+    response = session.post(url, json=payload, headers=headers, stream=True,
+                            timeout=deadline.timeout("busca", REQUEST_TIMEOUT))
+    try:
+        if response.status_code != 200:
+            logger.error(f"Erro na pesquisa na página {page}: {response.status_code} - {response.text}")
+            return
+        yield from iter_json_array_items(response.iter_content(chunk_size=65536), "docs")
+    finally:
+        response.close()
+
+def iter_customer_tasks(token, customer_ids, company_user_ids, start_date, end_date, deadline=None, compact=True,
+                        task_filter=None):
+    """
+    Versão em streaming de search_all_customer_tasks: decodifica o array "docs" item a item
+    enquanto a resposta ainda está sendo baixada e entrega cada tarefa assim que chega.
+
+    Args:
+        customer_ids (list, optional): Empresas pesquisadas. None não filtra; lista vazia não
+            busca nada (shard sem empresas).
+        task_filter (callable, optional): Recebe o dict da tarefa; tarefas recusadas são
+            descartadas antes da projeção em TaskRecord.
+
+    Yields:
+        TaskRecord (ou dict com compact=False) de cada tarefa aceita.
+    """
     url = "https://api.gestta.com.br/core/customer/task/search"
     headers = {
         "Authorization": token,
         "Accept": "application/json, text/plain, */*",
         "Content-Type": "application/json;charset=UTF-8"
     }
+    if customer_ids is not None and not customer_ids:
+        # Lista vazia é uma seleção sem empresas, não "todas as empresas"
+        logger.info("Nenhuma empresa na seleção; busca de tarefas não realizada.")
+        return
     page = 1
     limit = 100000
-    all_tasks = []
-    try:
-        session = create_session()
-        while True:
-            payload = {
-                "status": ["OPEN", "IMPEDIMENT"],
-                "type": ["SERVICE_ORDER", "RECURRENT", "ACCOUNTING"],
-                "company_user": company_user_ids,
-                "start_date": start_date,
-                "end_date": end_date,
-                "date_type": "DUE_DATE",
-                "no_owner": False,
-                "os_workflow": True,
-                "os_free": False,
-                "page": page,
-                "limit": limit
-            }
-            if customer_ids:
-                payload["customer"] = customer_ids
-            response = session.post(url, json=payload, headers=headers)
-            if response.status_code != 200:
-                logger.error(f"Erro na pesquisa na página {page}: {response.status_code} - {response.text}")
-                break
-            data = response.json()
-            docs = data.get("docs", [])
-            logger.info(f"Página {page}: {len(docs)} tarefas retornadas.")
-            if not docs:
-                break
-            all_tasks.extend(docs)
-            page += 1
-            time.sleep(0.5)
-        logger.info(f"Total de tarefas coletadas: {len(all_tasks)}")
-        return all_tasks
-    except Exception as e:
-        logger.error(f"Exceção ao buscar tarefas: {str(e)}")
-        return []
+    deadline = ensure_deadline(deadline)
+    session = create_session()
+    while True:
+        payload = {
+            "status": ["OPEN", "IMPEDIMENT"],
+            "type": ["SERVICE_ORDER", "RECURRENT", "ACCOUNTING"],
+            "company_user": company_user_ids,
+            "start_date": start_date,
+            "end_date": end_date,
+            "date_type": "DUE_DATE",
+            "no_owner": False,
+            "os_workflow": True,
+            "os_free": False,
+            "page": page,
+            "limit": limit
+        }
+        if customer_ids is not None:
+            payload["customer"] = customer_ids
+        page_count = 0
+        # A página inteira (requisição e leitura do corpo em streaming) conta no orçamento da busca,
+        # exceto o tempo em que o consumidor processa cada tarefa entregue
+        for doc in deadline.stage_iter("busca", _search_page_docs(session, url, payload, headers, page, deadline)):
+            page_count += 1
+            deadline.check("busca")
+            if task_filter is not None and not task_filter(doc):
+                continue
+            yield TaskRecord.from_doc(doc) if compact else doc
+        logger.info(f"Página {page}: {page_count} tarefas retornadas.")
+        if not page_count:
+            return
+        page += 1
+        time.sleep(0.5)
 
-def get_task_detail(token, task_id):
+def get_task_detail(token, task_id, deadline=None):
     url = f"https://api.gestta.com.br/core/customer/task/{task_id}"
     headers = {"Authorization": token, "Accept": "application/json, text/plain, */*"}
+    deadline = ensure_deadline(deadline)
     try:
-        session = create_session()
-        response = session.get(url, headers=headers)
+        with deadline.stage("detalhe"):
+            response = hedged_get(create_session, url, "task_detail", headers=headers,
+                                  timeout=deadline.timeout("detalhe", REQUEST_TIMEOUT))
         if response.status_code == 200:
             return response.json()
         else:
@@ -176,7 +296,8 @@ def get_task_detail(token, task_id):
         logger.error(f"Exceção ao buscar detalhe da task {task_id}: {str(e)}")
         return None
 
-def download_document_file(token, task_id, doc_id, customer_id, file_obj, target_folder):
+def download_document_file(token, task_id, doc_id, customer_id, file_obj, target_folder, deadline=None,
+                           modified_at=None):
     file_id = file_obj.get("_id", "")
     file_name = file_obj.get("file_name", f"{file_id}.dat")
     safe_file_name = sanitize_filename(file_name)
@@ -186,6 +307,7 @@ def download_document_file(token, task_id, doc_id, customer_id, file_obj, target
         shortened_name = f"{file_id}{file_extension}"
         local_path = os.path.join(target_folder, shortened_name)
         logger.warning(f"Nome de arquivo muito longo, renomeando para: {shortened_name}")
+    deadline = ensure_deadline(deadline)
     try:
         payload = {
             "customer_task": task_id, 
@@ -200,7 +322,9 @@ def download_document_file(token, task_id, doc_id, customer_id, file_obj, target
             "Content-Type": "application/json;charset=UTF-8"
         }
         session = create_session()
-        resp = session.post(download_url, json=payload, headers=headers)
+        with deadline.stage("download"):
+            resp = session.post(download_url, json=payload, headers=headers,
+                                timeout=deadline.timeout("download", REQUEST_TIMEOUT))
         if resp.status_code == 200:
             try:
                 resp_data = resp.json()
@@ -208,13 +332,18 @@ def download_document_file(token, task_id, doc_id, customer_id, file_obj, target
             except Exception:
                 link = resp.text.strip()
             if link:
-                download_resp = session.get(link, stream=True, timeout=120)
+                with deadline.stage("download"):
+                    download_resp = session.get(link, stream=True, timeout=deadline.timeout("download", 120))
+                    if download_resp.status_code == 200:
+                        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                        with open(local_path, 'wb') as f:
+                            for chunk in get_download_governor().iter_content(download_resp, 8192, deadline):
+                                if chunk:
+                                    f.write(chunk)
+                                deadline.check("download")
                 if download_resp.status_code == 200:
-                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                    with open(local_path, 'wb') as f:
-                        for chunk in download_resp.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
+                    # mtime do envio (e não do download): a cópia para a rede reconhece o arquivo já copiado
+                    set_mtime_from_iso(local_path, modified_at)
                     logger.info(f"Arquivo salvo: {local_path}")
                     return f"Arquivo salvo: {local_path}"
                 else:
@@ -234,7 +363,50 @@ def download_document_file(token, task_id, doc_id, customer_id, file_obj, target
         logger.error(error_msg)
         return error_msg
 
-def send_task_comment(token, task_id, competence="XX/XXXX", customer_id=None, company_department=None):
+def download_task_files(token, job, task_detail, deadline=None):
+    """
+    Baixa individualmente (em paralelo) os arquivos enviados na tarefa, uma subpasta por documento.
+    Alimenta o histórico de downloads (overhead por arquivo e vazão) usado na escolha da estratégia.
+    Retorna o número de arquivos salvos, ou 0 se algum arquivo falhar: nesse caso o que foi baixado
+    é descartado, para a tarefa não ser concluída com documentos faltando.
+    """
+    arquivos = listar_arquivos_tarefa(task_detail)
+    history = get_download_history()
+    
+    def baixar(item):
+        doc, file_obj = item
+        pasta_doc = os.path.join(job["task_folder"], sanitize_filename(truncate_name(doc.get("name", "documento"), 60)))
+        inicio = time.monotonic()
+        resultado = download_document_file(token, job["task_id"], doc.get("_id"), job["customer_id"], file_obj,
+                                           pasta_doc, deadline=deadline,
+                                           modified_at=file_obj.get("created_at") or doc.get("last_upload_date"))
+        decorrido = time.monotonic() - inicio
+        if not resultado.startswith("Arquivo salvo: "):
+            return False
+        tamanho = os.path.getsize(resultado[len("Arquivo salvo: "):])
+        history.record("tamanho_medio_arquivo", tamanho)
+        if tamanho < 256 * 1024:
+            history.record("overhead_arquivo_s", decorrido)
+        elif tamanho > 1024 * 1024:
+            history.record("bytes_por_s", tamanho / decorrido)
+        return True
+    
+    logger.info(f"[DOWNLOAD] Baixando {len(arquivos)} arquivo(s) individualmente para tarefa {job['task_id']}")
+    with ThreadPoolExecutor(max_workers=config_module.PER_FILE_CONCURRENCY) as executor:
+        salvos = sum(1 for ok in executor.map(baixar, arquivos) if ok)
+    if salvos < len(arquivos):
+        logger.warning(f"[DOWNLOAD] {len(arquivos) - salvos} de {len(arquivos)} arquivo(s) da tarefa {job['task_id']} "
+                       f"falharam. Downloads individuais descartados.")
+        for nome in os.listdir(job["task_folder"]):
+            caminho = os.path.join(job["task_folder"], nome)
+            if os.path.isdir(caminho):
+                shutil.rmtree(caminho, ignore_errors=True)
+            else:
+                os.remove(caminho)
+        return 0
+    return salvos
+
+def send_task_comment(token, task_id, competence="XX/XXXX", customer_id=None, company_department=None, deadline=None):
     """
     Envia um comentário para uma tarefa com mensagem fixa, incorporando a competência dinâmica.
     Antes do envio, realiza uma requisição GET para obter o accountable (customer_user) de forma dinâmica.
@@ -246,6 +418,7 @@ def send_task_comment(token, task_id, competence="XX/XXXX", customer_id=None, co
         competence (str, optional): Competência a ser inserida na mensagem. Padrão "XX/XXXX".
         customer_id (str): ID do customer (necessário para buscar o accountable).
         company_department (str): ID do departamento (necessário para buscar o accountable).
+        deadline (RunDeadline, optional): Prazo da execução; as chamadas usam a etapa "comentario".
         
     Returns:
         str: Mensagem informando sucesso ou erro.
@@ -259,6 +432,8 @@ def send_task_comment(token, task_id, competence="XX/XXXX", customer_id=None, co
         logger.error(error_msg)
         return error_msg
     
+    deadline = ensure_deadline(deadline)
+    
     # Chamada GET para obter o accountable (customer_user)
     accountable_url = f"https://api.gestta.com.br/admin/customer/{customer_id}/accountable?company_department={company_department}"
     get_headers = {
@@ -267,7 +442,9 @@ def send_task_comment(token, task_id, competence="XX/XXXX", customer_id=None, co
     }
     try:
         session = create_session()
-        get_response = session.get(accountable_url, headers=get_headers)
+        with deadline.stage("comentario"):
+            get_response = session.get(accountable_url, headers=get_headers,
+                                       timeout=deadline.timeout("comentario", REQUEST_TIMEOUT))
         if get_response.status_code == 200:
             accountable_data = get_response.json()
             if isinstance(accountable_data, list) and len(accountable_data) > 0:
@@ -332,7 +509,9 @@ def send_task_comment(token, task_id, competence="XX/XXXX", customer_id=None, co
     logger.info(f"Enviando comentário para {len(customer_user_ids)} usuário(s)")
     
     try:
-        post_response = session.post(url, json=payload, headers=post_headers)
+        with deadline.stage("comentario"):
+            post_response = session.post(url, json=payload, headers=post_headers,
+                                         timeout=deadline.timeout("comentario", REQUEST_TIMEOUT))
         if post_response.status_code in (200, 201):
             logger.info(f"Comentário enviado com sucesso para {len(customer_user_ids)} usuário(s).")
             return "Comentário enviado com sucesso."
@@ -366,7 +545,7 @@ def tarefa_possui_arquivos(task_detail, verificar_completo=False):
     
     if not req_docs:
         # Se não há documentos solicitados, consideramos completo
-        logger.info("Nenhum documento solicitado encontrado. Considerando tarefa completa.")
+        _documentos_logger.info("Nenhum documento solicitado encontrado. Considerando tarefa completa.")
         return True
     
     # Contar documentos com upload e total de documentos não ignorados
@@ -376,7 +555,7 @@ def tarefa_possui_arquivos(task_detail, verificar_completo=False):
     for doc in req_docs:
         # Ignorar documentos marcados como "disconsidered"
         if doc.get("disconsidered", False):
-            logger.debug(f"Documento '{doc.get('name', 'sem nome')}' está marcado como desconsiderado")
+            _documentos_logger.debug(f"Documento '{doc.get('name', 'sem nome')}' está marcado como desconsiderado")
             continue
         
         docs_validos += 1
@@ -384,30 +563,42 @@ def tarefa_possui_arquivos(task_detail, verificar_completo=False):
         # Verificar se tem last_upload_date
         if "last_upload_date" in doc:
             docs_com_upload += 1
-            logger.debug(f"Documento '{doc.get('name', 'sem nome')}' tem data de upload: {doc.get('last_upload_date')}")
+            _documentos_logger.debug(f"Documento '{doc.get('name', 'sem nome')}' tem data de upload: {doc.get('last_upload_date')}")
         else:
-            logger.debug(f"Documento '{doc.get('name', 'sem nome')}' não tem data de upload")
+            _documentos_logger.debug(f"Documento '{doc.get('name', 'sem nome')}' não tem data de upload")
     
     # Se não há documentos válidos (todos foram desconsiderados), consideramos completo
     if docs_validos == 0:
-        logger.info("Todos os documentos estão marcados como desconsiderados. Considerando tarefa completa.")
+        _documentos_logger.info("Todos os documentos estão marcados como desconsiderados. Considerando tarefa completa.")
         return True
     
     # Verificar se todos os documentos têm upload ou se pelo menos um tem upload
     if verificar_completo:
         resultado = docs_com_upload == docs_validos
-        logger.info(f"Verificação completa: {docs_com_upload}/{docs_validos} documentos com upload. Resultado: {resultado}")
+        _documentos_logger.info(f"Verificação completa: {docs_com_upload}/{docs_validos} documentos com upload. Resultado: {resultado}")
         return resultado
     else:
         resultado = docs_com_upload > 0
-        logger.info(f"Verificação parcial: {docs_com_upload}/{docs_validos} documentos com upload. Resultado: {resultado}")
+        _documentos_logger.info(f"Verificação parcial: {docs_com_upload}/{docs_validos} documentos com upload. Resultado: {resultado}")
         return resultado
 
-def download_all_task_documents(token, task_id, customer_id, target_folder):
+def download_all_task_documents(token, task_id, customer_id, target_folder, deadline=None):
     """
     Baixa todos os documentos de uma tarefa de uma vez só usando o endpoint download/all
     Retorna o caminho do arquivo ZIP baixado ou None em caso de erro
     """
+    download_url = prepare_task_zip(token, task_id, deadline=deadline)
+    if not download_url:
+        return None
+    return download_task_zip(download_url, task_id, target_folder, deadline=deadline)
+
+def prepare_task_zip(token, task_id, deadline=None):
+    """
+    Solicita ao Gestta a preparação do ZIP com todos os documentos da tarefa (download/all)
+    e acompanha o status até ficar pronto.
+    Retorna a URL final do ZIP ou None em caso de erro
+    """
+    deadline = ensure_deadline(deadline)
     try:
         # Passo 1: Obter o document identifier
         url = "https://api.gestta.com.br/accounting/pendency/document/download/all"
@@ -423,175 +614,199 @@ def download_all_task_documents(token, task_id, customer_id, target_folder):
         
         logger.info(f"[DOWNLOAD] Solicitando document identifier para tarefa {task_id}")
         session = create_session()
-        response = session.post(url, json=payload, headers=headers)
+        with deadline.stage("preparo_zip"):
+            response = session.post(url, json=payload, headers=headers,
+                                    timeout=deadline.timeout("preparo_zip", REQUEST_TIMEOUT))
         
-        if response.status_code == 200:
-            try:
-                # Obter o document identifier da resposta
-                resp_data = response.json()
-                document_identifier = resp_data.get("documentIdentifier")
-                
-                if not document_identifier:
-                    logger.error("Document identifier não retornado pela API")
-                    return None
-                
-                logger.info(f"[DOWNLOAD] Document identifier obtido: {document_identifier}")
-                
-                # Passo 2: Fazer a requisição para verificar o status e obter a URL final do download
-                status_url = f"https://api.gestta.com.br/core/customer/task/document/download/{document_identifier}"
-                status_headers = {
-                    "Authorization": token,
-                    "Accept": "application/json, text/plain, */*"
-                }
-                
-                # Polling para verificar quando o ZIP estiver pronto
-                max_attempts = 30  # Máximo de tentativas
-                attempt = 0
-                wait_time = 2  # Tempo inicial de espera em segundos
-                
-                logger.info(f"[DOWNLOAD] Aguardando preparação do arquivo ZIP para tarefa {task_id}...")
-                
-                while attempt < max_attempts:
-                    attempt += 1
-                    status_response = session.get(status_url, headers=status_headers)
+        if response.status_code != 200:
+            logger.error(f"Erro ao solicitar download completo: {response.status_code} - {response.text}")
+            return None
+        
+        # Obter o document identifier da resposta
+        resp_data = response.json()
+        document_identifier = resp_data.get("documentIdentifier")
+        
+        if not document_identifier:
+            logger.error("Document identifier não retornado pela API")
+            return None
+        
+        logger.info(f"[DOWNLOAD] Document identifier obtido: {document_identifier}")
+        
+        # Passo 2: Fazer a requisição para verificar o status e obter a URL final do download
+        status_url = f"https://api.gestta.com.br/core/customer/task/document/download/{document_identifier}"
+        status_headers = {
+            "Authorization": token,
+            "Accept": "application/json, text/plain, */*"
+        }
+        
+        # Polling para verificar quando o ZIP estiver pronto
+        max_attempts = 30  # Máximo de tentativas
+        attempt = 0
+        wait_time = 2  # Tempo inicial de espera em segundos
+        
+        logger.info(f"[DOWNLOAD] Aguardando preparação do arquivo ZIP para tarefa {task_id}...")
+        
+        while attempt < max_attempts:
+            attempt += 1
+            if attempt > 1:
+                api_metrics.registrar_retentativa("download_status")
+            with deadline.stage("preparo_zip"):
+                status_response = hedged_get(create_session, status_url, "download_status",
+                                             headers=status_headers,
+                                             timeout=deadline.timeout("preparo_zip", REQUEST_TIMEOUT))
+            
+            if status_response.status_code == 200:
+                try:
+                    status_data = status_response.json()
+                    status = status_data.get("status")
+                    
+                    if status == "DONE":
+                        # ZIP está pronto, obter a URL
+                        download_url = status_data.get("url")
+                        if not download_url:
+                            logger.error("URL de download não encontrada na resposta")
+                            logger.debug(f"Resposta completa: {status_data}")
+                            return None
+                        
+                        logger.info(f"[DOWNLOAD] ZIP pronto após {attempt} verificações.")
+                        return download_url
                     
-                    if status_response.status_code == 200:
-                        try:
-                            status_data = status_response.json()
-                            status = status_data.get("status")
-                            
-                            if status == "DONE":
-                                # ZIP está pronto, obter a URL
-                                download_url = status_data.get("url")
-                                if not download_url:
-                                    logger.error("URL de download não encontrada na resposta")
-                                    logger.debug(f"Resposta completa: {status_data}")
-                                    return None
-                                
-                                logger.info(f"[DOWNLOAD] ZIP pronto após {attempt} verificações. Baixando...")
-                                
-                                # Garantir que o caminho não tenha espaços no final - correção crítica
-                                target_folder = target_folder.rstrip()
-                                
-                                # Criar um caminho de diretório seguro para o arquivo ZIP
-                                safe_dir = target_folder.replace(" ", "_").rstrip()
-                                
-                                # Garantir que não há caracteres problemáticos no caminho
-                                safe_dir = re.sub(r'[^\w\\:/_-]', '_', safe_dir)
-                                
-                                # Se o safe_dir é diferente do target_folder, criar nova pasta
-                                if safe_dir != target_folder:
-                                    logger.info(f"Usando diretório seguro: {safe_dir} em vez de {target_folder}")
-                                    try:
-                                        os.makedirs(safe_dir, exist_ok=True)
-                                    except Exception as e:
-                                        logger.error(f"Erro ao criar diretório seguro: {e}")
-                                        # Usar diretório temporário como fallback
-                                        safe_dir = os.path.join(os.environ.get('TEMP', 'C:\\Temp'), f"gestta_download_{task_id}")
-                                        os.makedirs(safe_dir, exist_ok=True)
-                                        logger.info(f"Usando diretório temporário: {safe_dir}")
-                                
-                                # Usar um nome de arquivo simples sem espaços ou caracteres especiais
-                                zip_filename = f"task_{task_id}.zip"
-                                
-                                # Criar o caminho completo do arquivo ZIP sem espaços
-                                zip_path = os.path.join(safe_dir, zip_filename)
-                                
-                                # Remover qualquer espaço extra que possa ter surgido
-                                zip_path = zip_path.replace(" ", "_").rstrip()
-                                
-                                # Normalizar o caminho para garantir consistência
-                                zip_path = os.path.abspath(os.path.normpath(zip_path))
-                                
-                                # Criar diretório pai se necessário (evita erro de diretório não encontrado)
-                                os.makedirs(os.path.dirname(zip_path), exist_ok=True)
-                                
-                                # Verificar se o arquivo já existe e removê-lo
-                                if os.path.exists(zip_path):
-                                    try:
-                                        os.remove(zip_path)
-                                        logger.info(f"Arquivo existente removido: {zip_path}")
-                                    except Exception as e:
-                                        logger.error(f"Erro ao remover arquivo existente: {e}")
-                                
-                                # Log detalhado para diagnóstico
-                                logger.info(f"[DOWNLOAD] Caminho final do arquivo ZIP: {zip_path}")
-                                
-                                # Baixar o arquivo
-                                try:
-                                    # Testar a escrita na pasta com um arquivo temporário
-                                    test_file = os.path.join(os.path.dirname(zip_path), "test_write.tmp")
-                                    try:
-                                        with open(test_file, 'w') as f:
-                                            f.write("test")
-                                        os.remove(test_file)
-                                        logger.info(f"Teste de escrita bem-sucedido em: {os.path.dirname(zip_path)}")
-                                    except Exception as e:
-                                        logger.error(f"Teste de escrita falhou: {e}")
-                                        # Tentar diretório temporário como fallback
-                                        temp_dir = os.environ.get('TEMP', 'C:\\Temp')
-                                        zip_path = os.path.join(temp_dir, f"gestta_task_{task_id}.zip")
-                                        logger.info(f"Usando caminho alternativo: {zip_path}")
-                                    
-                                    # Baixar o arquivo
-                                    logger.info(f"[DEBUG] Attempting to download from: {download_url}")
-                                    download_resp = session.get(download_url, stream=True, timeout=3600)
-                                    
-                                    if download_resp.status_code == 200:
-                                        try:
-                                            with open(zip_path, 'wb') as f:
-                                                for chunk in download_resp.iter_content(chunk_size=8192):
-                                                    if chunk:
-                                                        f.write(chunk)
-                                            logger.info(f"[DOWNLOAD] Arquivo ZIP salvo com sucesso em: {zip_path}")
-                                            
-                                            if os.path.exists(zip_path):
-                                                return zip_path
-                                            else:
-                                                logger.error(f"Arquivo ZIP não foi criado apesar de não haver erros: {zip_path}")
-                                                return None
-                                        except Exception as write_error:
-                                            logger.error(f"Erro ao escrever arquivo ZIP: {str(write_error)}")
-                                            return None
-                                    else:
-                                        logger.error(f"Erro ao baixar ZIP completo: {download_resp.status_code}")
-                                        return None
-                                except Exception as download_error:
-                                    logger.error(f"Erro durante o download do arquivo ZIP: {str(download_error)}")
-                                    return None
-                            
-                            elif status == "ERROR":
-                                logger.error("Erro reportado pelo servidor ao preparar o ZIP")
-                                return None
-                            else:
-                                logger.info(f"[DOWNLOAD] Status atual: {status}, aguardando... (tentativa {attempt}/{max_attempts})")
-                                time.sleep(wait_time)
-                                if wait_time < 30:
-                                    wait_time = min(wait_time * 1.5, 30)
-                            
-                        except Exception as e:
-                            logger.error(f"Erro ao processar resposta de status: {str(e)}")
-                            time.sleep(wait_time)
+                    elif status == "ERROR":
+                        logger.error("Erro reportado pelo servidor ao preparar o ZIP")
+                        return None
                     else:
-                        logger.error(f"Erro ao verificar status: {status_response.status_code}")
-                        if status_response.status_code == 404:
-                            logger.info(f"[DOWNLOAD] Endpoint não encontrado, tentativa {attempt}. Aguardando...")
-                        time.sleep(wait_time)
-                
-                logger.error(f"Tempo limite excedido aguardando preparação do ZIP após {max_attempts} tentativas")
-                return None
-            
+                        logger.info(f"[DOWNLOAD] Status atual: {status}, aguardando... (tentativa {attempt}/{max_attempts})")
+                        time.sleep(deadline.timeout("preparo_zip", wait_time))
+                        if wait_time < 30:
+                            wait_time = min(wait_time * 1.5, 30)
+                    
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.error(f"Erro ao processar resposta de status: {str(e)}")
+                    time.sleep(deadline.timeout("preparo_zip", wait_time))
+            else:
+                logger.error(f"Erro ao verificar status: {status_response.status_code}")
+                if status_response.status_code == 404:
+                    logger.info(f"[DOWNLOAD] Endpoint não encontrado, tentativa {attempt}. Aguardando...")
+                time.sleep(deadline.timeout("preparo_zip", wait_time))
+        
+        logger.error(f"Tempo limite excedido aguardando preparação do ZIP após {max_attempts} tentativas")
+        return None
+    except Exception as e:
+        logger.error(f"Exceção ao preparar o ZIP da tarefa {task_id}: {str(e)}")
+        return None
+
+def download_task_zip(download_url, task_id, target_folder, deadline=None):
+    """
+    Baixa o ZIP já preparado pelo Gestta (URL retornada por prepare_task_zip) para target_folder.
+    Retorna o caminho do arquivo ZIP baixado ou None em caso de erro
+    """
+    deadline = ensure_deadline(deadline)
+    try:
+        # Garantir que o caminho não tenha espaços no final - correção crítica
+        target_folder = target_folder.rstrip()
+        
+        # Criar um caminho de diretório seguro para o arquivo ZIP
+        safe_dir = target_folder.replace(" ", "_").rstrip()
+        
+        # Garantir que não há caracteres problemáticos no caminho
+        safe_dir = re.sub(r'[^\w\\:/_-]', '_', safe_dir)
+        
+        # Se o safe_dir é diferente do target_folder, criar nova pasta
+        if safe_dir != target_folder:
+            logger.info(f"Usando diretório seguro: {safe_dir} em vez de {target_folder}")
+            try:
+                os.makedirs(safe_dir, exist_ok=True)
+                get_scratch_manager().track(safe_dir)
             except Exception as e:
-                logger.error(f"Erro ao processar resposta da API: {str(e)}")
+                logger.error(f"Erro ao criar diretório seguro: {e}")
+                # Usar diretório temporário como fallback
+                safe_dir = os.path.join(tempfile.gettempdir(), f"gestta_download_{task_id}")
+                os.makedirs(safe_dir, exist_ok=True)
+                get_scratch_manager().track(safe_dir)
+                logger.info(f"Usando diretório temporário: {safe_dir}")
+        
+        # Usar um nome de arquivo simples sem espaços ou caracteres especiais
+        zip_filename = f"task_{task_id}.zip"
+        
+        # Criar o caminho completo do arquivo ZIP sem espaços
+        zip_path = os.path.join(safe_dir, zip_filename)
+        
+        # Remover qualquer espaço extra que possa ter surgido
+        zip_path = zip_path.replace(" ", "_").rstrip()
+        
+        # Normalizar o caminho para garantir consistência
+        zip_path = os.path.abspath(os.path.normpath(zip_path))
+        
+        # Criar diretório pai se necessário (evita erro de diretório não encontrado)
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        
+        # Verificar se o arquivo já existe e removê-lo
+        if os.path.exists(zip_path):
+            try:
+                os.remove(zip_path)
+                logger.info(f"Arquivo existente removido: {zip_path}")
+            except Exception as e:
+                logger.error(f"Erro ao remover arquivo existente: {e}")
+        
+        # Log detalhado para diagnóstico
+        logger.info(f"[DOWNLOAD] Caminho final do arquivo ZIP: {zip_path}")
+        
+        # Testar a escrita na pasta com um arquivo temporário
+        test_file = os.path.join(os.path.dirname(zip_path), "test_write.tmp")
+        try:
+            with open(test_file, 'w') as f:
+                f.write("test")
+            os.remove(test_file)
+            logger.info(f"Teste de escrita bem-sucedido em: {os.path.dirname(zip_path)}")
+        except Exception as e:
+            logger.error(f"Teste de escrita falhou: {e}")
+            # Tentar diretório temporário como fallback
+            temp_dir = os.path.join(tempfile.gettempdir(), f"gestta_task_{task_id}")
+            os.makedirs(temp_dir, exist_ok=True)
+            get_scratch_manager().track(temp_dir)
+            zip_path = os.path.join(temp_dir, f"task_{task_id}.zip")
+            logger.info(f"Usando caminho alternativo: {zip_path}")
+        
+        # Baixar o arquivo
+        logger.info(f"[DEBUG] Attempting to download from: {download_url}")
+        session = create_session()
+        with deadline.stage("download"):
+            download_resp = session.get(download_url, stream=True,
+                                        timeout=deadline.timeout("download", DOWNLOAD_TIMEOUT))
+        
+        if download_resp.status_code != 200:
+            logger.error(f"Erro ao baixar ZIP completo: {download_resp.status_code}")
+            return None
+        
+        try:
+            with deadline.stage("download"), open(zip_path, 'wb') as f:
+                for chunk in get_download_governor().iter_content(download_resp, 8192, deadline):
+                    if chunk:
+                        f.write(chunk)
+                    deadline.check("download")
+            logger.info(f"[DOWNLOAD] Arquivo ZIP salvo com sucesso em: {zip_path}")
+            
+            if os.path.exists(zip_path):
+                return zip_path
+            else:
+                logger.error(f"Arquivo ZIP não foi criado apesar de não haver erros: {zip_path}")
                 return None
-        else:
-            logger.error(f"Erro ao solicitar download completo: {response.status_code} - {response.text}")
+        except DeadlineExceeded as e:
+            logger.error(f"Download do ZIP da tarefa {task_id} cancelado: {e}")
+            download_resp.close()
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
             return None
-    except Exception as e:
-        logger.error(f"Exceção ao baixar todos os documentos: {str(e)}")
+        except Exception as write_error:
+            logger.error(f"Erro ao escrever arquivo ZIP: {str(write_error)}")
+            return None
+    except Exception as download_error:
+        logger.error(f"Erro durante o download do arquivo ZIP: {str(download_error)}")
         return None
 
-def process_task_documents(token, task_detail, debug_mode=False, download_dir=None):
+def process_task_documents(token, task_detail, debug_mode=False, download_dir=None, deadline=None):
     """
     Processa e baixa documentos relacionados a uma tarefa
     
@@ -600,13 +815,44 @@ def process_task_documents(token, task_detail, debug_mode=False, download_dir=No
         task_detail (dict): Detalhes da tarefa
         debug_mode (bool): Se está em modo debug
         download_dir (str): Diretório específico para download dos arquivos
+        deadline (RunDeadline, optional): Prazo da execução repassado ao download e à extração
         
     Returns:
         int: Número de documentos baixados
     """
+    job = prepare_task_folder(task_detail, download_dir=download_dir)
+    if not job:
+        return 0
+    
+    logger.info(f"[DOWNLOAD] Solicitando download de todos os documentos da tarefa {job['task_id']}")
+    
+    zip_file_path = download_all_task_documents(token, job["task_id"], job["customer_id"], job["task_folder"],
+                                                deadline=deadline)
+    
+    if not zip_file_path:
+        logger.warning(f"Download em lote falhou para tarefa {job['task_id']}. Não há documentos para processar.")
+        get_scratch_manager().release(job["task_folder"], remove=True)
+        return 0
+    
+    final_count = extract_task_folder(job, zip_file_path, deadline=deadline)
+    if not final_count:
+        get_scratch_manager().release(job["task_folder"], remove=True)
+        return 0
+    return move_task_folder(job, final_count)
+
+def prepare_task_folder(task_detail, download_dir=None, expected_bytes=None, deadline=None):
+    """
+    Monta a pasta local de download de uma tarefa e os dados para o destino final na rede.
+    A pasta é entregue pelo gerenciador de staging (scratch), que reserva `expected_bytes`
+    e levanta ScratchFull quando não há espaço (a tarefa deve ser adiada).
+    
+    Returns:
+        dict | None: Dados da tarefa (task_id, customer_id, customer_code, task_folder,
+        path_func, mes_ano, task_name, tipo_destino, politica, pasta_destino) ou None se não houver o que baixar.
+    """
     if not task_detail:
         logger.error("Detalhe da tarefa não fornecido.")
-        return 0
+        return None
     
     task_name = task_detail.get("name", "task_default")
     task_id = task_detail.get("_id", "")
@@ -618,12 +864,14 @@ def process_task_documents(token, task_detail, debug_mode=False, download_dir=No
     
     if not tarefa_possui_arquivos(task_detail):
         logger.warning(f"[SKIP] Tarefa {task_id} ({task_name}) não possui documentos para download.")
-        return 0
+        return None
     
     if "fiscais" in lower_name:
         path_func = monta_caminho_fiscal
+        tipo_destino = "fiscal"
     else:
         path_func = monta_caminho_contabil
+        tipo_destino = "contabil"
         
     if date_field:
         mes_ano = iso_to_mes_ano(date_field)
@@ -636,11 +884,15 @@ def process_task_documents(token, task_detail, debug_mode=False, download_dir=No
     # Criar uma versão ainda mais segura do nome para a pasta
     task_name_very_safe = re.sub(r'[^\w\-]', '_', task_name_safe)   
     
-    # Adicionar timestamp para evitar sobreposição quando há tarefas com mesmo nome
+    # No destino a pasta tem nome estável por tarefa, para que novas execuções e reprocessamentos
+    # sincronizem com os arquivos já copiados; o staging local leva timestamp para não colidir
+    # com pastas retidas de execuções anteriores
+    pasta_destino = f"{task_name_very_safe}_{task_id}" if task_id else task_name_very_safe
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     task_name_with_timestamp = f"{task_name_very_safe}_{timestamp}"
     
-    base_dir = download_dir or DOWNLOAD_BASE_DIR
+    scratch = get_scratch_manager()
+    base_dir = download_dir or scratch.base_dir_for(expected_bytes, DOWNLOAD_BASE_DIR)
     base_dir = base_dir.rstrip()
     
     logger.info(f"Diretório base para download: {base_dir}")
@@ -651,7 +903,7 @@ def process_task_documents(token, task_detail, debug_mode=False, download_dir=No
         
     if not os.access(base_dir, os.W_OK):
         logger.error(f"Sem permissões de escrita no diretório base: {base_dir}")
-        return 0
+        return None
     
     # Usar nome com timestamp para criar a pasta
     task_folder = os.path.normpath(os.path.join(base_dir, task_name_with_timestamp))
@@ -665,28 +917,52 @@ def process_task_documents(token, task_detail, debug_mode=False, download_dir=No
     logger.info(f"Pasta específica para a tarefa: {task_folder}")
     
     try:
-        os.makedirs(task_folder, exist_ok=True)
+        scratch.allocate(task_folder, expected_bytes, deadline=deadline)
         logger.info(f"Pasta para download criada: {task_folder}")
+    except ScratchFull:
+        raise
     except Exception as e:
         logger.error(f"Erro ao criar pasta para download {task_folder}: {e}")
-        return 0
-    
-    logger.info(f"[DOWNLOAD] Solicitando download de todos os documentos da tarefa {task_id}")
-    
-    zip_file_path = download_all_task_documents(token, task_id, customer_id, task_folder)
-    
-    if not zip_file_path:
-        logger.warning(f"Download em lote falhou para tarefa {task_id}. Não há documentos para processar.")
-        return 0
+        return None
     
-    if not os.path.exists(zip_file_path):
+    return {
+        "task_id": task_id,
+        "task_name": task_name,
+        "customer_id": customer_id,
+        "customer_code": customer_code,
+        "task_folder": task_folder,
+        "path_func": path_func,
+        "mes_ano": mes_ano,
+        "tipo_destino": tipo_destino,
+        "politica": DESTINATION_POLICIES.get(tipo_destino, "extrair"),
+        "pasta_destino": pasta_destino,
+    }
+
+def extract_task_folder(job, zip_file_path, deadline=None):
+    """
+    Extrai o ZIP baixado (e arquivos compactados aninhados) na pasta da tarefa.
+    zip_file_path=None indica arquivos baixados individualmente (só os compactados aninhados são extraídos).
+    Com a política "arquivo" do destino, o ZIP é mantido como está e só o manifesto é gerado.
+    Retorna o número de arquivos resultantes (0 em caso de erro). Se a extração estourar os
+    limites da tarefa (zip bomb, arquivos demais), o motivo fica em job["erro_extracao"].
+    """
+    task_id = job["task_id"]
+    task_folder = job["task_folder"]
+    if zip_file_path is not None and not os.path.exists(zip_file_path):
         logger.error(f"Arquivo ZIP não encontrado após download: {zip_file_path}")
         return 0
     
+    if zip_file_path is not None and job.get("politica") == "arquivo":
+        logger.info(f"[DOWNLOAD] Destino {job['tipo_destino']} guarda o arquivo original. ZIP mantido sem extração: {zip_file_path}")
+        total = write_archive_manifest(zip_file_path)
+        if total is not None:
+            return total
+        logger.warning(f"Manifesto indisponível para {zip_file_path}. Extraindo normalmente.")
+    
     logger.info(f"[DOWNLOAD] Iniciando extração de arquivos em: {task_folder}")
     try:
         # A função extract_all_archives vai encontrar o ZIP baixado e quaisquer outros arquivos
-        extract_all_archives(task_folder)
+        extract_all_archives(task_folder, deadline=deadline)
         logger.info(f"[DOWNLOAD] Extração concluída em {task_folder}")
         
         final_count = count_files_in_folder(task_folder)
@@ -696,15 +972,45 @@ def process_task_documents(token, task_detail, debug_mode=False, download_dir=No
             return 0
             
         logger.info(f"[DOWNLOAD] {final_count} arquivos no total para a tarefa {task_id}")
-        
-        destino_base = path_func(customer_code, mes_ano)
+        return final_count
+    except ExtractionLimitExceeded as e:
+        job["erro_extracao"] = str(e)
+        logger.error(f"[EXTRAÇÃO RECUSADA] Tarefa {task_id} ({job['task_name']}): {e}. "
+                     f"Extração interrompida; a tarefa precisa de verificação manual.")
+        return 0
+    except Exception as e:
+        logger.error(f"Erro durante o processo de extração em {task_folder}: {e}")
+        return 0
+
+def resolve_task_destination(job):
+    """
+    Caminho final na rede (contábil ou fiscal) para a pasta da tarefa, ou None se a pasta
+    da empresa não foi encontrada.
+    """
+    destino_base = job["path_func"](job["customer_code"], job["mes_ano"])
+    if not destino_base:
+        logger.warning(f"Caminho de destino não definido para {job['customer_code']}. Pasta não movida.")
+        return None
+    return os.path.normpath(os.path.join(destino_base, job["pasta_destino"]))
+
+def move_task_folder(job, final_count):
+    """
+    Move a pasta extraída da tarefa para o destino na rede (contábil ou fiscal).
+    Retorna o número de arquivos movidos (ou o total local se não houver destino).
+    """
+    task_name = job["task_name"]
+    task_folder = job["task_folder"]
+    customer_code = job["customer_code"]
+    try:
+        destino_base = job["path_func"](customer_code, job["mes_ano"])
         if destino_base:
             try:
                 os.makedirs(destino_base, exist_ok=True)
-                dest_path = os.path.normpath(os.path.join(destino_base, os.path.basename(task_folder)))
+                dest_path = os.path.normpath(os.path.join(destino_base, job["pasta_destino"]))
                 
                 moved_count = safe_move_folder(task_folder, dest_path, DEBUG_MODE)
                 logger.info(f"Arquivos pós-extração para '{task_name}': {moved_count}")
+                get_scratch_manager().release(task_folder)
                 
                 return moved_count
             except Exception as e:
@@ -715,12 +1021,11 @@ def process_task_documents(token, task_detail, debug_mode=False, download_dir=No
             logger.info(f"Arquivos pós-extração para '{task_name}': {final_count}")
             
             return final_count
-            
     except Exception as e:
-        logger.error(f"Erro durante o processo de extração em {task_folder}: {e}")
-        return 0
+        logger.error(f"Erro ao mover pasta {task_folder}: {e}")
+        return final_count
 
-def update_task_status(token, task_id, new_status="DONE"):
+def update_task_status(token, task_id, new_status="DONE", deadline=None):
     """
     Altera o status de uma tarefa para o valor especificado.
     
@@ -728,6 +1033,7 @@ def update_task_status(token, task_id, new_status="DONE"):
         token (str): Token de autenticação.
         task_id (str): ID da tarefa.
         new_status (str, optional): Novo status. Padrão "DONE".
+        deadline (RunDeadline, optional): Prazo da execução; a chamada usa a etapa "status".
         
     Returns:
         str: Mensagem informando sucesso ou erro.
@@ -739,9 +1045,11 @@ def update_task_status(token, task_id, new_status="DONE"):
         "Accept": "application/json, text/plain, */*",
         "Content-Type": "application/json;charset=UTF-8"
     }
+    deadline = ensure_deadline(deadline)
     try:
         session = create_session()
-        response = session.put(url, json=payload, headers=headers)
+        with deadline.stage("status"):
+            response = session.put(url, json=payload, headers=headers, timeout=deadline.timeout("status", REQUEST_TIMEOUT))
         if response.status_code == 200:
             logger.info(f"Status da tarefa {task_id} alterado para '{new_status}' com sucesso.")
             return f"Status da tarefa alterado para '{new_status}' com sucesso."
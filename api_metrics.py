@@ -0,0 +1,196 @@
+# api_metrics.py
+"""
+Métricas por endpoint da API do Gestta, medidas na sessão HTTP (todas as chamadas de api.py e
+http_utils passam por SessaoMedida.send):
+
+- histograma de latência (buckets fixos) e p50/p95 das últimas API_METRICS_WINDOW chamadas;
+- contagem por status HTTP (e por tipo de erro de conexão/timeout);
+- repetições (polling do ZIP, hedges) e bytes enviados/recebidos;
+- log de chamadas lentas: acima de API_SLOW_CALL_SECONDS do endpoint, a chamada vai para o
+  logger GesttaSystem.http_lento e para o histórico consultável por `chamadas_lentas()`.
+
+A latência é o tempo da chamada até a resposta: inclui o corpo nas chamadas normais e só os
+cabeçalhos nas chamadas com stream=True (downloads e busca de tarefas).
+"""
+import math
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+
+import config as config_module
+from logger_config import logger
+
+_lento_logger = logger.getChild("http_lento")
+
+API_HOST = "api.gestta.com.br"
+
+# (endpoint, método, caminho) na ordem de verificação
+ENDPOINTS = [
+    ("login", "POST", re.compile(r"^/core/login$")),
+    ("customer", "GET", re.compile(r"^/core/customer$")),
+    ("company_user", "GET", re.compile(r"^/core/company/user$")),
+    ("task_search", "POST", re.compile(r"^/core/customer/task/search$")),
+    ("download_status", "GET", re.compile(r"^/core/customer/task/document/download/[^/]+$")),
+    ("task_comment", "POST", re.compile(r"^/core/customer/task/[^/]+/history/comment$")),
+    ("task_detail", "GET", re.compile(r"^/core/customer/task/[^/]+$")),
+    ("download_all", "POST", re.compile(r"^/accounting/pendency/document/download/all$")),
+    ("document_download", "POST", re.compile(r"^/accounting/pendency/document/download$")),
+    ("accountable", "GET", re.compile(r"^/admin/customer/[^/]+/accountable$")),
+    ("task_status", "PUT", re.compile(r"^/es/task/[^/]+/status$")),
+]
+
+# Limites superiores dos buckets do histograma (segundos); o último é +inf
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+
+
+def classificar(metodo, url):
+    """Nome do endpoint da chamada. Links fora da API (arquivos do download/all) são "arquivo"."""
+    partes = urlsplit(url)
+    if partes.hostname != API_HOST:
+        return "arquivo"
+    for nome, metodo_endpoint, caminho in ENDPOINTS:
+        if metodo == metodo_endpoint and caminho.match(partes.path):
+            return nome
+    return "outros"
+
+
+def _percentil(valores_ordenados, pct):
+    if not valores_ordenados:
+        return None
+    return valores_ordenados[max(0, math.ceil(pct / 100 * len(valores_ordenados)) - 1)]
+
+
+class ApiMetrics:
+    """Métricas acumuladas por endpoint no processo (zeradas a cada execução, como o hedge_stats)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._lentas = deque(maxlen=config_module.API_SLOW_CALL_HISTORY)
+
+    def _entry(self, endpoint):
+        entry = self._endpoints.get(endpoint)
+        if entry is None:
+            entry = self._endpoints[endpoint] = {
+                "chamadas": 0, "erros": 0, "retentativas": 0, "lentas": 0, "total_s": 0.0, "max_s": 0.0,
+                "bytes_enviados": 0, "bytes_recebidos": 0, "status": {}, "buckets": [0] * len(BUCKETS),
+                "recentes": deque(maxlen=config_module.API_METRICS_WINDOW),
+            }
+        return entry
+
+    def registrar(self, endpoint, segundos, status, bytes_enviados=0, bytes_recebidos=0, url=None):
+        limite = config_module.API_SLOW_CALL_SECONDS.get(endpoint, config_module.API_SLOW_CALL_SECONDS.get("padrao"))
+        lenta = limite is not None and segundos >= limite
+        with self._lock:
+            entry = self._entry(endpoint)
+            entry["chamadas"] += 1
+            entry["total_s"] += segundos
+            entry["max_s"] = max(entry["max_s"], segundos)
+            entry["bytes_enviados"] += bytes_enviados
+            entry["bytes_recebidos"] += bytes_recebidos
+            entry["status"][status] = entry["status"].get(status, 0) + 1
+            if not isinstance(status, int) or status >= 500:
+                entry["erros"] += 1
+            entry["buckets"][next(i for i, limite_bucket in enumerate(BUCKETS) if segundos <= limite_bucket)] += 1
+            entry["recentes"].append(segundos)
+            if lenta:
+                entry["lentas"] += 1
+                self._lentas.append({"quando": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "endpoint": endpoint,
+                                     "segundos": round(segundos, 3), "status": status, "limite_s": limite,
+                                     "url": url.split("?")[0] if url else None})
+        if lenta:
+            _lento_logger.warning(f"[HTTP LENTO] {endpoint}: {segundos:.2f}s (limite {limite}s), status {status}"
+                                  + (f" - {url.split('?')[0]}" if url else ""))
+
+    def registrar_bytes(self, endpoint, bytes_recebidos):
+        """Bytes de um corpo lido em streaming depois que a chamada já foi registrada."""
+        with self._lock:
+            self._entry(endpoint)["bytes_recebidos"] += bytes_recebidos
+
+    def registrar_retentativa(self, endpoint, quantidade=1):
+        with self._lock:
+            self._entry(endpoint)["retentativas"] += quantidade
+
+    def snapshot(self):
+        """Métricas por endpoint: chamadas, erros, status, repetições, bytes, latência e histograma."""
+        with self._lock:
+            copia = {nome: dict(entry, status=dict(entry["status"]), buckets=list(entry["buckets"]),
+                                recentes=sorted(entry["recentes"])) for nome, entry in self._endpoints.items()}
+        resultado = {}
+        for nome, entry in sorted(copia.items()):
+            recentes = entry.pop("recentes")
+            buckets = entry.pop("buckets")
+            entry["media_s"] = round(entry["total_s"] / entry["chamadas"], 3) if entry["chamadas"] else None
+            entry["total_s"] = round(entry["total_s"], 3)
+            entry["max_s"] = round(entry["max_s"], 3)
+            entry["p50_s"] = round(_percentil(recentes, 50), 3) if recentes else None
+            entry["p95_s"] = round(_percentil(recentes, 95), 3) if recentes else None
+            entry["histograma"] = {("+inf" if math.isinf(limite) else f"<={limite}s"): quantidade
+                                   for limite, quantidade in zip(BUCKETS, buckets)}
+            entry["status"] = {str(codigo): quantidade for codigo, quantidade in entry["status"].items()}
+            resultado[nome] = entry
+        return resultado
+
+    def chamadas_lentas(self, limite=50):
+        """Últimas chamadas acima do limite do endpoint (mais recentes primeiro)."""
+        with self._lock:
+            return list(self._lentas)[::-1][:limite]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._lentas.clear()
+
+
+api_metrics = ApiMetrics()
+
+
+def _tamanho_corpo(corpo):
+    if corpo is None:
+        return 0
+    if isinstance(corpo, str):
+        return len(corpo.encode("utf-8"))
+    if isinstance(corpo, (bytes, bytearray)):
+        return len(corpo)
+    return 0
+
+
+def _contar_corpo(response, endpoint):
+    # iter_content é o caminho de leitura de todo o código (inclusive response.content e iter_lines)
+    iter_content = response.iter_content
+
+    def iter_content_medido(*args, **kwargs):
+        for chunk in iter_content(*args, **kwargs):
+            api_metrics.registrar_bytes(endpoint, len(chunk))
+            yield chunk
+
+    response.iter_content = iter_content_medido
+
+
+class SessaoMedida(requests.Session):
+    """Session que registra cada chamada em `api_metrics` (endpoint, latência, status e bytes)."""
+
+    def send(self, request, **kwargs):
+        endpoint = classificar(request.method, request.url)
+        inicio = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception as e:
+            api_metrics.registrar(endpoint, time.monotonic() - inicio, f"erro:{type(e).__name__}",
+                                  bytes_enviados=_tamanho_corpo(request.body), url=request.url)
+            raise
+        if kwargs.get("stream"):
+            # Corpo ainda não lido (a latência é até os cabeçalhos): os bytes são contados à
+            # medida que o corpo é consumido, inclusive em respostas chunked sem Content-Length
+            recebidos = 0
+            _contar_corpo(response, endpoint)
+        else:
+            recebidos = len(response.content or b"")
+        api_metrics.registrar(endpoint, time.monotonic() - inicio, response.status_code,
+                              bytes_enviados=_tamanho_corpo(request.body), bytes_recebidos=recebidos, url=request.url)
+        return response
@@ -3,18 +3,22 @@ from flask import Flask, render_template, request, redirect, url_for, flash, ses
 from werkzeug.middleware.proxy_fix import ProxyFix
 import json
 import os
-import threading
-from config import CONFIG_FILE, DOWNLOAD_BASE_DIR
+from datetime import date
+from config import CONFIG_FILE, DOWNLOAD_BASE_DIR, ensure_runtime_dirs
 from logger_config import logger
 from api import get_token, get_all_companies, get_all_users
-from processing import realizar_processamento, TASK_PHRASES_FILE, load_task_phrases
-import json as _json
-from pathlib import Path
-
-# File used to persist processing status so other worker processes can read it
-STATUS_FILE = Path(__file__).resolve().parent / 'processing_status.json'
-LOGS_DIR = Path(__file__).resolve().parent / 'logs'
+from processing import TASK_PHRASES_FILE, load_task_phrases
+from download_governor import get_download_governor
+from worker_daemon import enviar_comando
+from coordinator import get_coordinator
+import job_queue
+import status_registry
+import event_stream
+import log_index
+import run_history
+import config as config_module
 
+ensure_runtime_dirs()
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app)
 app.secret_key = 'your_secret_key_here'  # Change this to a secure key
@@ -138,76 +142,199 @@ def index():
 def run():
     if 'token' not in session:
         return redirect(url_for('index'))
-    # Start processing in background and expose status via /processing_status
-    global _processing_thread, _processing_status
-    if '_processing_thread' in globals() and _processing_thread is not None and _processing_thread.is_alive():
-        flash('Já existe um processamento em execução.', 'warning')
-        return redirect(url_for('index'))
-
-    # capture date params from query string
+    # Runs are queued (job_queue) and executed by the worker daemon or, without it, by a runner in this process
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    empresas = [e.strip() for e in request.args.getlist('empresa') + (request.args.get('empresas') or '').split(',')
+                if e.strip()] or None
+    dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'on', 'sim')
+    # ?formato=json (the page's "Processar" button) returns the queued job instead of redirecting
+    formato_json = request.args.get('formato') == 'json'
 
-    def run_processing():
+    def recusar(mensagem, categoria, status):
+        if formato_json:
+            from flask import jsonify
+            return jsonify({'error': mensagem}), status
+        flash(mensagem, categoria)
+        return redirect(url_for('index'))
+
+    # Another process (worker, scheduler, manual run or another container) may hold the date's lease
+    ativos = [] if dry_run else get_coordinator().ativos(start_date or date.today().strftime('%Y-%m-%d'))
+    if ativos:
+        return recusar(f'Já existe um processamento desta data em execução ({", ".join(ativos)}).', 'warning', 409)
+
+    resposta = enviar_comando('executar', start_date=start_date, end_date=end_date, empresas=empresas,
+                              dry_run=dry_run, origem='app web')
+    if resposta is None:
         try:
-            global _processing_status
-            _processing_status = {'running': True, 'success': None, 'message': 'Em execução'}
-            # persist immediately so other processes/requests can read it
-            try:
-                STATUS_FILE.write_text(_json.dumps(_processing_status))
-            except Exception:
-                logger.debug('Não foi possível gravar STATUS_FILE')
-            ok = realizar_processamento(start_date=start_date, end_date=end_date)
-            # try to attach the latest summary JSON if available
-            summary = None
-            try:
-                if LOGS_DIR.exists():
-                    files = sorted(LOGS_DIR.glob('last_run_summary_*.json'))
-                    if files:
-                        latest = files[-1]
-                        summary = _json.loads(latest.read_text())
-            except Exception:
-                logger.debug('Erro ao carregar summary')
-            _processing_status = {'running': False, 'success': bool(ok), 'message': 'Concluído' if ok else 'Concluído com erros', 'summary': summary}
-            try:
-                STATUS_FILE.write_text(_json.dumps(_processing_status))
-            except Exception:
-                logger.debug('Não foi possível gravar STATUS_FILE')
-        except Exception as e:
-            logger.error(f"Erro ao executar processamento: {e}")
-            _processing_status = {'running': False, 'success': False, 'message': str(e)}
-            try:
-                STATUS_FILE.write_text(_json.dumps(_processing_status))
-            except Exception:
-                logger.debug('Não foi possível gravar STATUS_FILE')
-
-    _processing_thread = threading.Thread(target=run_processing)
-    _processing_thread.start()
-    _processing_status = {'running': True, 'success': None, 'message': 'Em execução'}
-    try:
-        STATUS_FILE.write_text(_json.dumps(_processing_status))
-    except Exception:
-        logger.debug('Não foi possível gravar STATUS_FILE')
-    flash('Processamento iniciado em background!', 'info')
+            job, novo = job_queue.enfileirar(start_date, end_date, empresas=empresas, dry_run=dry_run,
+                                             origem='app web')
+        except ValueError as e:
+            return recusar(str(e), 'danger', 400)
+        job_queue.get_job_runner().start().notificar()
+    elif not resposta.get('ok'):
+        return recusar(resposta.get('erro') or 'Não foi possível enfileirar o processamento no worker.', 'warning', 409)
+    else:
+        job, novo = resposta['job'], resposta['novo']
+
+    if formato_json:
+        from flask import jsonify
+        return jsonify({'job': job, 'novo': novo})
+
+    if novo:
+        flash(f'Processamento enfileirado (job #{job["id"]}).', 'info')
+    else:
+        flash(f'Um pedido idêntico já está na fila (job #{job["id"]}).', 'warning')
     return redirect(url_for('index'))
 
 
+@app.route('/jobs')
+def jobs():
+    """Jobs da fila de execuções, mais recentes primeiro (?estado=pendente para filtrar)."""
+    from flask import jsonify
+    estados = request.args.getlist('estado') or None
+    limite = request.args.get('limite', 50, type=int)
+    return jsonify(job_queue.listar_jobs(limite=limite, estados=estados))
+
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    from flask import jsonify
+    job = job_queue.obter_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<int:job_id>/cancelar', methods=['POST'])
+def cancel_job(job_id):
+    from flask import jsonify
+    if 'token' not in session:
+        abort(401)
+    if not job_queue.cancelar_job(job_id):
+        return jsonify({'error': 'Só jobs pendentes podem ser cancelados'}), 409
+    return jsonify(job_queue.obter_job(job_id))
+
+
+@app.route('/historico')
+def historico():
+    """Últimas execuções (?n=20) com totais e tempos por etapa; ?simulacoes=1 inclui as simulações."""
+    from flask import jsonify
+    n = max(1, min(request.args.get('n', 20, type=int), 500))
+    return jsonify(run_history.ultimas(n, incluir_simulacoes=request.args.get('simulacoes') == '1'))
+
+
+@app.route('/historico/semanas')
+def historico_semanas():
+    """p50/p95 do tempo de execução por semana (?semanas=12)."""
+    from flask import jsonify
+    return jsonify(run_history.tempo_por_semana(request.args.get('semanas', 12, type=int)))
+
+
+@app.route('/historico/empresas')
+def historico_empresas():
+    """Documentos baixados por empresa por mês (?meses=6, ?empresa=<id ou código>)."""
+    from flask import jsonify
+    return jsonify(run_history.documentos_por_empresa(request.args.get('meses', 6, type=int),
+                                                      empresa=request.args.get('empresa')))
+
+
+@app.route('/historico/exportar')
+def historico_exportar():
+    """Exportação colunar (JSON gzip) do histórico completo."""
+    from flask import send_file
+    if 'token' not in session:
+        abort(401)
+    caminho = run_history.exportar()
+    return send_file(os.path.abspath(caminho), mimetype='application/gzip', as_attachment=True,
+                     download_name=os.path.basename(caminho))
+
+
+@app.route('/metricas/http')
+def metricas_http():
+    """
+    Latência (histograma, p50/p95), status, repetições e bytes por endpoint da API do Gestta na
+    execução mais recente, e as últimas chamadas lentas. Vem do worker daemon quando ele está no ar
+    (é onde as execuções rodam); senão, do próprio processo do app.
+    """
+    from flask import jsonify
+    resposta = enviar_comando('metricas_http')
+    if resposta is None or not resposta.get('ok'):
+        from api_metrics import api_metrics
+        resposta = {'ok': True, 'endpoints': api_metrics.snapshot(), 'lentas': api_metrics.chamadas_lentas()}
+    return jsonify({'endpoints': resposta['endpoints'], 'lentas': resposta['lentas']})
+
+
 @app.route('/processing_status')
 def processing_status():
     # Return a small JSON about current processing state
     from flask import jsonify
-    # Prefer file-backed status if available (works across processes)
-    try:
-        if STATUS_FILE.exists():
-            txt = STATUS_FILE.read_text()
-            try:
-                return jsonify(_json.loads(txt))
-            except Exception:
-                pass
-    except Exception:
-        logger.debug('Erro ao ler STATUS_FILE')
-    status = globals().get('_processing_status', {'running': False, 'success': None, 'message': 'Nenhuma execução'} )
-    return jsonify(status)
+    # Shared registry: the same answer from any WSGI worker, whichever process runs the job
+    return jsonify(status_registry.status_atual())
+
+@app.route('/events')
+def events():
+    """
+    Server-Sent Events com o progresso das execuções (tarefas, downloads, extração, cópia, alertas
+    e progresso periódico do pipeline), lidos do stream compartilhado entre processos.
+    Sem Last-Event-ID, começa pelo status atual e só transmite eventos novos.
+    """
+    from flask import Response, stream_with_context
+    import time
+    desde = request.headers.get('Last-Event-ID') or request.args.get('desde')
+    desde = int(desde) if desde and desde.isdigit() else event_stream.ultimo_id()
+    limite = time.monotonic() + config_module.EVENTS_STREAM_MAX_SECONDS
+
+    def gerar(desde):
+        yield 'retry: 2000\n'
+        yield f"event: status\ndata: {json.dumps(status_registry.status_atual(), default=str)}\n\n"
+        ocioso = time.monotonic()
+        while time.monotonic() < limite:
+            eventos = event_stream.ler(desde)
+            for evento in eventos:
+                desde = evento['id']
+                yield f"id: {desde}\nevent: {evento['tipo']}\ndata: {json.dumps(evento, default=str)}\n\n"
+            if eventos:
+                ocioso = time.monotonic()
+                continue
+            if time.monotonic() - ocioso > 15:
+                # Comentário SSE: mantém a conexão aberta através de proxies
+                yield ': ping\n\n'
+                ocioso = time.monotonic()
+            time.sleep(config_module.EVENTS_POLL_SECONDS)
+
+    return Response(stream_with_context(gerar(desde)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/logs')
+def logs():
+    """
+    Log do sistema sem acesso ao container, lido por seek a partir do índice de offsets:
+    ?tarefa=<task_id> (todas as linhas da tarefa), ?execucao=<id de /processing_status>
+    ou, sem filtro, as últimas ?linhas=N (padrão 200). ?formato=texto devolve text/plain.
+    """
+    from flask import jsonify, Response
+    if 'token' not in session:
+        abort(401)
+    limite = max(1, min(request.args.get('linhas', 200, type=int), 5000))
+    tarefa = request.args.get('tarefa')
+    execucao = request.args.get('execucao')
+    if tarefa:
+        linhas = log_index.linhas_da_tarefa(tarefa, limite=limite)
+    elif execucao:
+        linhas = log_index.linhas_da_execucao(execucao)[-limite:]
+    else:
+        linhas = log_index.tail(limite)
+    if request.args.get('formato') == 'texto':
+        return Response('\n'.join(linhas) + '\n', mimetype='text/plain; charset=utf-8')
+    # Linhas do arquivo em JSON (LOG_JSON) vão como objetos; linhas de texto, como estão
+    registros = []
+    for linha in linhas:
+        try:
+            registros.append(json.loads(linha) if linha.startswith('{') else linha)
+        except ValueError:
+            registros.append(linha)
+    return jsonify({'tarefa': tarefa, 'execucao': execucao, 'linhas': registros})
 
 @app.route('/next_execution')
 def next_execution():
@@ -270,6 +397,38 @@ def settings():
     config = load_config()
     return render_template('settings.html', config=config)
 
+@app.route('/download_limits', methods=['GET', 'POST'])
+def download_limits():
+    """
+    Consulta ou altera (sem reiniciar a execução em andamento) os limites globais de download.
+    Os limites valem no worker daemon quando ele está no ar (é onde as execuções rodam); senão,
+    no próprio processo do app. Ficam salvos no gestta_config.json para as próximas execuções.
+    """
+    from flask import jsonify
+    if 'token' not in session:
+        abort(401)
+    limites = None
+    if request.method == 'POST':
+        data = request.get_json()
+        campos = ("max_bytes_per_s", "max_transfers", "max_inflight_bytes")
+        if not data or not any(campo in data for campo in campos):
+            return jsonify({"error": "Dados inválidos"}), 400
+        try:
+            limites = {campo: int(data[campo]) for campo in campos if campo in data}
+        except (TypeError, ValueError):
+            return jsonify({"error": "Os limites devem ser números inteiros"}), 400
+        config = load_config()
+        config.setdefault('settings', {}).setdefault('download_governor', {}).update(limites)
+        save_config(config)
+    resposta = enviar_comando('limites_download', limites=limites)
+    if resposta is None or not resposta.get('ok'):
+        from download_governor import limites_atuais
+        if limites:
+            get_download_governor().configure(**limites)
+        resposta = limites_atuais()
+    resposta.pop('ok', None)
+    return jsonify(resposta)
+
 @app.route('/save_selection', methods=['POST'])
 def save_selection():
     if 'token' not in session:
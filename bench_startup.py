@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# bench_startup.py - Mede o tempo de importação do caminho headless (execução agendada / CLI)
+"""
+Importa main.py e processing.py (o que uma execução com --start-date carrega) em processos
+novos, numa pasta temporária, e verifica:
+
+- a mediana do tempo de importação contra STARTUP_IMPORT_BUDGET_MS (ou --budget-ms);
+- que GUI e gráficos (PyQt5, gui, matplotlib, dashboard) não foram importados;
+- que a importação não criou arquivos nem pastas (logs/, downloads/).
+
+Sai com código 1 se alguma verificação falhar. Uso: python bench_startup.py [--runs 7] [--budget-ms 1500]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import config
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("PyQt5", "gui", "matplotlib", "dashboard")
+
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {project!r})
+start = time.perf_counter()
+import main
+import processing
+elapsed_ms = (time.perf_counter() - start) * 1000
+heavy = sorted(name for name in sys.modules if name.split(".")[0] in {heavy!r})
+print(json.dumps({{"ms": elapsed_ms, "pesados": heavy}}))
+"""
+
+
+def medir(runs):
+    code = _PROBE.format(project=PROJECT_DIR, heavy=HEAVY_MODULES)
+    tempos = []
+    pesados = set()
+    efeitos = set()
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as cwd:
+            result = subprocess.run([sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise SystemExit(f"Falha ao importar o caminho headless:\n{result.stderr}")
+            dados = json.loads(result.stdout.strip().splitlines()[-1])
+            tempos.append(dados["ms"])
+            pesados.update(dados["pesados"])
+            efeitos.update(os.listdir(cwd))
+    return tempos, sorted(pesados), sorted(efeitos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de inicialização do caminho headless")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=config.STARTUP_IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    tempos, pesados, efeitos = medir(args.runs)
+    mediana = statistics.median(tempos)
+    print(f"Importação headless: mediana {mediana:.0f} ms (mín {min(tempos):.0f}, máx {max(tempos):.0f}, "
+          f"{args.runs} execuções), orçamento {args.budget_ms:.0f} ms")
+
+    falhas = []
+    if mediana > args.budget_ms:
+        falhas.append(f"mediana {mediana:.0f} ms acima do orçamento de {args.budget_ms:.0f} ms")
+    if pesados:
+        falhas.append(f"módulos pesados importados: {', '.join(pesados)}")
+    if efeitos:
+        falhas.append(f"a importação criou arquivos/pastas: {', '.join(efeitos)}")
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    if not falhas:
+        print("OK")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
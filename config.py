@@ -3,13 +3,216 @@ import os
 
 CONFIG_FILE = "gestta_config.json"
 LOGS_DIR = "logs"
-os.makedirs(LOGS_DIR, exist_ok=True)
 
 DOWNLOAD_BASE_DIR = os.path.join(os.getcwd(), "downloads")
-os.makedirs(DOWNLOAD_BASE_DIR, exist_ok=True)
+
+
+def ensure_runtime_dirs():
+    """Cria as pastas de logs e de download. Chamado pelos pontos de entrada, não na importação."""
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    os.makedirs(DOWNLOAD_BASE_DIR, exist_ok=True)
+
 
 DEBUG_MODE = False
 
+# Timeouts padrão por chamada (segundos)
+REQUEST_TIMEOUT = 60
+DOWNLOAD_TIMEOUT = 3600
+EXTRACTION_TIMEOUT = 300
+
+# Extração recursiva: limites por tarefa (todos os níveis somados) e ZIPs aninhados em memória
+EXTRACTION_MAX_DEPTH = 20
+EXTRACTION_MAX_BYTES = 10 * 1024 ** 3
+EXTRACTION_MAX_ENTRIES = 20000
+NESTED_ZIP_MEMORY_MAX_BYTES = 32 * 1024 ** 2
+# Taxa de compressão máxima (expandido/compactado), avaliada a partir de EXTRACTION_RATIO_MIN_BYTES
+EXTRACTION_MAX_RATIO = 200
+EXTRACTION_RATIO_MIN_BYTES = 16 * 1024 ** 2
+EXTRACTION_POLL_INTERVAL = 1.0  # segundos entre verificações do unrar/7z
+# A cada verificação, os bytes vêm do contador de gravação do processo (/proc/<pid>/io, no Linux);
+# a pasta de destino só é percorrida (contagem de arquivos) a cada EXTRACTION_TREE_SCAN_EVERY
+# verificações. Sem esse contador, a pasta é percorrida em toda verificação.
+EXTRACTION_TREE_SCAN_EVERY = 10
+
+# Hedging de GETs idempotentes (detalhe de tarefa e polling do ZIP): desligado por padrão.
+# Ativável em gestta_config.json -> settings.hedge_requests
+HEDGE_REQUESTS = False
+HEDGE_MIN_SAMPLES = 20
+
+# Métricas por endpoint da API (api_metrics.py): janela para p50/p95 e log de chamadas lentas.
+# Limites em segundos por endpoint ("padrao" para os demais; downloads com stream medem até os cabeçalhos)
+API_METRICS_WINDOW = 500
+API_SLOW_CALL_HISTORY = 200
+API_SLOW_CALL_SECONDS = {
+    "padrao": 10,
+    "login": 5,
+    "task_detail": 5,
+    "download_status": 5,
+    "task_search": 30,
+    "download_all": 30,
+    "arquivo": 30,
+}
+
+# Conexões mantidas pela sessão HTTP compartilhada (api.create_session) por host: cobre os workers
+# do pipeline, os pedidos de hedging e os downloads por arquivo em paralelo
+HTTP_POOL_MAXSIZE = 32
+
+# Reaproveitamento de token e catálogos (empresas/usuários) entre execuções; 0 = sempre buscar.
+# O worker daemon usa os valores DAEMON_* abaixo.
+TOKEN_REUSE_SECONDS = 0
+CATALOG_CACHE_SECONDS = 0
+
+# Orçamento de importação do caminho headless (main.py + processing), verificado por bench_startup.py
+STARTUP_IMPORT_BUDGET_MS = 1500
+
+# Worker daemon (worker_daemon.py): execuções agendadas no próprio processo e socket de controle
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 5011
+DAEMON_CRON = {"hour": 8, "minute": 30}
+DAEMON_TOKEN_REUSE_SECONDS = 30 * 60
+DAEMON_CATALOG_CACHE_SECONDS = 6 * 3600
+DAEMON_WARM_INTERVAL_MINUTES = 20
+
+# Banco SQLite de estado compartilhado entre processos (coordenação de execuções)
+STATE_DB_FILE = os.path.join(LOGS_DIR, "gestta_state.db")
+
+# Coordenação entre processos (coordinator.py): cada execução de uma data é dividida em
+# RUN_SHARDS partes de empresas, reivindicadas por lease com heartbeat.
+# RUN_SHARDS pode ser sobrescrito em settings.run_shards ou com --shards
+RUN_SHARDS = 1
+RUN_LEASE_TTL_SECONDS = 120
+RUN_LEASE_HEARTBEAT_SECONDS = 30
+SHARD_MAX_ATTEMPTS = 3
+# Após o fim de uma rodada, novos pedidos da mesma data dentro desse prazo são ignorados
+SHARD_JOIN_WINDOW_SECONDS = 120
+
+# Fila de execuções (job_queue.py): pedidos do app web/worker executados um por vez em cada processo;
+# para paralelismo rode mais processos (RUN_SHARDS divide as empresas entre eles)
+JOB_QUEUE_POLL_SECONDS = 5
+JOB_MAX_RANGE_DAYS = 31
+JOB_MAX_ATTEMPTS = 3
+
+# Registro de status das execuções (status_registry.py), compartilhado entre processos
+STATUS_PROGRESS_SECONDS = 2
+STATUS_STALE_SECONDS = 60  # sem publicar progresso por esse tempo: execução considerada interrompida
+STATUS_HISTORY_SIZE = 500
+
+# Eventos de progresso (event_stream.py) transmitidos por /events (Server-Sent Events)
+EVENTS_FLUSH_SECONDS = 0.5
+EVENTS_HISTORY_SIZE = 20000
+EVENTS_POLL_SECONDS = 0.5
+EVENTS_STREAM_MAX_SECONDS = 300  # o navegador reconecta (Last-Event-ID) ao fim de cada stream
+
+# Índice de offsets do log (log_index.py) e leitura por /logs
+LOG_INDEX_FLUSH_LINES = 200
+LOG_INDEX_FLUSH_SECONDS = 1.0
+LOG_READ_MAX_BYTES = 4 * 1024 ** 2
+
+# Logging em segundo plano (logger_config.py): arquivo em JSON (um registro por linha),
+# rotacionado por tamanho e na virada do dia
+LOG_JSON = True
+LOG_MAX_BYTES = 50 * 1024 ** 2  # 0 = sem rotação por tamanho
+LOG_ROTATE_DAILY = True
+LOG_BACKUP_COUNT = 14
+# Limite por ponto de chamada dos loggers ruidosos: mensagens por minuto e, acima disso, 1 a cada `amostra`
+LOG_RATE_LIMITS = {
+    "GesttaSystem.token": {"por_minuto": 4},
+    "GesttaSystem.documentos": {"por_minuto": 120, "amostra": 50},
+    "GesttaSystem.http_lento": {"por_minuto": 30, "amostra": 20},
+}
+
+# Tracing das execuções (tracing.py): spans por etapa/tarefa gravados em formato Chrome trace
+TRACE_ENABLED = True
+TRACE_DIR = os.path.join(LOGS_DIR, "traces")
+TRACE_KEEP = 30
+TRACE_MAX_SPANS = 200000
+
+# Compartilhamento de rede onde ficam as pastas das empresas e writer em segundo plano
+SHARE_BASE_DIR = "/home/roboestatistica/rede/Acesso Digital"
+SHARE_WRITER_WORKERS = 4
+SHARE_MAX_STREAMS = 2
+SHARE_RETRY_ATTEMPTS = 5
+SHARE_RETRY_MAX_WAIT = 600
+# Cópia para a rede: "mtime" (tamanho + data; com datas diferentes, conteúdo), "hash" (tamanho + SHA-256)
+# ou "completo" (copia tudo)
+SHARE_SYNC_MODE = "mtime"
+
+# Índice da listagem das pastas de empresas na base da rede (evita listar o SMB a cada tarefa)
+FOLDER_INDEX_SECONDS = 300
+FOLDER_INDEX_MISS_REFRESH = 30
+
+# Política por tipo de destino: "extrair" (extrai tudo e copia os arquivos soltos) ou
+# "arquivo" (guarda o ZIP original com um manifesto do conteúdo, sem extrair).
+# O destino fiscal é a pasta "10 - Backup (Winrar)", que só precisa do arquivo compactado.
+DESTINATION_POLICIES = {
+    "contabil": "extrair",
+    "fiscal": "arquivo",
+}
+
+# Escolha entre o ZIP do download/all e downloads individuais por arquivo
+DOWNLOAD_HISTORY_FILE = os.path.join(LOGS_DIR, "download_history.json")
+PER_FILE_CONCURRENCY = 4
+PER_FILE_MAX_FILES = 50
+
+# Limites globais de download (reconfiguráveis em settings.download_governor)
+DOWNLOAD_MAX_BYTES_PER_S = 0  # 0 = sem limite de banda
+DOWNLOAD_MAX_TRANSFERS = 6
+DOWNLOAD_MAX_INFLIGHT_BYTES = 4 * 1024 ** 3
+DOWNLOAD_UNKNOWN_SIZE_BYTES = 200 * 1024 ** 2  # reserva quando o servidor não informa Content-Length
+
+# Staging local (scratch): cota, espaço livre mínimo e limpeza de sobras
+SCRATCH_QUOTA_BYTES = 20 * 1024 ** 3  # 0 = sem cota
+SCRATCH_MIN_FREE_BYTES = 2 * 1024 ** 3
+SCRATCH_DEFAULT_RESERVE_BYTES = 200 * 1024 ** 2
+SCRATCH_ADMISSION_WAIT = 600  # segundos aguardando espaço antes de adiar a tarefa
+SCRATCH_RETENTION_HOURS = 72  # sobras e pastas cuja cópia falhou são removidas após esse prazo
+# Cada processo renova seu registro de staging nesse intervalo; registros sem renovação há mais de
+# SCRATCH_OWNER_TIMEOUT_SECONDS são de processos mortos (vale entre containers que dividem downloads/)
+SCRATCH_HEARTBEAT_SECONDS = 60
+SCRATCH_OWNER_TIMEOUT_SECONDS = 300
+# tmpfs opcional para tarefas pequenas (ex.: "/dev/shm/gestta"); None desativa
+SCRATCH_TMPFS_DIR = None
+SCRATCH_TMPFS_MAX_BYTES = 64 * 1024 ** 2
+SCRATCH_TMPFS_MIN_FREE_BYTES = 256 * 1024 ** 2
+
+# Pipeline de processamento: workers e tamanho da fila de cada etapa.
+# Workers podem ser sobrescritos em gestta_config.json -> settings.pipeline_workers
+PIPELINE_WORKERS = {
+    "busca": 1,
+    "detalhe": 4,
+    "classificar": 1,
+    "preparar_zip": 4,
+    "download": 2,
+    "extrair": 2,
+    "mover": 2,
+    "comentario": 2,
+}
+PIPELINE_QUEUE_SIZES = {
+    "detalhe": 200,
+    "classificar": 50,
+    "preparar_zip": 20,
+    "download": 8,
+    "extrair": 4,
+    "mover": 8,
+    "comentario": 200,
+}
+PIPELINE_LOG_INTERVAL = 30
+
+# Prazo total de uma execução e orçamento acumulado por etapa (segundos).
+# Podem ser sobrescritos em gestta_config.json -> settings.run_deadline_seconds / settings.stage_budgets
+RUN_DEADLINE_SECONDS = 4 * 3600
+STAGE_BUDGETS = {
+    "login": 120,
+    "catalogo": 600,
+    "busca": 900,
+    "detalhe": 1800,
+    "preparo_zip": 3600,
+    "download": 7200,
+    "extracao": 3600,
+    "comentario": 1200,
+    "status": 900,
+}
+
 # Credenciais para API Gestta
 GESTTA_EMAIL = ""
 GESTTA_PASSWORD = ""
@@ -0,0 +1,291 @@
+# coordinator.py
+"""
+Coordenação entre processos das execuções de processamento (app web, worker daemon,
+scheduler, execuções manuais e outros containers que compartilham o banco de estado).
+
+Cada execução de uma data é uma rodada dividida em RUN_SHARDS partes (shards) de empresas.
+Cada shard é um lease no SQLite (state_db): quem o reivindica recebe um prazo (RUN_LEASE_TTL_SECONDS)
+renovado por heartbeat em segundo plano. Um shard cujo dono parou de renovar (processo morto,
+container derrubado) é retomado pelo próximo worker que pedir trabalho. Com RUN_SHARDS = 1 há um
+único shard por rodada, o que impede duas execuções simultâneas da mesma data.
+"""
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+
+import config as config_module
+import state_db
+from logger_config import logger
+
+PENDENTE = "pendente"
+EM_ANDAMENTO = "em_andamento"
+CONCLUIDO = "concluido"
+FALHOU = "falhou"
+
+
+class LeaseLost(Exception):
+    """O lease deixou de pertencer a este processo (expirou e outro worker o retomou)."""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS execucao_shards (
+    execucao TEXT NOT NULL,
+    rodada INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    estado TEXT NOT NULL,
+    dono TEXT,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    iniciado_em REAL,
+    renovado_em REAL,
+    expira_em REAL,
+    concluido_em REAL,
+    erro TEXT,
+    PRIMARY KEY (execucao, rodada, shard)
+);
+"""
+
+
+def chave_execucao(data, empresas=None, dry_run=False):
+    """
+    Chave da execução no coordenador. Execuções restritas a um subconjunto de empresas e
+    simulações têm rodadas próprias: não entram nos shards da execução completa da data (que
+    seriam marcados concluídos com só parte das empresas processadas) nem a bloqueiam.
+    """
+    chave = data
+    if empresas:
+        assinatura = hashlib.sha1(",".join(sorted(set(map(str, empresas)))).encode("utf-8")).hexdigest()[:12]
+        chave += f":empresas:{assinatura}"
+    if dry_run:
+        chave += ":simulacao"
+    return chave
+
+
+def dividir_em_shards(ids, shard, total):
+    """Ids que pertencem ao `shard` de `total` (hash estável: o mesmo id cai no mesmo shard em qualquer processo)."""
+    if total <= 1:
+        return list(ids)
+    return [i for i in ids if int(hashlib.sha1(str(i).encode("utf-8")).hexdigest(), 16) % total == shard]
+
+
+class ShardLease:
+    """
+    Shard reivindicado por este processo. Enquanto ativo, uma thread renova o prazo a cada
+    RUN_LEASE_HEARTBEAT_SECONDS. Como context manager: sai com `complete()` ou, se houver
+    exceção, com `fail()` (o shard volta à fila até SHARD_MAX_ATTEMPTS tentativas).
+
+    Falhas ao renovar (banco ocupado) são repetidas no próximo heartbeat; se o lease for perdido,
+    os callbacks de `ao_perder()` são chamados para interromper o trabalho do shard.
+    """
+
+    def __init__(self, coordinator, execucao, rodada, shard, total, tentativas):
+        self.coordinator = coordinator
+        self.execucao = execucao
+        self.rodada = rodada
+        self.shard = shard
+        self.total = total
+        self.tentativas = tentativas
+        self.ativa = True
+        self.perdida = False
+        self._ao_perder = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, name=f"lease-shard-{shard}", daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f"shard {self.shard + 1}/{self.total} da execução {self.execucao} (rodada {self.rodada})"
+
+    def ao_perder(self, callback):
+        """Registra `callback()`, chamado se o lease for perdido (na hora, se já foi)."""
+        self._ao_perder.append(callback)
+        if self.perdida:
+            callback()
+
+    def check(self):
+        """Levanta LeaseLost se o shard não pertence mais a este processo."""
+        if self.perdida:
+            raise LeaseLost(f"Lease perdido: {self!r}")
+
+    def _heartbeat(self):
+        renovado = time.monotonic()
+        while not self._stop.wait(config_module.RUN_LEASE_HEARTBEAT_SECONDS):
+            try:
+                if self.coordinator._renovar(self):
+                    renovado = time.monotonic()
+                    continue
+                motivo = "retomado por outro worker"
+            except Exception as e:
+                if time.monotonic() - renovado < config_module.RUN_LEASE_TTL_SECONDS:
+                    logger.warning(f"[COORDENADOR] Falha ao renovar {self!r}: {e}. Nova tentativa no próximo heartbeat.")
+                    continue
+                motivo = f"sem renovação há mais de {config_module.RUN_LEASE_TTL_SECONDS}s ({e})"
+            self.perdida = True
+            logger.error(f"[COORDENADOR] Lease perdido: {self!r} {motivo}. Interrompendo o shard.")
+            for callback in self._ao_perder:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"[COORDENADOR] Erro ao interromper {self!r}: {e}", exc_info=True)
+            return
+
+    def _encerrar(self, estado, erro=None):
+        if not self.ativa:
+            return False
+        self.ativa = False
+        self._stop.set()
+        ok = self.coordinator._finalizar(self, estado, erro)
+        if not ok:
+            logger.warning(f"[COORDENADOR] {self!r} não pertencia mais a este processo ao ser finalizado")
+        return ok
+
+    def complete(self):
+        return self._encerrar(CONCLUIDO)
+
+    def fail(self, erro=None):
+        estado = FALHOU if self.tentativas >= config_module.SHARD_MAX_ATTEMPTS else PENDENTE
+        return self._encerrar(estado, erro)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.complete()
+        else:
+            self.fail(str(exc) or exc_type.__name__)
+        return False
+
+
+class RunCoordinator:
+    """Leases de execução/shards no banco de estado compartilhado entre processos."""
+
+    def __init__(self, path=None, dono=None):
+        self.path = path
+        self.dono = dono or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+    def _conn(self):
+        return state_db.ensure_schema("coordinator", SCHEMA, self.path)
+
+    def _criar_rodada(self, conn, execucao, rodada, total):
+        conn.executemany(
+            "INSERT INTO execucao_shards (execucao, rodada, shard, total, estado) VALUES (?, ?, ?, ?, ?)",
+            [(execucao, rodada, shard, total, PENDENTE) for shard in range(total)])
+        logger.info(f"[COORDENADOR] Execução {execucao}: rodada {rodada} criada com {total} shard(s)")
+
+    def claim_shard(self, execucao, total=None, rodada=None):
+        """
+        Reivindica um shard livre (pendente ou com lease expirado) da execução `execucao`.
+
+        Sem `rodada`, entra na rodada em andamento ou, se a última terminou há mais de
+        SHARD_JOIN_WINDOW_SECONDS, inicia uma nova com `total` shards. Com `rodada`, só procura
+        trabalho nela (usado no laço de quem já participa, para não reiniciar a execução).
+        Retorna ShardLease ou None quando não há trabalho disponível.
+        """
+        total = max(1, int(total or config_module.RUN_SHARDS))
+        ttl = config_module.RUN_LEASE_TTL_SECONDS
+        conn = self._conn()
+        with state_db.transaction(conn):
+            now = time.time()
+            if rodada is None:
+                ultima = conn.execute(
+                    "SELECT rodada, MAX(total) AS total, "
+                    "SUM(estado IN (?, ?)) AS abertos, MAX(concluido_em) AS fim "
+                    "FROM execucao_shards WHERE execucao = ? GROUP BY rodada ORDER BY rodada DESC LIMIT 1",
+                    (PENDENTE, EM_ANDAMENTO, execucao)).fetchone()
+                if ultima is None:
+                    rodada = 1
+                    self._criar_rodada(conn, execucao, rodada, total)
+                elif ultima["abertos"]:
+                    rodada = ultima["rodada"]
+                    if ultima["total"] != total:
+                        logger.info(f"[COORDENADOR] Execução {execucao}: participando da rodada {rodada} "
+                                    f"com {ultima['total']} shard(s) (pedido: {total})")
+                elif now - (ultima["fim"] or 0) < config_module.SHARD_JOIN_WINDOW_SECONDS:
+                    logger.warning(f"[COORDENADOR] Execução {execucao}: rodada {ultima['rodada']} terminou há "
+                                   f"{now - ultima['fim']:.0f}s; nova execução ignorada")
+                    return None
+                else:
+                    rodada = ultima["rodada"] + 1
+                    self._criar_rodada(conn, execucao, rodada, total)
+
+            row = conn.execute(
+                "SELECT * FROM execucao_shards WHERE execucao = ? AND rodada = ? "
+                "AND (estado = ? OR (estado = ? AND expira_em < ?)) ORDER BY estado = ?, shard LIMIT 1",
+                (execucao, rodada, PENDENTE, EM_ANDAMENTO, now, EM_ANDAMENTO)).fetchone()
+            if row is None:
+                return None
+            if row["estado"] == EM_ANDAMENTO:
+                logger.warning(f"[COORDENADOR] Retomando shard {row['shard'] + 1}/{row['total']} de {execucao}: "
+                               f"lease de {row['dono']} expirou há {now - row['expira_em']:.0f}s")
+            conn.execute(
+                "UPDATE execucao_shards SET estado = ?, dono = ?, tentativas = tentativas + 1, iniciado_em = ?, "
+                "renovado_em = ?, expira_em = ?, erro = NULL WHERE execucao = ? AND rodada = ? AND shard = ?",
+                (EM_ANDAMENTO, self.dono, now, now, now + ttl, execucao, rodada, row["shard"]))
+        lease = ShardLease(self, execucao, rodada, row["shard"], row["total"], row["tentativas"] + 1)
+        logger.info(f"[COORDENADOR] {lease!r} reivindicado por {self.dono}")
+        return lease
+
+    def _renovar(self, lease):
+        now = time.time()
+        cur = self._conn().execute(
+            "UPDATE execucao_shards SET renovado_em = ?, expira_em = ? "
+            "WHERE execucao = ? AND rodada = ? AND shard = ? AND dono = ? AND estado = ?",
+            (now, now + config_module.RUN_LEASE_TTL_SECONDS, lease.execucao, lease.rodada, lease.shard,
+             self.dono, EM_ANDAMENTO))
+        return cur.rowcount == 1
+
+    def _finalizar(self, lease, estado, erro=None):
+        now = time.time()
+        cur = self._conn().execute(
+            "UPDATE execucao_shards SET estado = ?, concluido_em = ?, erro = ?, "
+            "dono = CASE WHEN ? = ? THEN NULL ELSE dono END, expira_em = NULL "
+            "WHERE execucao = ? AND rodada = ? AND shard = ? AND dono = ? AND estado = ?",
+            (estado, now if estado != PENDENTE else None, erro, estado, PENDENTE,
+             lease.execucao, lease.rodada, lease.shard, self.dono, EM_ANDAMENTO))
+        if cur.rowcount == 1:
+            logger.info(f"[COORDENADOR] {lease!r}: {estado}" + (f" ({erro})" if erro else ""))
+        return cur.rowcount == 1
+
+    def situacao(self, execucao):
+        """Estado da última rodada da execução: shards, donos ativos e quantos faltam."""
+        now = time.time()
+        rows = self._conn().execute(
+            "SELECT * FROM execucao_shards WHERE execucao = ? AND rodada = "
+            "(SELECT MAX(rodada) FROM execucao_shards WHERE execucao = ?) ORDER BY shard",
+            (execucao, execucao)).fetchall()
+        shards = [{
+            "shard": row["shard"],
+            "estado": row["estado"],
+            "dono": row["dono"],
+            "tentativas": row["tentativas"],
+            "expira_em_s": round(row["expira_em"] - now, 1) if row["expira_em"] else None,
+            "erro": row["erro"],
+        } for row in rows]
+        ativos = sorted({s["dono"] for s in shards
+                         if s["estado"] == EM_ANDAMENTO and s["expira_em_s"] is not None and s["expira_em_s"] > 0})
+        return {
+            "execucao": execucao,
+            "rodada": rows[0]["rodada"] if rows else None,
+            "total": rows[0]["total"] if rows else 0,
+            "shards": shards,
+            "ativos": ativos,
+            "pendentes": sum(1 for s in shards if s["estado"] in (PENDENTE, EM_ANDAMENTO)),
+        }
+
+    def ativos(self, execucao):
+        """Donos com lease válido na execução (vazio se ninguém está processando a data)."""
+        return self.situacao(execucao)["ativos"]
+
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_coordinator():
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            _coordinator = RunCoordinator()
+        return _coordinator
@@ -1,8 +1,6 @@
 # dashboard.py
 import os
-import matplotlib.pyplot as plt
 from datetime import datetime
-from matplotlib.gridspec import GridSpec
 from logger_config import logger
 
 def gerar_dashboard_estatisticas(estatisticas):
@@ -10,6 +8,10 @@ def gerar_dashboard_estatisticas(estatisticas):
     Gera um dashboard visual limpo e minimalista com as estatísticas do processamento.
     Usa um design retangular moderno sem círculos.
     """
+    # matplotlib só é carregado quando o dashboard é gerado
+    import matplotlib.pyplot as plt
+    from matplotlib.gridspec import GridSpec
+    
     # Criar pasta para logs e estatísticas se não existir
     logs_dir = "logs"
     os.makedirs(logs_dir, exist_ok=True)
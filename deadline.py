@@ -0,0 +1,186 @@
+# deadline.py
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import config as config_module
+import tracing
+
+_FIM = object()
+
+
+class DeadlineExceeded(Exception):
+    """Orçamento de tempo da execução (ou de uma etapa) esgotado."""
+
+
+class RunDeadline:
+    """
+    Prazo total de uma execução com orçamentos por etapa.
+
+    Cada chamada de rede ou subprocesso pede seu timeout com `timeout(etapa, padrao)`,
+    que nunca ultrapassa o tempo restante da execução nem o da etapa. Quando algum
+    dos dois se esgota a chamada é cancelada com DeadlineExceeded.
+
+    `cancelled` (threading.Event, opcional) permite cancelar a execução de fora, como quando
+    o lease do job ou do shard é perdido.
+    """
+
+    def __init__(self, total_seconds=None, stage_budgets=None, cancelled=None):
+        self.started = time.monotonic()
+        self.total_seconds = total_seconds
+        self.expires_at = self.started + total_seconds if total_seconds else None
+        self.stage_budgets = dict(stage_budgets or {})
+        self._usage = {}
+        self._active = {}
+        self._cancelled = cancelled if cancelled is not None else threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cancelled=None):
+        """Cria o prazo a partir de RUN_DEADLINE_SECONDS e STAGE_BUDGETS do config."""
+        return cls(config_module.RUN_DEADLINE_SECONDS, config_module.STAGE_BUDGETS, cancelled)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """Segundos restantes da execução (None quando não há prazo total)."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_remaining(self, stage):
+        """Segundos restantes do orçamento da etapa (None quando a etapa não tem orçamento)."""
+        budget = self.stage_budgets.get(stage)
+        if not budget:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            used = self._usage.get(stage, {}).get("usado", 0.0)
+            # Chamadas ainda em andamento também consomem o orçamento
+            used += sum(now - started for started in self._active.get(stage, {}).values())
+        return max(0.0, budget - used)
+
+    def check(self, stage=None):
+        """Levanta DeadlineExceeded se a execução (ou a etapa informada) não tiver mais tempo."""
+        if self.cancelled:
+            raise DeadlineExceeded("Execução cancelada")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Prazo da execução esgotado ({self.total_seconds:.0f}s)")
+        if stage:
+            stage_left = self.stage_remaining(stage)
+            if stage_left is not None and stage_left <= 0:
+                self._mark_exhausted(stage)
+                raise DeadlineExceeded(f"Orçamento da etapa '{stage}' esgotado ({self.stage_budgets[stage]:.0f}s)")
+
+    def timeout(self, stage, default):
+        """
+        Timeout a usar em uma chamada da etapa: o menor entre o padrão da chamada,
+        o restante da execução e o restante da etapa.
+        """
+        self.check(stage)
+        limits = [default]
+        for left in (self.remaining(), self.stage_remaining(stage)):
+            if left is not None:
+                limits.append(left)
+        return max(0.001, min(limits))
+
+    @contextmanager
+    def stage(self, name):
+        """Contabiliza o tempo gasto no bloco no orçamento da etapa `name` (e como span no trace da execução)."""
+        start = time.monotonic()
+        key = object()
+        with self._lock:
+            self._active.setdefault(name, {})[key] = start
+        try:
+            with tracing.span(name, "api"):
+                yield self
+        finally:
+            with self._lock:
+                self._active[name].pop(key, None)
+            self._record(name, time.monotonic() - start)
+
+    def stage_iter(self, name, iterable):
+        """
+        Itera `iterable` (uma resposta em streaming) contabilizando como uma chamada da etapa `name`
+        só o tempo gasto produzindo os itens, sem o tempo em que o consumidor fica com cada item.
+        No trace, o span cobre a iteração inteira.
+        """
+        iterator = iter(iterable)
+        total = 0.0
+        try:
+            with tracing.span(name, "api"):
+                while True:
+                    start = time.monotonic()
+                    key = object()
+                    with self._lock:
+                        self._active.setdefault(name, {})[key] = start
+                    try:
+                        item = next(iterator, _FIM)
+                    finally:
+                        elapsed = time.monotonic() - start
+                        total += elapsed
+                        with self._lock:
+                            self._active[name].pop(key, None)
+                            self._entry(name)["usado"] += elapsed
+                    if item is _FIM:
+                        return
+                    yield item
+        finally:
+            with self._lock:
+                entry = self._entry(name)
+                entry["chamadas"] += 1
+                entry["duracoes"].append(total)
+
+    def _entry(self, stage):
+        return self._usage.setdefault(stage, {"usado": 0.0, "chamadas": 0, "duracoes": [], "esgotado": False})
+
+    def _record(self, stage, elapsed):
+        with self._lock:
+            entry = self._entry(stage)
+            entry["usado"] += elapsed
+            entry["chamadas"] += 1
+            entry["duracoes"].append(elapsed)
+
+    def _mark_exhausted(self, stage):
+        with self._lock:
+            self._entry(stage)["esgotado"] = True
+
+    def summary(self):
+        """Uso do orçamento por etapa, para o resumo da execução."""
+        with self._lock:
+            etapas = {}
+            for stage, entry in self._usage.items():
+                duracoes = sorted(entry["duracoes"])
+                etapas[stage] = {
+                    "orcamento_s": self.stage_budgets.get(stage),
+                    "usado_s": round(entry["usado"], 3),
+                    "chamadas": entry["chamadas"],
+                    "p95_s": round(_percentile(duracoes, 95), 3),
+                    "max_s": round(duracoes[-1], 3) if duracoes else 0.0,
+                    "esgotado": entry["esgotado"],
+                }
+        return {
+            "prazo_total_s": self.total_seconds,
+            "decorrido_s": round(time.monotonic() - self.started, 3),
+            "cancelado": self.cancelled,
+            "etapas": etapas,
+        }
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def ensure_deadline(deadline):
+    """Retorna o prazo informado ou um prazo sem limites para chamadas avulsas (GUI, Flask)."""
+    return deadline if deadline is not None else RunDeadline()
@@ -0,0 +1,171 @@
+# download_governor.py
+import threading
+import time
+from contextlib import contextmanager
+
+import config as config_module
+from logger_config import logger
+
+
+class DownloadGovernor:
+    """
+    Limites globais compartilhados por todos os downloads do processo:
+
+    - `max_bytes_per_s`: banda agregada (token bucket; 0 = sem limite);
+    - `max_transfers`: transferências simultâneas;
+    - `max_inflight_bytes`: bytes reservados por transferências em andamento (protege o disco de staging).
+
+    Os limites podem ser trocados com `configure()` durante a execução; quem está aguardando
+    é reavaliado imediatamente.
+    """
+
+    def __init__(self, max_bytes_per_s=None, max_transfers=None, max_inflight_bytes=None):
+        self._cond = threading.Condition()
+        self.max_bytes_per_s = 0
+        self.max_transfers = 1
+        self.max_inflight_bytes = 0
+        self.active = 0
+        self.inflight_bytes = 0
+        self._tokens = 0.0
+        self._last_refill = time.monotonic()
+        self.reset()
+        self.configure(
+            config_module.DOWNLOAD_MAX_BYTES_PER_S if max_bytes_per_s is None else max_bytes_per_s,
+            config_module.DOWNLOAD_MAX_TRANSFERS if max_transfers is None else max_transfers,
+            config_module.DOWNLOAD_MAX_INFLIGHT_BYTES if max_inflight_bytes is None else max_inflight_bytes,
+        )
+
+    def configure(self, max_bytes_per_s=None, max_transfers=None, max_inflight_bytes=None):
+        with self._cond:
+            if max_bytes_per_s is not None:
+                self.max_bytes_per_s = max(0, int(max_bytes_per_s))
+                self._tokens = min(self._tokens, self.max_bytes_per_s)
+            if max_transfers is not None:
+                self.max_transfers = max(1, int(max_transfers))
+            if max_inflight_bytes is not None:
+                self.max_inflight_bytes = max(0, int(max_inflight_bytes))
+            self._cond.notify_all()
+        logger.info(f"[DOWNLOAD] Limites: banda={self.max_bytes_per_s or 'ilimitada'} B/s, "
+                    f"transferências={self.max_transfers}, em trânsito={self.max_inflight_bytes or 'ilimitado'} B")
+
+    def _fits(self, reserve):
+        if self.active >= self.max_transfers:
+            return False
+        if not self.max_inflight_bytes or self.active == 0:
+            # Uma transferência maior que o limite ainda pode rodar sozinha
+            return True
+        return self.inflight_bytes + reserve <= self.max_inflight_bytes
+
+    def acquire(self, expected_bytes=None, deadline=None, stage="download"):
+        """Aguarda vaga para uma transferência e reserva `expected_bytes`. Retorna os bytes reservados."""
+        reserve = int(expected_bytes) if expected_bytes else config_module.DOWNLOAD_UNKNOWN_SIZE_BYTES
+        start = time.monotonic()
+        with self._cond:
+            while not self._fits(reserve):
+                if deadline is not None:
+                    deadline.check(stage)
+                self._cond.wait(timeout=0.5)
+            self.active += 1
+            self.inflight_bytes += reserve
+            self.stats["transferencias"] += 1
+            self.stats["espera_vaga_s"] += time.monotonic() - start
+        return reserve
+
+    def release(self, reserved):
+        with self._cond:
+            self.active -= 1
+            self.inflight_bytes -= reserved
+            self._cond.notify_all()
+
+    def throttle(self, nbytes, deadline=None, stage="download"):
+        """Consome `nbytes` do balde de banda, dormindo o necessário para respeitar o limite."""
+        with self._cond:
+            self.stats["bytes"] += nbytes
+            if not self.max_bytes_per_s:
+                return
+            waited = 0.0
+            while True:
+                now = time.monotonic()
+                rate = self.max_bytes_per_s
+                if not rate:
+                    break
+                # Balde com no máximo 1s de rajada
+                self._tokens = min(rate, self._tokens + (now - self._last_refill) * rate)
+                self._last_refill = now
+                if self._tokens >= min(nbytes, rate):
+                    self._tokens -= nbytes
+                    break
+                pause = (min(nbytes, rate) - self._tokens) / rate
+                if deadline is not None:
+                    deadline.check(stage)
+                self._cond.wait(timeout=min(pause, 0.5))
+                waited += time.monotonic() - now
+            self.stats["espera_banda_s"] += waited
+
+    @contextmanager
+    def transfer(self, expected_bytes=None, deadline=None, stage="download"):
+        reserved = self.acquire(expected_bytes, deadline, stage)
+        try:
+            yield self
+        finally:
+            self.release(reserved)
+
+    def iter_content(self, response, chunk_size=8192, deadline=None, stage="download"):
+        """`response.iter_content` dentro de uma vaga de transferência, com a banda limitada."""
+        length = response.headers.get("Content-Length")
+        expected = int(length) if length and length.isdigit() else None
+        with self.transfer(expected, deadline, stage):
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    self.throttle(len(chunk), deadline, stage)
+                yield chunk
+
+    def reset(self):
+        with self._cond:
+            self.stats = {"transferencias": 0, "bytes": 0, "espera_vaga_s": 0.0, "espera_banda_s": 0.0}
+
+    def snapshot(self):
+        with self._cond:
+            data = dict(self.stats)
+            data.update({
+                "ativas": self.active,
+                "bytes_em_transito": self.inflight_bytes,
+                "espera_vaga_s": round(self.stats["espera_vaga_s"], 3),
+                "espera_banda_s": round(self.stats["espera_banda_s"], 3),
+            })
+            return data
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_download_governor():
+    """Governador compartilhado por todos os caminhos de download do processo."""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = DownloadGovernor()
+        return _governor
+
+
+def aplicar_configuracao(settings):
+    """Aplica os limites de `settings["download_governor"]` (gestta_config.json) ao governador."""
+    limites = settings.get("download_governor") or {}
+    if limites:
+        get_download_governor().configure(
+            limites.get("max_bytes_per_s"),
+            limites.get("max_transfers"),
+            limites.get("max_inflight_bytes"),
+        )
+
+
+def limites_atuais():
+    """Limites em vigor no governador do processo e o estado das transferências."""
+    governor = get_download_governor()
+    return {
+        "max_bytes_per_s": governor.max_bytes_per_s,
+        "max_transfers": governor.max_transfers,
+        "max_inflight_bytes": governor.max_inflight_bytes,
+        "estado": governor.snapshot(),
+    }
@@ -0,0 +1,136 @@
+# download_strategy.py
+import json
+import math
+import os
+import threading
+
+import config as config_module
+from logger_config import logger
+
+ESTRATEGIA_ZIP = "zip"
+ESTRATEGIA_ARQUIVOS = "arquivos"
+
+
+class DownloadHistory:
+    """
+    Médias móveis (EWMA) usadas para estimar o custo de cada estratégia de download:
+    tempo de preparação do ZIP no servidor, overhead por arquivo (pedido do link) e vazão.
+    Persistidas em DOWNLOAD_HISTORY_FILE para valerem entre execuções.
+    """
+
+    DEFAULTS = {
+        "preparo_zip_s": 20.0,
+        "overhead_arquivo_s": 1.5,
+        "bytes_por_s": 2 * 1024 * 1024,
+        "tamanho_medio_arquivo": 512 * 1024,
+    }
+
+    def __init__(self, path=None, alpha=0.2):
+        self.path = path or config_module.DOWNLOAD_HISTORY_FILE
+        self.alpha = alpha
+        self.values = dict(self.DEFAULTS)
+        self.samples = {key: 0 for key in self.DEFAULTS}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.values.update({k: float(v) for k, v in data.get("valores", {}).items() if k in self.DEFAULTS})
+                self.samples.update({k: int(v) for k, v in data.get("amostras", {}).items() if k in self.DEFAULTS})
+        except Exception as e:
+            logger.warning(f"Histórico de downloads ignorado ({self.path}): {e}")
+
+    def save(self):
+        with self._lock:
+            data = {"valores": dict(self.values), "amostras": dict(self.samples)}
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+        except Exception as e:
+            logger.warning(f"Não foi possível salvar histórico de downloads: {e}")
+
+    def record(self, key, value):
+        if value is None or value <= 0:
+            return
+        with self._lock:
+            # As primeiras amostras substituem o padrão mais rapidamente
+            alpha = max(self.alpha, 1.0 / (self.samples[key] + 1))
+            self.values[key] = (1 - alpha) * self.values[key] + alpha * value
+            self.samples[key] += 1
+
+    def get(self, key):
+        with self._lock:
+            return self.values[key]
+
+
+def listar_arquivos_tarefa(task_detail):
+    """
+    Arquivos enviados nos documentos solicitados (ignorando os desconsiderados).
+    Retorna lista de (documento, arquivo).
+    """
+    doc_req = task_detail.get("document_request", {}) or {}
+    arquivos = []
+    for doc in doc_req.get("requested_documents", []):
+        if doc.get("disconsidered", False):
+            continue
+        for file_obj in doc.get("files", []) or []:
+            if file_obj.get("_id"):
+                arquivos.append((doc, file_obj))
+    return arquivos
+
+
+def _tamanho(file_obj, padrao):
+    for key in ("size", "file_size", "length"):
+        value = file_obj.get(key)
+        if isinstance(value, (int, float)) and value > 0:
+            return value
+    return padrao
+
+
+def estimar_bytes(task_detail, history):
+    """Tamanho estimado dos arquivos da tarefa (média histórica quando a API não informa o tamanho)."""
+    tamanho_padrao = history.get("tamanho_medio_arquivo")
+    return sum(_tamanho(file_obj, tamanho_padrao) for _, file_obj in listar_arquivos_tarefa(task_detail))
+
+
+def escolher_estrategia(task_detail, history):
+    """
+    Compara o tempo estimado do ZIP (preparo no servidor + transferência) com o de baixar
+    os arquivos individualmente em paralelo e retorna (estrategia, detalhes).
+    """
+    arquivos = listar_arquivos_tarefa(task_detail)
+    if not arquivos or len(arquivos) > config_module.PER_FILE_MAX_FILES:
+        return ESTRATEGIA_ZIP, {"arquivos": len(arquivos)}
+
+    tamanho_padrao = history.get("tamanho_medio_arquivo")
+    total_bytes = sum(_tamanho(file_obj, tamanho_padrao) for _, file_obj in arquivos)
+    vazao = history.get("bytes_por_s")
+    transferencia = total_bytes / vazao
+
+    custo_zip = history.get("preparo_zip_s") + transferencia
+    rodadas = math.ceil(len(arquivos) / config_module.PER_FILE_CONCURRENCY)
+    custo_arquivos = rodadas * history.get("overhead_arquivo_s") + transferencia
+
+    estrategia = ESTRATEGIA_ARQUIVOS if custo_arquivos < custo_zip else ESTRATEGIA_ZIP
+    detalhes = {
+        "arquivos": len(arquivos),
+        "bytes_estimados": int(total_bytes),
+        "custo_zip_s": round(custo_zip, 2),
+        "custo_arquivos_s": round(custo_arquivos, 2),
+    }
+    return estrategia, detalhes
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_download_history():
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = DownloadHistory()
+        return _history
@@ -0,0 +1,96 @@
+# event_stream.py
+"""
+Eventos de progresso das execuções (tarefa iniciada, download concluído, extraída, movida,
+alertada, progresso do pipeline...), publicados no banco de estado compartilhado para que o
+endpoint /events (Server-Sent Events) de qualquer processo do app web os transmita.
+
+`emitir()` só enfileira em memória; uma thread grava os eventos em lote a cada
+EVENTS_FLUSH_SECONDS, sem bloquear as etapas do pipeline.
+"""
+import json
+import threading
+import time
+
+import config as config_module
+import state_db
+from logger_config import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS eventos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    criado_em REAL NOT NULL,
+    execucao TEXT,
+    job_id INTEGER,
+    tipo TEXT NOT NULL,
+    dados TEXT
+);
+"""
+
+_lock = threading.Lock()
+_pendentes = []
+_contexto = {"execucao": None, "job_id": None}
+_flusher = None
+_gravacoes = 0
+
+
+def _conn():
+    return state_db.ensure_schema("event_stream", SCHEMA)
+
+
+def definir_contexto(execucao=None, job_id=None):
+    """Execução/job aos quais os próximos eventos do processo pertencem."""
+    with _lock:
+        _contexto.update(execucao=execucao, job_id=job_id)
+
+
+def emitir(tipo, **dados):
+    global _flusher
+    with _lock:
+        _pendentes.append((time.time(), _contexto["execucao"], _contexto["job_id"], tipo,
+                           json.dumps(dados, default=str)))
+        if _flusher is None:
+            _flusher = threading.Thread(target=_loop, name="eventos-flush", daemon=True)
+            _flusher.start()
+
+
+def flush():
+    """Grava os eventos pendentes (chamado pela thread e ao fim da execução)."""
+    global _gravacoes
+    with _lock:
+        lote = list(_pendentes)
+        _pendentes.clear()
+    if not lote:
+        return
+    conn = _conn()
+    with state_db.transaction(conn):
+        conn.executemany("INSERT INTO eventos (criado_em, execucao, job_id, tipo, dados) VALUES (?, ?, ?, ?, ?)", lote)
+        _gravacoes += 1
+        if _gravacoes % 100 == 0:
+            conn.execute("DELETE FROM eventos WHERE id <= (SELECT MAX(id) FROM eventos) - ?",
+                         (config_module.EVENTS_HISTORY_SIZE,))
+
+
+def _loop():
+    while True:
+        time.sleep(config_module.EVENTS_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            logger.debug(f"Falha ao gravar eventos: {e}")
+
+
+def ultimo_id():
+    row = _conn().execute("SELECT MAX(id) AS id FROM eventos").fetchone()
+    return row["id"] or 0
+
+
+def ler(desde, limite=200):
+    """Eventos com id maior que `desde`, em ordem."""
+    rows = _conn().execute("SELECT * FROM eventos WHERE id > ? ORDER BY id LIMIT ?", (desde, limite)).fetchall()
+    eventos = []
+    for row in rows:
+        evento = json.loads(row["dados"]) if row["dados"] else {}
+        evento.update(id=row["id"], tipo=row["tipo"], execucao=row["execucao"], job_id=row["job_id"],
+                      criado_em=row["criado_em"])
+        eventos.append(evento)
+    return eventos
@@ -1,8 +1,9 @@
 # file_utils.py
-import os, re, time, zipfile, shutil, subprocess
+import os, re, io, time, zipfile, shutil, subprocess, json, hashlib, threading
 from datetime import datetime
 import config  # Import the entire config module to access its variables
 from logger_config import logger
+from deadline import DeadlineExceeded, ensure_deadline
 
 def sanitize_filename(filename):
     """
@@ -73,6 +74,14 @@ def format_date_only(iso_date):
     except Exception:
         return "Não disponível"
 
+def set_mtime_from_iso(path, iso_date):
+    """Usa a data ISO da API como mtime do arquivo (datas ausentes ou inválidas são ignoradas)."""
+    try:
+        timestamp = datetime.fromisoformat(iso_date.replace("Z", "+00:00")).timestamp()
+        os.utime(path, (timestamp, timestamp))
+    except Exception:
+        pass
+
 def remove_if_empty(folder):
     if os.path.exists(folder) and os.path.isdir(folder):
         if not os.listdir(folder):
@@ -84,56 +93,228 @@ def is_tool_installed(name):
     """Verifica se uma ferramenta de linha de comando está no PATH."""
     return shutil.which(name) is not None
 
-def extract_archive(archive_path, destination_folder):
+# Assinaturas (magic bytes) dos formatos compactados suportados
+ARCHIVE_SIGNATURES = (
+    (b"PK\x03\x04", "zip"),
+    (b"PK\x05\x06", "zip"),  # ZIP vazio
+    (b"PK\x07\x08", "zip"),  # ZIP dividido
+    (b"Rar!\x1a\x07", "rar"),
+    (b"7z\xbc\xaf\x27\x1c", "7z"),
+)
+# Formatos que são ZIP por dentro mas devem ser entregues como estão
+ZIP_CONTAINER_EXTENSIONS = {".docx", ".docm", ".xlsx", ".xlsm", ".pptx", ".odt", ".ods", ".odp",
+                            ".jar", ".apk", ".epub", ".xps"}
+
+def sniff_archive_format(path=None, header=None):
+    """
+    Identifica o formato compactado ("zip", "rar", "7z") pelo cabeçalho do arquivo, não pela extensão.
+    Retorna None para arquivos comuns e documentos Office/OpenDocument (que são ZIPs internamente).
+    """
+    if path is not None and os.path.splitext(path)[1].lower() in ZIP_CONTAINER_EXTENSIONS:
+        return None
+    if header is None:
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(8)
+        except OSError:
+            return None
+    for signature, fmt in ARCHIVE_SIGNATURES:
+        if header.startswith(signature):
+            return fmt
+    return None
+
+class ExtractionLimitExceeded(Exception):
+    """Extração da tarefa ultrapassou o limite de bytes expandidos, de arquivos ou de taxa de compressão."""
+
+class ExtractionBudget:
+    """
+    Limites de uma tarefa para toda a extração recursiva (inclui os compactados aninhados):
+    bytes expandidos, número de arquivos e taxa de compressão (proteção contra zip bombs).
+    Os bytes são contados enquanto são gravados, não pelo tamanho declarado no arquivo.
+    """
+
+    def __init__(self, max_bytes=None, max_entries=None, max_ratio=None):
+        self.max_bytes = config.EXTRACTION_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_entries = config.EXTRACTION_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_ratio = config.EXTRACTION_MAX_RATIO if max_ratio is None else max_ratio
+        self.bytes = 0
+        self.entries = 0
+
+    def check(self, extra_bytes=0, extra_entries=0):
+        """Verifica se o consumo atual somado ao `extra` ainda cabe nos limites."""
+        if self.max_bytes and self.bytes + extra_bytes > self.max_bytes:
+            raise ExtractionLimitExceeded(f"limite de {self.max_bytes} bytes expandidos atingido")
+        if self.max_entries and self.entries + extra_entries > self.max_entries:
+            raise ExtractionLimitExceeded(f"limite de {self.max_entries} arquivos extraídos atingido")
+
+    def check_ratio(self, expanded, compressed, name):
+        """Taxa de compressão suspeita (só avaliada acima de EXTRACTION_RATIO_MIN_BYTES expandidos)."""
+        if not self.max_ratio or expanded < config.EXTRACTION_RATIO_MIN_BYTES:
+            return
+        if expanded > max(compressed, 1) * self.max_ratio:
+            raise ExtractionLimitExceeded(f"taxa de compressão acima de {self.max_ratio}:1 em {name}")
+
+    def consume(self, nbytes, entries=1):
+        self.bytes += nbytes
+        self.entries += entries
+        self.check()
+
+    def precheck_zip(self, zip_ref, archive_size, name):
+        """Recusa antes de extrair um ZIP cujo diretório central já declara mais do que os limites."""
+        members = [info for info in zip_ref.infolist() if not info.is_dir()]
+        declared = sum(info.file_size for info in members)
+        self.check(declared, len(members))
+        self.check_ratio(declared, archive_size, name)
+
+def _member_target(destination_folder, member_name):
+    """Caminho de destino de um membro do ZIP, sem permitir sair da pasta (como ZipFile.extract)."""
+    parts = [sanitize_filename(p) if os.sep == "\\" else p
+             for p in member_name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return os.path.join(destination_folder, *parts) if parts else None
+
+def _set_member_mtime(path, member):
+    # Mantém a data do membro (como unrar/7z): reprocessar gera o mesmo mtime
+    # e a cópia incremental para a rede reconhece o arquivo como inalterado
+    mtime = time.mktime(member.date_time + (0, 0, -1))
+    os.utime(path, (mtime, mtime))
+
+def _extract_zip(zip_ref, destination_folder, deadline, budget, depth=0):
+    """
+    Extrai os membros de um ZipFile. ZIPs aninhados pequenos (até NESTED_ZIP_MEMORY_MAX_BYTES)
+    são abertos direto da memória, sem passar pelo disco.
+    """
+    for member in zip_ref.infolist():
+        deadline.check("extracao")
+        if member.is_dir():
+            continue
+        target = _member_target(destination_folder, member.filename)
+        if target is None:
+            continue
+        budget.consume(0)
+        if member.file_size > config.NESTED_ZIP_MEMORY_MAX_BYTES:
+            _stream_member(zip_ref, member, target, deadline, budget)
+            continue
+        data = zip_ref.read(member)
+        budget.consume(len(data), entries=0)
+        budget.check_ratio(len(data), member.compress_size, member.filename)
+        if (depth < config.EXTRACTION_MAX_DEPTH
+                and sniff_archive_format(target, header=data[:8]) == "zip"):
+            # Pasta com o nome do ZIP aninhado, como na extração em disco
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as nested:
+                    budget.precheck_zip(nested, len(data), member.filename)
+                    _extract_zip(nested, os.path.splitext(target)[0], deadline, budget, depth + 1)
+                continue
+            except zipfile.BadZipFile:
+                logger.warning(f"ZIP aninhado inválido mantido como arquivo: {member.filename}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        _set_member_mtime(target, member)
+
+def _stream_member(zip_ref, member, target, deadline, budget):
+    """Grava um membro grande em blocos, contando os bytes reais no orçamento a cada bloco."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    written = 0
+    with zip_ref.open(member) as src, open(target, 'wb') as dst:
+        for block in iter(lambda: src.read(1024 * 1024), b""):
+            written += len(block)
+            budget.consume(len(block), entries=0)
+            budget.check_ratio(written, member.compress_size, member.filename)
+            deadline.check("extracao")
+            dst.write(block)
+    _set_member_mtime(target, member)
+
+def _count_tree(folder):
+    total_bytes = 0
+    total_files = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            total_files += 1
+            try:
+                total_bytes += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total_bytes, total_files
+
+def _process_written_bytes(pid):
+    """Bytes gravados pelo processo até agora (wchar de /proc/<pid>/io); None fora do Linux."""
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def extract_archive(archive_path, destination_folder, deadline=None, budget=None, fmt=None):
     """
-    Extrai um arquivo compactado usando a ferramenta apropriada baseada na extensão.
-    Suporta .zip, .rar, e .7z.
+    Extrai um arquivo compactado usando a ferramenta apropriada para o formato detectado
+    pelo cabeçalho (zip, rar, 7z). O timeout do subprocesso respeita o orçamento da etapa "extracao".
+    Levanta ExtractionLimitExceeded quando o orçamento de extração (`budget`) se esgota.
     """
     if not os.path.exists(archive_path):
         logger.error(f"Arquivo compactado não encontrado: {archive_path}")
         return False
 
-    file_ext = os.path.splitext(archive_path)[1].lower()
-    os.makedirs(destination_folder, exist_ok=True)
+    deadline = ensure_deadline(deadline)
+    budget = budget if budget is not None else ExtractionBudget()
+    fmt = fmt or sniff_archive_format(archive_path)
     cmd = []
 
-    if file_ext == '.zip':
+    if fmt is None:
+        logger.warning(f"Arquivo não é um formato compactado suportado: {archive_path}")
+        return False
+
+    os.makedirs(destination_folder, exist_ok=True)
+
+    if fmt == 'zip':
         try:
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                zip_ref.extractall(destination_folder)
+            with deadline.stage("extracao"), zipfile.ZipFile(archive_path, 'r') as zip_ref:
+                budget.precheck_zip(zip_ref, os.path.getsize(archive_path), os.path.basename(archive_path))
+                _extract_zip(zip_ref, destination_folder, deadline, budget)
             logger.info(f"Arquivo ZIP extraído com sucesso: {archive_path}")
             os.remove(archive_path)
             return True
         except zipfile.BadZipFile:
             logger.error(f"Arquivo ZIP corrompido: {archive_path}")
             return False
+        except DeadlineExceeded as e:
+            logger.error(f"Extração de {archive_path} cancelada: {e}")
+            return False
+        except ExtractionLimitExceeded:
+            raise
         except Exception as e:
             logger.error(f"Erro ao extrair ZIP {archive_path}: {e}")
             return False
 
-    elif file_ext == '.rar':
+    elif fmt == 'rar':
         if is_tool_installed("unrar"):
             cmd = ["unrar", "x", "-o+", "-y", archive_path, destination_folder]
         else:
             logger.error(f"Comando 'unrar' não encontrado. Instale o pacote 'unrar' para extrair arquivos .rar.")
             return False
 
-    elif file_ext == '.7z':
+    elif fmt == '7z':
         if is_tool_installed("7z"):
             cmd = ["7z", "x", archive_path, f"-o{destination_folder}", "-y"]
         else:
             logger.error(f"Comando '7z' não encontrado. Instale o pacote 'p7zip-full' para extrair arquivos .7z.")
             return False
-    else:
-        logger.warning(f"Formato de arquivo não suportado para extração: {file_ext}")
-        return False
-
     try:
         logger.info(f"Extraindo com comando: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        timeout = deadline.timeout("extracao", config.EXTRACTION_TIMEOUT)
+        # O destino pode já ter conteúdo (pasta com o mesmo nome do compactado, já contada no
+        # orçamento): só conta o que a extração acrescentar
+        baseline = _count_tree(destination_folder)
+        with deadline.stage("extracao"):
+            result = _run_extractor(cmd, archive_path, destination_folder, timeout, deadline, budget, baseline)
         if result.returncode == 0:
             logger.info(f"Arquivo extraído com sucesso: {archive_path}")
             os.remove(archive_path)
+            extracted_bytes, extracted_files = _count_tree(destination_folder)
+            budget.consume(max(0, extracted_bytes - baseline[0]), max(0, extracted_files - baseline[1]))
             return True
         else:
             logger.error(f"Erro ao extrair {archive_path}. Código: {result.returncode}")
@@ -141,21 +322,64 @@ def extract_archive(archive_path, destination_folder):
             logger.error(f"Stdout: {result.stdout}")
             return False
     except subprocess.TimeoutExpired:
-        logger.error(f"Timeout ao extrair {archive_path} - processo cancelado após 5 minutos.")
+        logger.error(f"Timeout ao extrair {archive_path} - processo cancelado após {timeout:.0f} segundos.")
         return False
+    except DeadlineExceeded as e:
+        logger.error(f"Extração de {archive_path} cancelada: {e}")
+        return False
+    except ExtractionLimitExceeded:
+        raise
     except Exception as e:
         logger.error(f"Erro desconhecido ao extrair {archive_path}: {e}")
         return False
 
-def extract_all_archives(folder_path, recursion_level=0, max_recursion=20):
+def _run_extractor(cmd, archive_path, destination_folder, timeout, deadline, budget, baseline=(0, 0)):
+    """
+    Executa unrar/7z acompanhando quanto a extração já gravou (além do `baseline` de bytes e
+    arquivos que o destino já tinha); o processo é encerrado assim que a extração ultrapassa o
+    orçamento da tarefa, o timeout ou o prazo da execução.
+    """
+    archive_size = os.path.getsize(archive_path)
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    polls = 0
+    files = 0
+    try:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=config.EXTRACTION_POLL_INTERVAL)
+                return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                pass
+            if time.monotonic() - started > timeout:
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            deadline.check("extracao")
+            polls += 1
+            expanded = _process_written_bytes(proc.pid)
+            if expanded is None or polls % config.EXTRACTION_TREE_SCAN_EVERY == 0:
+                tree_bytes, tree_files = _count_tree(destination_folder)
+                files = max(0, tree_files - baseline[1])
+                expanded = max(expanded or 0, tree_bytes - baseline[0])
+            budget.check(expanded, files)
+            budget.check_ratio(expanded, archive_size, os.path.basename(archive_path))
+    except BaseException:
+        proc.kill()
+        proc.communicate()
+        raise
+
+def extract_all_archives(folder_path, recursion_level=0, max_recursion=None, deadline=None, budget=None):
     """
-    Extrai recursivamente todos os arquivos compactados em uma pasta.
+    Extrai recursivamente todos os arquivos compactados em uma pasta (detectados pelo cabeçalho).
+    A recursão é limitada por níveis (EXTRACTION_MAX_DEPTH) e pelo orçamento da tarefa (bytes
+    expandidos, arquivos e taxa de compressão) compartilhado por todos os níveis; quando o
+    orçamento estoura, ExtractionLimitExceeded interrompe a extração inteira.
     """
+    max_recursion = config.EXTRACTION_MAX_DEPTH if max_recursion is None else max_recursion
     if recursion_level >= max_recursion:
         logger.warning(f"Extração recursiva interrompida no nível {max_recursion}.")
         return 0
 
-    supported_extensions = [".zip", ".rar", ".7z"]
+    budget = budget if budget is not None else ExtractionBudget()
     extracted_count = 0
     
     logger.info(f"Iniciando extração recursiva no nível {recursion_level}: {folder_path}")
@@ -167,21 +391,57 @@ def extract_all_archives(folder_path, recursion_level=0, max_recursion=20):
             files_to_process.append(os.path.join(root, file))
 
     for file_path in files_to_process:
-        file_lower = file_path.lower()
-        if any(file_lower.endswith(ext) for ext in supported_extensions):
+        fmt = sniff_archive_format(file_path)
+        if fmt:
             file_name_no_ext = os.path.splitext(os.path.basename(file_path))[0]
             extract_dir = os.path.join(os.path.dirname(file_path), file_name_no_ext)
             
-            if extract_archive(file_path, extract_dir):
+            if extract_archive(file_path, extract_dir, deadline=deadline, budget=budget, fmt=fmt):
                 extracted_count += 1
                 # Chama recursivamente para a nova pasta extraída
-                extract_all_archives(extract_dir, recursion_level + 1, max_recursion)
+                extract_all_archives(extract_dir, recursion_level + 1, max_recursion, deadline=deadline, budget=budget)
 
     if extracted_count > 0:
         logger.info(f"Extração recursiva encontrou e processou {extracted_count} arquivos no nível {recursion_level}.")
     
     return extracted_count
 
+def write_archive_manifest(archive_path):
+    """
+    Grava ao lado do ZIP um manifesto (<arquivo>.manifest.json) com o conteúdo lido apenas
+    do diretório central, sem extrair nada.
+    Retorna o número de arquivos listados ou None se o ZIP for inválido.
+    """
+    try:
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            entries = [
+                {
+                    "nome": info.filename,
+                    "tamanho": info.file_size,
+                    "tamanho_compactado": info.compress_size,
+                    "crc32": f"{info.CRC:08x}",
+                    "modificado_em": datetime(*info.date_time).isoformat() if info.date_time[0] >= 1980 else None,
+                }
+                for info in zip_ref.infolist() if not info.is_dir()
+            ]
+    except (zipfile.BadZipFile, OSError) as e:
+        logger.error(f"Não foi possível ler o diretório central de {archive_path}: {e}")
+        return None
+
+    manifest = {
+        "arquivo": os.path.basename(archive_path),
+        "tamanho": os.path.getsize(archive_path),
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "total_arquivos": len(entries),
+        "total_bytes_expandidos": sum(e["tamanho"] for e in entries),
+        "arquivos": entries,
+    }
+    manifest_path = f"{archive_path}.manifest.json"
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f"Manifesto gravado: {manifest_path} ({len(entries)} arquivos)")
+    return len(entries)
+
 def count_files_in_folder(folder):
     """
     Conta arquivos em uma pasta, com informações mais detalhadas para depuração.
@@ -212,9 +472,64 @@ def count_files_in_folder(folder):
         logger.error(f"Erro ao contar arquivos em {folder}: {e}")
         return 0
 
-def safe_move_folder(src_folder, dest_folder, is_debug_mode=False):
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.digest()
+
+def _same_file(src, dest, mode):
+    """
+    Compara origem e destino: tamanho e mtime ("mtime") ou tamanho e conteúdo ("hash").
+    No modo "mtime", arquivos do mesmo tamanho com datas diferentes (baixados de novo sem data
+    de origem, como o ZIP do download/all) ainda são comparados pelo conteúdo antes de copiar.
+    """
+    try:
+        src_stat = os.stat(src)
+        dest_stat = os.stat(dest)
+    except OSError:
+        return False
+    if src_stat.st_size != dest_stat.st_size:
+        return False
+    if mode == "hash":
+        return _file_digest(src) == _file_digest(dest)
+    # Compartilhamentos SMB/FAT guardam mtime com resolução de 2 segundos
+    if abs(src_stat.st_mtime - dest_stat.st_mtime) <= 2:
+        return True
+    return _file_digest(src) == _file_digest(dest)
+
+def sync_folder(src_folder, dest_folder, mode="mtime", report=None):
+    """
+    Copia para dest_folder apenas os arquivos novos ou alterados de src_folder.
+    Com mode="completo" copia tudo (comportamento do copytree).
+    Acumula em `report` arquivos/bytes copiados e ignorados.
+    """
+    report = report if report is not None else {}
+    for key in ("arquivos_copiados", "arquivos_ignorados", "bytes_copiados", "bytes_ignorados"):
+        report.setdefault(key, 0)
+    for root, _, files in os.walk(src_folder):
+        target_root = os.path.join(dest_folder, os.path.relpath(root, src_folder))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            src = os.path.join(root, name)
+            dest = os.path.join(target_root, name)
+            size = os.path.getsize(src)
+            if mode != "completo" and _same_file(src, dest, mode):
+                report["arquivos_ignorados"] += 1
+                report["bytes_ignorados"] += size
+                continue
+            shutil.copy2(src, dest)
+            report["arquivos_copiados"] += 1
+            report["bytes_copiados"] += size
+    return report
+
+def safe_move_folder(src_folder, dest_folder, is_debug_mode=False, raise_errors=False, sync_mode=None, report=None):
     """
     Move arquivos de uma pasta para outra, lidando com erros de acesso.
+    Com raise_errors=True erros de E/S são propagados (para quem quiser tentar de novo).
+    sync_mode (padrão config.SHARE_SYNC_MODE): "mtime" ou "hash" copiam só arquivos novos ou
+    alterados em relação ao destino; "completo" copia tudo. Estatísticas vão para `report`.
     """
     try:
         if not os.path.exists(src_folder):
@@ -229,30 +544,62 @@ def safe_move_folder(src_folder, dest_folder, is_debug_mode=False):
         logger.info(f"Movendo {total_files} arquivos de {src_folder} para {dest_folder}")
         
         try:
-            # Usar copytree e depois rmtree é mais robusto que mover arquivo por arquivo
-            shutil.copytree(src_folder, dest_folder, dirs_exist_ok=True)
+            # Copiar e depois rmtree é mais robusto que mover arquivo por arquivo
+            resumo = sync_folder(src_folder, dest_folder, sync_mode or config.SHARE_SYNC_MODE)
             shutil.rmtree(src_folder)
-            logger.info(f"Pasta movida com sucesso: {src_folder} -> {dest_folder}")
+            if report is not None:
+                for key, value in resumo.items():
+                    report[key] = report.get(key, 0) + value
+            logger.info(f"Pasta movida com sucesso: {src_folder} -> {dest_folder} "
+                        f"({resumo['arquivos_copiados']} copiados, {resumo['arquivos_ignorados']} já existentes, "
+                        f"{resumo['bytes_ignorados']} bytes não transferidos)")
         except Exception as e:
+            if raise_errors:
+                raise
             logger.error(f"Erro ao mover pasta {src_folder} para {dest_folder}: {e}")
             # Retorna o número de arquivos que falharam em ser movidos
             return count_files_in_folder(src_folder)
             
         return total_files
     except Exception as e:
+        if raise_errors:
+            raise
         logger.error(f"Erro em safe_move_folder: {e}")
         return 0
 
+_folder_index = {"base": None, "nomes": [], "lido_em": 0.0}
+_folder_index_lock = threading.Lock()
+
+def empresa_dir_name_for(base, customer_code):
+    """
+    Pasta da empresa (nome começando pelo código) na base da rede, usando um índice da listagem
+    mantido por FOLDER_INDEX_SECONDS; um código não encontrado força nova listagem se o índice
+    tiver mais de FOLDER_INDEX_MISS_REFRESH segundos (empresa recém-criada).
+    """
+    prefix = str(customer_code)
+    with _folder_index_lock:
+        age = time.monotonic() - _folder_index["lido_em"]
+        stale = _folder_index["base"] != base or age > config.FOLDER_INDEX_SECONDS
+        for attempt in range(2):
+            if stale:
+                _folder_index.update(base=base, nomes=sorted(os.listdir(base)), lido_em=time.monotonic())
+                age = 0.0
+            name = next((p for p in _folder_index["nomes"] if p.startswith(prefix)), None)
+            if name is not None or stale or age <= config.FOLDER_INDEX_MISS_REFRESH:
+                return name
+            stale = True
+        return None
+
 def monta_caminho_contabil(customer_code, mes_ano_tuple):
     try:
-        base = "/home/roboestatistica/rede/Acesso Digital"
+        base = config.SHARE_BASE_DIR
         # A busca da pasta da empresa pode falhar se a rede não estiver montada.
         # Adicionar tratamento de erro para isso.
         if not os.path.exists(base):
             logger.error(f"Caminho base da rede não encontrado: {base}")
             return None
         
-        empresa_dir_name = next((p for p in os.listdir(base) if p.startswith(str(customer_code))), None)
+        empresa_dir_name = empresa_dir_name_for(base, customer_code)
         if not empresa_dir_name:
             logger.warning(f"Pasta com código {customer_code} não encontrada em {base}.")
             return None
@@ -269,12 +616,12 @@ def monta_caminho_contabil(customer_code, mes_ano_tuple):
 
 def monta_caminho_fiscal(customer_code, mes_ano_tuple):
     try:
-        base = "/home/roboestatistica/rede/Acesso Digital"
+        base = config.SHARE_BASE_DIR
         if not os.path.exists(base):
             logger.error(f"Caminho base da rede não encontrado: {base}")
             return None
 
-        empresa_dir_name = next((p for p in os.listdir(base) if p.startswith(str(customer_code))), None)
+        empresa_dir_name = empresa_dir_name_for(base, customer_code)
         if not empresa_dir_name:
             logger.warning(f"Pasta com código {customer_code} não encontrada em {base}.")
             return None
@@ -0,0 +1,354 @@
+# http_utils.py
+import codecs
+import json
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import config as config_module
+from logger_config import logger
+from api_metrics import api_metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gestta-http")
+        return _executor
+
+
+class LatencyTracker:
+    """Janela móvel de latências por endpoint, usada para estimar o p95 observado."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, endpoint):
+        with self._lock:
+            return len(self._samples.get(endpoint, ()))
+
+    def percentile(self, endpoint, pct=95):
+        with self._lock:
+            values = sorted(self._samples.get(endpoint, ()))
+        if not values:
+            return None
+        index = max(0, math.ceil(pct / 100 * len(values)) - 1)
+        return values[index]
+
+
+class HedgeStats:
+    """Contadores de hedging por endpoint: requisições, hedges disparados, vitórias e latência economizada."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, endpoint):
+        return self._stats.setdefault(endpoint, {
+            "requisicoes": 0, "hedges": 0, "hedge_venceu": 0, "latencia_economizada_s": 0.0,
+        })
+
+    def add(self, endpoint, field, value=1):
+        with self._lock:
+            self._entry(endpoint)[field] += value
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for endpoint, entry in self._stats.items():
+                data = dict(entry)
+                data["taxa_hedge"] = round(data["hedges"] / data["requisicoes"], 4) if data["requisicoes"] else 0.0
+                data["latencia_economizada_s"] = round(data["latencia_economizada_s"], 3)
+                result[endpoint] = data
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+latency_tracker = LatencyTracker()
+hedge_stats = HedgeStats()
+
+
+def _timed_get(session_factory, url, kwargs):
+    start = time.monotonic()
+    response = session_factory().get(url, **kwargs)
+    return response, time.monotonic() - start
+
+
+def hedged_get(session_factory, url, endpoint, **kwargs):
+    """
+    GET idempotente com hedging opcional (config HEDGE_REQUESTS).
+
+    Se a primeira tentativa não responder dentro do p95 observado do endpoint, uma
+    segunda cópia é enviada e vale a resposta que chegar primeiro. Sem amostras
+    suficientes (HEDGE_MIN_SAMPLES) ou com o hedging desligado, faz um GET simples.
+    """
+    hedge_stats.add(endpoint, "requisicoes")
+    delay = latency_tracker.percentile(endpoint, 95)
+    if (not config_module.HEDGE_REQUESTS or delay is None
+            or latency_tracker.count(endpoint) < config_module.HEDGE_MIN_SAMPLES):
+        response, elapsed = _timed_get(session_factory, url, kwargs)
+        latency_tracker.record(endpoint, elapsed)
+        return response
+
+    start = time.monotonic()
+    executor = _get_executor()
+    primary = executor.submit(_timed_get, session_factory, url, kwargs)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        response, elapsed = primary.result()
+        latency_tracker.record(endpoint, elapsed)
+        return response
+
+    hedge_stats.add(endpoint, "hedges")
+    api_metrics.registrar_retentativa(endpoint)
+    hedge_started = time.monotonic()
+    hedge = executor.submit(_timed_get, session_factory, url, kwargs)
+    # Toda tentativa entra no p95 quando termina, inclusive a que perdeu (senão o p95 só veria as
+    # respostas mais rápidas e cairia a cada hedge, disparando hedges cada vez mais cedo)
+    primary.add_done_callback(lambda f: _record_attempt(endpoint, f, start))
+    hedge.add_done_callback(lambda f: _record_attempt(endpoint, f, hedge_started))
+    pending = {primary, hedge}
+    last_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response, elapsed = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if future is hedge:
+                winner_total = time.monotonic() - start
+                hedge_stats.add(endpoint, "hedge_venceu")
+                primary.add_done_callback(lambda f: _record_saved(endpoint, f, start, winner_total))
+                logger.debug(f"[HEDGE] {endpoint}: cópia respondeu em {elapsed:.2f}s (disparada após {hedge_started - start:.2f}s)")
+            else:
+                hedge.add_done_callback(_close_response)
+            return response
+    raise last_error
+
+
+def _record_attempt(endpoint, future, started):
+    """Registra a latência de uma tentativa do hedge ao terminar; se falhou, o tempo até a falha."""
+    try:
+        _, elapsed = future.result()
+    except Exception:
+        elapsed = time.monotonic() - started
+    latency_tracker.record(endpoint, elapsed)
+
+
+def _record_saved(endpoint, primary_future, start, winner_total):
+    """Quando a tentativa original finalmente termina, contabiliza quanto o hedge economizou."""
+    try:
+        response, _ = primary_future.result()
+        response.close()
+    except Exception:
+        return
+    primary_total = time.monotonic() - start
+    hedge_stats.add(endpoint, "latencia_economizada_s", max(0.0, primary_total - winner_total))
+
+
+def _close_response(future):
+    try:
+        response, _ = future.result()
+        response.close()
+    except Exception:
+        pass
+
+
+class SingleFlight:
+    """
+    Coalesce chamadas concorrentes idênticas: enquanto uma chamada com a mesma chave
+    estiver em andamento, as demais aguardam e recebem o mesmo resultado (ou a mesma exceção).
+    Nada é armazenado depois que a chamada termina.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            logger.debug(f"[SINGLE-FLIGHT] Aguardando chamada em andamento: {key[0]}")
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+single_flight = SingleFlight()
+
+
+class WarmCache:
+    """
+    Valores reaproveitados entre execuções de um processo de longa duração (token, catálogos).
+    Cada leitura informa a validade aceita (`max_age`); com max_age 0 o valor é sempre recarregado.
+    Resultados vazios (falhas) não são guardados.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, max_age, loader, *args, **kwargs):
+        if max_age:
+            with self._lock:
+                entry = self._values.get(key)
+            if entry is not None and time.monotonic() - entry[0] < max_age:
+                return entry[1]
+        value = loader(*args, **kwargs)
+        if value:
+            with self._lock:
+                self._values[key] = (time.monotonic(), value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def age(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+        return None if entry is None else time.monotonic() - entry[0]
+
+
+warm_cache = WarmCache()
+
+
+class _StreamBuffer:
+    """Buffer de texto alimentado por pedaços de bytes, com leitura incremental de JSON."""
+
+    def __init__(self, chunks, encoding="utf-8"):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._json = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def fill(self):
+        """Lê mais um pedaço do stream; retorna False quando o stream terminou."""
+        if self.exhausted:
+            return False
+        if self.pos > 65536:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.text += self._decoder.decode(chunk)
+                return True
+        self.text += self._decoder.decode(b"", final=True)
+        self.exhausted = True
+        return False
+
+    def skip_ws(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.text) or not self.fill():
+                return
+
+    def expect(self, chars):
+        self.skip_ws()
+        if self.pos >= len(self.text):
+            raise ValueError(f"JSON truncado: esperado um de {chars!r}")
+        char = self.text[self.pos]
+        if char not in chars:
+            raise ValueError(f"JSON inválido na posição {self.pos}: esperado {chars!r}, encontrado {char!r}")
+        self.pos += 1
+        return char
+
+    def peek(self):
+        self.skip_ws()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def value(self):
+        """Decodifica o próximo valor JSON completo, lendo mais dados enquanto estiver incompleto."""
+        self.skip_ws()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # Números no fim do buffer podem continuar no próximo pedaço
+            if end == len(self.text) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array_items(chunks, key, metadata=None):
+    """
+    Percorre um objeto JSON recebido em pedaços e produz, um a um, os itens do array `key`
+    (ex.: "docs" do task/search) sem materializar a resposta inteira.
+
+    As demais chaves de primeiro nível são guardadas em `metadata` (se informado).
+    """
+    buf = _StreamBuffer(chunks)
+    buf.expect("{")
+    if buf.peek() == "}":
+        buf.pos += 1
+        return
+    while True:
+        name = buf.value()
+        buf.expect(":")
+        if name == key and buf.peek() == "[":
+            buf.pos += 1
+            if buf.peek() == "]":
+                buf.pos += 1
+            else:
+                while True:
+                    yield buf.value()
+                    if buf.expect(",]") == "]":
+                        break
+        else:
+            item = buf.value()
+            if metadata is not None:
+                metadata[name] = item
+        if buf.expect(",}") == "}":
+            return
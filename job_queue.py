@@ -0,0 +1,317 @@
+# job_queue.py
+"""
+Fila persistente de execuções (banco de estado SQLite, compartilhado entre processos).
+
+O app web e o worker daemon enfileiram pedidos (intervalo de datas, subconjunto de empresas,
+simulação); o runner de cada processo os executa um por vez, dia a dia, com realizar_processamento.
+Pedidos idênticos ainda pendentes não são duplicados. Cada job em execução tem lease renovado por
+heartbeat: se o processo que o executava morrer, o job é retomado por outro runner.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+import config as config_module
+import event_stream
+import state_db
+from logger_config import logger
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+FALHOU = "falhou"
+CANCELADO = "cancelado"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chave TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    empresas TEXT,
+    dry_run INTEGER NOT NULL DEFAULT 0,
+    origem TEXT,
+    estado TEXT NOT NULL,
+    dono TEXT,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    criado_em REAL NOT NULL,
+    iniciado_em REAL,
+    expira_em REAL,
+    concluido_em REAL,
+    resultado TEXT,
+    erro TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_estado ON jobs (estado, id);
+CREATE INDEX IF NOT EXISTS jobs_chave ON jobs (chave, estado);
+"""
+
+
+def _conn():
+    return state_db.ensure_schema("job_queue", SCHEMA)
+
+
+def _dono():
+    from coordinator import get_coordinator
+    return get_coordinator().dono
+
+
+def _validar_datas(start_date, end_date):
+    """Normaliza o intervalo (padrão: hoje). Levanta ValueError com mensagem para o operador."""
+    try:
+        inicio = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else datetime.now().date()
+        fim = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else inicio
+    except ValueError:
+        raise ValueError("Datas devem estar no formato AAAA-MM-DD.")
+    if fim < inicio:
+        raise ValueError("A data final é anterior à data inicial.")
+    if (fim - inicio).days + 1 > config_module.JOB_MAX_RANGE_DAYS:
+        raise ValueError(f"Intervalo maior que {config_module.JOB_MAX_RANGE_DAYS} dias.")
+    return inicio, fim
+
+
+def _como_dict(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["empresas"] = json.loads(job["empresas"]) if job["empresas"] else None
+    job["dry_run"] = bool(job["dry_run"])
+    job["resultado"] = json.loads(job["resultado"]) if job["resultado"] else None
+    for campo in ("criado_em", "iniciado_em", "concluido_em"):
+        if job[campo]:
+            job[campo] = datetime.fromtimestamp(job[campo]).strftime("%Y-%m-%d %H:%M:%S")
+    job.pop("expira_em", None)
+    return job
+
+
+def enfileirar(start_date=None, end_date=None, empresas=None, dry_run=False, origem="app web"):
+    """
+    Enfileira uma execução. Retorna (job, novo): se já houver um pedido idêntico pendente,
+    retorna esse job com `novo=False`.
+    """
+    inicio, fim = _validar_datas(start_date, end_date)
+    empresas = sorted(set(empresas)) if empresas else None
+    chave = json.dumps([inicio.isoformat(), fim.isoformat(), empresas, bool(dry_run)])
+    conn = _conn()
+    with state_db.transaction(conn):
+        row = conn.execute("SELECT * FROM jobs WHERE chave = ? AND estado = ? ORDER BY id LIMIT 1",
+                           (chave, PENDENTE)).fetchone()
+        if row is not None:
+            return _como_dict(row), False
+        cur = conn.execute(
+            "INSERT INTO jobs (chave, start_date, end_date, empresas, dry_run, origem, estado, criado_em) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (chave, inicio.isoformat(), fim.isoformat(), json.dumps(empresas) if empresas else None,
+             int(bool(dry_run)), origem, PENDENTE, time.time()))
+        job_id = cur.lastrowid
+    logger.info(f"[FILA] Job #{job_id} enfileirado ({origem}): {inicio} até {fim}"
+                + (f", {len(empresas)} empresas" if empresas else "") + (", simulação" if dry_run else ""))
+    return obter_job(job_id), True
+
+
+def obter_job(job_id):
+    return _como_dict(_conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def listar_jobs(limite=50, estados=None):
+    """Jobs mais recentes primeiro (opcionalmente só nos `estados` pedidos)."""
+    if estados:
+        marcadores = ", ".join("?" for _ in estados)
+        rows = _conn().execute(f"SELECT * FROM jobs WHERE estado IN ({marcadores}) ORDER BY id DESC LIMIT ?",
+                               (*estados, limite)).fetchall()
+    else:
+        rows = _conn().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limite,)).fetchall()
+    return [_como_dict(row) for row in rows]
+
+
+def cancelar_job(job_id):
+    """Cancela um job ainda pendente. Retorna False se ele já começou ou não existe."""
+    cur = _conn().execute("UPDATE jobs SET estado = ?, concluido_em = ? WHERE id = ? AND estado = ?",
+                          (CANCELADO, time.time(), job_id, PENDENTE))
+    if cur.rowcount:
+        logger.info(f"[FILA] Job #{job_id} cancelado")
+    return cur.rowcount == 1
+
+
+def _reivindicar(dono):
+    """Pega o job pendente mais antigo (ou um em execução cujo lease expirou)."""
+    conn = _conn()
+    with state_db.transaction(conn):
+        now = time.time()
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE estado = ? OR (estado = ? AND expira_em < ?) ORDER BY id LIMIT 1",
+            (PENDENTE, EXECUTANDO, now)).fetchone()
+        if row is None:
+            return None
+        if row["estado"] == EXECUTANDO:
+            if row["tentativas"] >= config_module.JOB_MAX_ATTEMPTS:
+                conn.execute("UPDATE jobs SET estado = ?, concluido_em = ?, expira_em = NULL, erro = ? WHERE id = ?",
+                             (FALHOU, now, f"abandonado após {row['tentativas']} tentativas", row["id"]))
+                logger.error(f"[FILA] Job #{row['id']} abandonado após {row['tentativas']} tentativas")
+                return None
+            logger.warning(f"[FILA] Retomando job #{row['id']}: lease de {row['dono']} expirou")
+        conn.execute("UPDATE jobs SET estado = ?, dono = ?, tentativas = tentativas + 1, iniciado_em = ?, "
+                     "expira_em = ? WHERE id = ?",
+                     (EXECUTANDO, dono, now, now + config_module.RUN_LEASE_TTL_SECONDS, row["id"]))
+    return obter_job(row["id"])
+
+
+def _renovar(job_id, dono, resultado=None):
+    campos, valores = "expira_em = ?", [time.time() + config_module.RUN_LEASE_TTL_SECONDS]
+    if resultado is not None:
+        campos += ", resultado = ?"
+        valores.append(json.dumps(resultado, default=str))
+    cur = _conn().execute(f"UPDATE jobs SET {campos} WHERE id = ? AND dono = ? AND estado = ?",
+                          (*valores, job_id, dono, EXECUTANDO))
+    return cur.rowcount == 1
+
+
+def _finalizar(job_id, dono, estado, resultado=None, erro=None):
+    cur = _conn().execute(
+        "UPDATE jobs SET estado = ?, concluido_em = ?, expira_em = NULL, resultado = ?, erro = ? "
+        "WHERE id = ? AND dono = ? AND estado = ?",
+        (estado, time.time(), json.dumps(resultado, default=str) if resultado is not None else None, erro,
+         job_id, dono, EXECUTANDO))
+    return cur.rowcount == 1
+
+
+class JobRunner:
+    """
+    Thread que consome a fila. `ao_mudar(job)` é chamado quando um job começa e termina
+    (usado para publicar o status da execução).
+
+    Um job por processo: estatísticas, trace, contexto SSE, índice de log e métricas HTTP da
+    execução são globais do processo, e jobs simultâneos sobrescreveriam uns aos outros. Para
+    executar jobs em paralelo, rode mais processos (worker daemons, containers): eles dividem a
+    fila e os shards pelo banco de estado.
+    """
+
+    def __init__(self, ao_mudar=None, shards=None):
+        self.ao_mudar = ao_mudar
+        self.shards = shards
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.em_execucao = {}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+            self._thread.start()
+        logger.info("[FILA] Runner iniciado")
+        return self
+
+    def stop(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def notificar(self):
+        """Acorda o runner (job recém-enfileirado neste processo)."""
+        self._acordar.set()
+
+    def _notificar_mudanca(self, job):
+        if self.ao_mudar is not None:
+            try:
+                self.ao_mudar(job)
+            except Exception as e:
+                logger.debug(f"Falha ao publicar mudança do job #{job['id']}: {e}")
+
+    def _loop(self):
+        dono = _dono()
+        while not self._parar.is_set():
+            try:
+                job = _reivindicar(dono)
+            except Exception as e:
+                logger.error(f"[FILA] Erro ao consultar a fila: {e}")
+                job = None
+            if job is None:
+                self._acordar.wait(config_module.JOB_QUEUE_POLL_SECONDS)
+                self._acordar.clear()
+                continue
+            self._executar(job, dono)
+
+    def _executar(self, job, dono):
+        from processing import realizar_processamento
+        job_id = job["id"]
+        with self._lock:
+            self.em_execucao[job_id] = job
+        resultado = {"dias": {}}
+        parar_heartbeat = threading.Event()
+        # Sinalizado se o lease do job for perdido: cancela o prazo da execução em andamento
+        cancelamento = threading.Event()
+
+        def heartbeat():
+            renovado = time.monotonic()
+            while not parar_heartbeat.wait(config_module.RUN_LEASE_HEARTBEAT_SECONDS):
+                try:
+                    if _renovar(job_id, dono):
+                        renovado = time.monotonic()
+                        continue
+                    motivo = "retomado por outro runner"
+                except Exception as e:
+                    if time.monotonic() - renovado < config_module.RUN_LEASE_TTL_SECONDS:
+                        logger.warning(f"[FILA] Falha ao renovar o lease do job #{job_id}: {e}. "
+                                       f"Nova tentativa no próximo heartbeat.")
+                        continue
+                    motivo = f"sem renovação há mais de {config_module.RUN_LEASE_TTL_SECONDS}s ({e})"
+                logger.error(f"[FILA] Lease do job #{job_id} perdido ({motivo}). Interrompendo o job.")
+                cancelamento.set()
+                return
+
+        threading.Thread(target=heartbeat, name=f"lease-job-{job_id}", daemon=True).start()
+        logger.info(f"[FILA] Job #{job_id} iniciado: {job['start_date']} até {job['end_date']}")
+        event_stream.definir_contexto(None, job_id)
+        event_stream.emitir("job_iniciado", inicio=job["start_date"], fim=job["end_date"], simulacao=job["dry_run"])
+        self._notificar_mudanca(job)
+        estado, erro = CONCLUIDO, None
+        try:
+            inicio = datetime.strptime(job["start_date"], "%Y-%m-%d").date()
+            fim = datetime.strptime(job["end_date"], "%Y-%m-%d").date()
+            dia = inicio
+            while dia <= fim:
+                if self._parar.is_set():
+                    raise RuntimeError("runner encerrado antes do fim do job")
+                if cancelamento.is_set():
+                    raise RuntimeError("execução interrompida: lease perdido")
+                data = dia.isoformat()
+                ok = realizar_processamento(start_date=data, end_date=data, shards=self.shards,
+                                            empresas=job["empresas"], dry_run=job["dry_run"], job_id=job_id,
+                                            cancelamento=cancelamento)
+                resultado["dias"][data] = bool(ok)
+                try:
+                    _renovar(job_id, dono, resultado)
+                except Exception as e:
+                    logger.warning(f"[FILA] Não foi possível gravar o progresso do job #{job_id}: {e}")
+                dia += timedelta(days=1)
+            if not all(resultado["dias"].values()):
+                estado = FALHOU
+                erro = "Dias com erro: " + ", ".join(d for d, ok in resultado["dias"].items() if not ok)
+        except Exception as e:
+            logger.error(f"[FILA] Erro no job #{job_id}: {e}", exc_info=True)
+            estado, erro = FALHOU, str(e)
+        finally:
+            parar_heartbeat.set()
+            _finalizar(job_id, dono, estado, resultado, erro)
+            with self._lock:
+                self.em_execucao.pop(job_id, None)
+        logger.info(f"[FILA] Job #{job_id} {estado}" + (f": {erro}" if erro else ""))
+        event_stream.definir_contexto(None, job_id)
+        event_stream.emitir("job_concluido", estado=estado, erro=erro, dias=resultado["dias"])
+        self._notificar_mudanca(obter_job(job_id))
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner(ao_mudar=None):
+    """Runner do processo (criado na primeira chamada; `start()` é idempotente)."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(ao_mudar=ao_mudar)
+        return _runner
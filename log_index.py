@@ -0,0 +1,334 @@
+# log_index.py
+"""
+Índice de byte offsets do log do sistema (gestta_system.log), gravado enquanto as linhas são escritas:
+
+- por tarefa: offset de cada linha registrada no contexto de uma tarefa do pipeline ou que cita
+  o id (ObjectId) da tarefa;
+- por execução: faixa de bytes [início, fim] das linhas de cada execução (id do status_registry).
+
+Com o índice, /logs busca "todas as linhas da tarefa X" com seeks diretos e o tail lê só o fim do
+arquivo, sem varrer o log inteiro. Cada entrada guarda o inode do arquivo: na rotação (por tamanho
+ou diária) as entradas passam a apontar para o arquivo renomeado, e offsets de um arquivo
+substituído por outro processo não são lidos no arquivo novo.
+"""
+import glob
+import os
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import logging
+
+import config as config_module
+import state_db
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_linhas (
+    chave TEXT NOT NULL,
+    arquivo TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS log_linhas_chave ON log_linhas (chave, offset);
+CREATE TABLE IF NOT EXISTS log_execucoes (
+    execucao TEXT NOT NULL,
+    arquivo TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    inicio INTEGER NOT NULL,
+    fim INTEGER NOT NULL,
+    PRIMARY KEY (execucao, arquivo, inode)
+);
+"""
+
+_OBJECT_ID = re.compile(r"\b[0-9a-f]{24}\b")
+
+_local = threading.local()
+_execucao_atual = None
+_handlers = weakref.WeakSet()
+
+
+# Contexto -----------------------------------------------------------------
+
+@contextmanager
+def contexto_tarefa(task_id):
+    """Linhas registradas pela thread dentro do bloco ficam associadas à tarefa."""
+    anterior = getattr(_local, "task_id", None)
+    _local.task_id = task_id
+    try:
+        yield
+    finally:
+        _local.task_id = anterior
+
+
+def definir_execucao(run_id):
+    """Execução em andamento no processo (None ao terminar)."""
+    global _execucao_atual
+    _execucao_atual = run_id
+
+
+class ContextoFilter(logging.Filter):
+    """Acrescenta `run_id` e `task_id` do contexto atual a cada registro."""
+
+    def filter(self, record):
+        if not hasattr(record, "task_id"):
+            record.task_id = getattr(_local, "task_id", None)
+        if not hasattr(record, "run_id"):
+            record.run_id = _execucao_atual
+        return True
+
+
+# Escrita ------------------------------------------------------------------
+
+class IndexedFileHandler(logging.FileHandler):
+    """
+    FileHandler que registra o offset de cada linha indexável. Os offsets vão para um buffer
+    gravado no banco de estado em lote (LOG_INDEX_FLUSH_LINES linhas ou LOG_INDEX_FLUSH_SECONDS).
+    O offset vem da posição do descritor após a escrita (modo append), correto mesmo com vários
+    processos escrevendo no mesmo arquivo.
+
+    Rotação: ao passar de `max_bytes` (0 = sem limite) ou, com `diario`, na virada do dia, o
+    arquivo é renomeado para `<nome>.<AAAAMMDD_HHMMSS_micros>` e só os `backups` mais recentes são mantidos.
+    Se outro processo rotacionou o arquivo, o handler apenas reabre o novo.
+    """
+
+    def __init__(self, filename, encoding="utf-8", max_bytes=0, diario=False, backups=0):
+        super().__init__(filename, encoding=encoding, delay=True)
+        self.addFilter(ContextoFilter())
+        self.max_bytes = max_bytes
+        self.diario = diario
+        self.backups = backups
+        self._linhas = []
+        self._execucoes = {}
+        self._ultimo_flush = time.monotonic()
+        self._proxima_rotacao = None
+        self._proxima_verificacao = 0.0
+        _handlers.add(self)
+
+    def _open(self):
+        stream = super()._open()
+        if self.diario:
+            # Arquivo de um dia anterior (processo reiniciado) é rotacionado na primeira linha
+            info = os.fstat(stream.fileno())
+            inicio = datetime.fromtimestamp(info.st_mtime) if info.st_size else datetime.now()
+            self._proxima_rotacao = datetime.combine(inicio.date() + timedelta(days=1), datetime.min.time()).timestamp()
+        return stream
+
+    def _verificar_rotacao(self):
+        agora = time.time()
+        fd = self.stream.fileno()
+        if self.max_bytes and os.fstat(fd).st_size >= self.max_bytes:
+            self._rotacionar()
+        elif self._proxima_rotacao is not None and agora >= self._proxima_rotacao:
+            self._rotacionar()
+        elif agora >= self._proxima_verificacao:
+            # No máximo uma vez por segundo: o arquivo foi rotacionado por outro processo?
+            self._proxima_verificacao = agora + 1
+            try:
+                substituido = os.stat(self.baseFilename).st_ino != os.fstat(fd).st_ino
+            except FileNotFoundError:
+                substituido = True
+            if substituido:
+                self._reabrir()
+
+    def _reabrir(self):
+        self.flush_index()
+        self.stream.close()
+        self.stream = self._open()
+
+    def _rotacionar(self):
+        self.flush_index()
+        inode = os.fstat(self.stream.fileno()).st_ino
+        self.stream.close()
+        self.stream = None
+        try:
+            if os.stat(self.baseFilename).st_ino == inode:
+                destino = f"{self.baseFilename}.{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                os.rename(self.baseFilename, destino)
+                _renomear_no_indice(self.baseFilename, inode, destino)
+                self._remover_antigos()
+        except OSError:
+            pass  # rotacionado por outro processo no meio do caminho
+        self.stream = self._open()
+
+    def _remover_antigos(self):
+        if not self.backups:
+            return
+        antigos = sorted(glob.glob(glob.escape(self.baseFilename) + ".*"))
+        for caminho in antigos[:-self.backups]:
+            try:
+                os.remove(caminho)
+            except OSError:
+                continue
+            _remover_do_indice(caminho)
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.max_bytes or self.diario:
+                self._verificar_rotacao()
+            msg = self.format(record) + self.terminator
+            self.stream.write(msg)
+            self.stream.flush()
+            # Bytes gravados (no Windows o modo texto converte "\n" em "\r\n")
+            tamanho = len(msg.encode(self.encoding or "utf-8")) + (msg.count("\n") if os.linesep == "\r\n" else 0)
+            fd = self.stream.fileno()
+            fim = os.lseek(fd, 0, os.SEEK_CUR)
+            self._indexar(record, fim - tamanho, fim, os.fstat(fd).st_ino)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _indexar(self, record, inicio, fim, inode):
+        chaves = set(_OBJECT_ID.findall(record.getMessage()))
+        if getattr(record, "task_id", None):
+            chaves.add(str(record.task_id))
+        arquivo = os.path.abspath(self.baseFilename)
+        for chave in chaves:
+            self._linhas.append((chave, arquivo, inode, inicio))
+        run_id = getattr(record, "run_id", None)
+        if run_id:
+            faixa = self._execucoes.setdefault((run_id, arquivo, inode), [inicio, fim])
+            faixa[1] = fim
+        if (len(self._linhas) >= config_module.LOG_INDEX_FLUSH_LINES
+                or time.monotonic() - self._ultimo_flush >= config_module.LOG_INDEX_FLUSH_SECONDS):
+            self.flush_index()
+
+    def flush_index(self):
+        linhas, self._linhas = self._linhas, []
+        execucoes, self._execucoes = self._execucoes, {}
+        self._ultimo_flush = time.monotonic()
+        if not linhas and not execucoes:
+            return
+        try:
+            conn = state_db.ensure_schema("log_index", SCHEMA)
+            with state_db.transaction(conn):
+                conn.executemany("INSERT INTO log_linhas (chave, arquivo, inode, offset) VALUES (?, ?, ?, ?)", linhas)
+                conn.executemany(
+                    "INSERT INTO log_execucoes (execucao, arquivo, inode, inicio, fim) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (execucao, arquivo, inode) DO UPDATE SET fim = MAX(fim, excluded.fim)",
+                    [(run_id, arquivo, inode, inicio, fim) for (run_id, arquivo, inode), (inicio, fim) in execucoes.items()])
+        except Exception:
+            # Sem logar aqui: estamos dentro do próprio handler de log
+            pass
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush_index()
+        finally:
+            self.release()
+        super().close()
+
+
+def _renomear_no_indice(arquivo, inode, destino):
+    try:
+        conn = state_db.ensure_schema("log_index", SCHEMA)
+        with state_db.transaction(conn):
+            for tabela in ("log_linhas", "log_execucoes"):
+                conn.execute(f"UPDATE {tabela} SET arquivo = ? WHERE arquivo = ? AND inode = ?",
+                             (os.path.abspath(destino), os.path.abspath(arquivo), inode))
+    except Exception:
+        pass
+
+
+def _remover_do_indice(arquivo):
+    try:
+        conn = state_db.ensure_schema("log_index", SCHEMA)
+        with state_db.transaction(conn):
+            for tabela in ("log_linhas", "log_execucoes"):
+                conn.execute(f"DELETE FROM {tabela} WHERE arquivo = ?", (os.path.abspath(arquivo),))
+    except Exception:
+        pass
+
+
+def flush():
+    """Grava os offsets pendentes de todos os IndexedFileHandler ativos (fim de execução)."""
+    for handler in list(_handlers):
+        handler.acquire()
+        try:
+            handler.flush_index()
+        finally:
+            handler.release()
+
+
+# Leitura ------------------------------------------------------------------
+
+def caminho_log():
+    return os.path.abspath(os.path.join(config_module.LOGS_DIR, "gestta_system.log"))
+
+
+def _ler_linha(f, offset):
+    f.seek(offset)
+    return f.readline().decode("utf-8", errors="replace").rstrip("\n")
+
+
+def linhas_da_tarefa(task_id, limite=1000):
+    """Linhas do log associadas à tarefa, em ordem, lidas por seek nos offsets indexados."""
+    conn = state_db.ensure_schema("log_index", SCHEMA)
+    # Ordem de gravação (rowid): continua cronológica quando a tarefa atravessa uma rotação
+    rows = conn.execute("SELECT arquivo, inode, offset FROM log_linhas WHERE chave = ? ORDER BY rowid LIMIT ?",
+                        (task_id, limite)).fetchall()
+    linhas = []
+    abertos = {}
+    try:
+        for row in rows:
+            f = abertos.get(row["arquivo"])
+            if f is None:
+                try:
+                    f = open(row["arquivo"], "rb")
+                except OSError:
+                    continue
+                if os.fstat(f.fileno()).st_ino != row["inode"]:
+                    f.close()
+                    continue
+                abertos[row["arquivo"]] = f
+            linhas.append(_ler_linha(f, row["offset"]))
+    finally:
+        for f in abertos.values():
+            f.close()
+    return linhas
+
+
+def linhas_da_execucao(run_id, max_bytes=None):
+    """Linhas da faixa de bytes da execução (limitadas às últimas `max_bytes`)."""
+    max_bytes = max_bytes or config_module.LOG_READ_MAX_BYTES
+    conn = state_db.ensure_schema("log_index", SCHEMA)
+    linhas = []
+    for row in conn.execute("SELECT * FROM log_execucoes WHERE execucao = ? ORDER BY rowid", (run_id,)).fetchall():
+        try:
+            with open(row["arquivo"], "rb") as f:
+                if os.fstat(f.fileno()).st_ino != row["inode"]:
+                    continue
+                inicio = max(row["inicio"], row["fim"] - max_bytes)
+                f.seek(inicio)
+                dados = f.read(row["fim"] - inicio)
+        except OSError:
+            continue
+        texto = dados.decode("utf-8", errors="replace").splitlines()
+        if inicio > row["inicio"] and texto:
+            texto = texto[1:]  # primeira linha possivelmente cortada
+        linhas.extend(texto)
+    return linhas
+
+
+def tail(n=200, caminho=None):
+    """Últimas `n` linhas do log, lendo blocos a partir do fim do arquivo."""
+    caminho = caminho or caminho_log()
+    bloco = 64 * 1024
+    try:
+        with open(caminho, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            dados = b""
+            while pos > 0 and dados.count(b"\n") <= n and len(dados) < config_module.LOG_READ_MAX_BYTES:
+                leitura = min(bloco, pos)
+                pos -= leitura
+                f.seek(pos)
+                dados = f.read(leitura) + dados
+    except OSError:
+        return []
+    return dados.decode("utf-8", errors="replace").splitlines()[-n:]
@@ -1,16 +1,178 @@
 # logger_config.py
+"""
+Logging assíncrono: as threads do pipeline só enfileiram o registro (QueueHandler); um
+QueueListener em segundo plano formata e grava no arquivo e no console.
+
+- Arquivo (gestta_system.log): um JSON por linha com run_id e task_id, rotacionado por tamanho
+  (LOG_MAX_BYTES) e diariamente, com LOG_BACKUP_COUNT arquivos mantidos; offsets indexados
+  por tarefa/execução (log_index.py) para /logs.
+- Console: texto, como antes.
+- Loggers ruidosos (LOG_RATE_LIMITS) têm limite de mensagens por minuto por ponto de chamada.
+"""
+import atexit
+import copy
+import json
 import logging
 import os
-from config import LOGS_DIR
-
-os.makedirs(LOGS_DIR, exist_ok=True)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOGS_DIR, "gestta_system.log")),
-        logging.StreamHandler()
-    ]
-)
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+import config
+import log_index
+from log_index import IndexedFileHandler, ContextoFilter
+
+FORMATO_TEXTO = '%(asctime)s - %(levelname)s - %(message)s'
+
+_setup_lock = threading.Lock()
+_fila = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha: horário, nível, logger, mensagem, run_id, task_id e exceção."""
+
+    def format(self, record):
+        registro = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "run_id": getattr(record, "run_id", None),
+            "task_id": getattr(record, "task_id", None),
+            "thread": record.threadName,
+            "origem": f"{record.module}:{record.lineno}",
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            registro["exc"] = record.exc_text
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+
+class LimiteFilter(logging.Filter):
+    """
+    Limita um logger a `por_minuto` mensagens por ponto de chamada (arquivo:linha). Acima do
+    limite, só 1 a cada `amostra` passa (0 = nenhuma); a mensagem seguinte que passar informa
+    quantas foram suprimidas.
+    """
+
+    def __init__(self, por_minuto=60, amostra=0):
+        super().__init__()
+        self.por_minuto = por_minuto
+        self.amostra = amostra
+        self._lock = threading.Lock()
+        self._janelas = {}
+
+    def filter(self, record):
+        agora = time.monotonic()
+        chave = (record.pathname, record.lineno)
+        with self._lock:
+            janela = self._janelas.get(chave)
+            if janela is None or agora - janela[0] >= 60:
+                janela = self._janelas[chave] = [agora, 0, janela[2] if janela else 0]
+            janela[1] += 1
+            excedente = janela[1] - self.por_minuto
+            if excedente > 0 and not (self.amostra and excedente % self.amostra == 0):
+                janela[2] += 1
+                return False
+            suprimidas, janela[2] = janela[2], 0
+        if suprimidas:
+            record.msg = f"{record.getMessage()} (+{suprimidas} mensagens suprimidas)"
+            record.args = None
+        return True
+
+
+class _FilaHandler(QueueHandler):
+    """
+    Enfileira o registro já com a mensagem formatada e o contexto (run_id/task_id) da thread que
+    registrou; a exceção vai como texto, sem manter referências ao frame.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def iniciar_logging(arquivo):
+    """
+    Liga a raiz ao listener em segundo plano, com o arquivo `arquivo` (JSON ou texto, conforme
+    LOG_JSON) e o console. Substitui os handlers da raiz.
+    """
+    global _fila, _listener
+    parar_logging()
+    handler_arquivo = IndexedFileHandler(arquivo, max_bytes=config.LOG_MAX_BYTES, diario=config.LOG_ROTATE_DAILY,
+                                         backups=config.LOG_BACKUP_COUNT)
+    handler_arquivo.setFormatter(JsonFormatter() if config.LOG_JSON else logging.Formatter(FORMATO_TEXTO))
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(FORMATO_TEXTO))
+    _fila = queue.Queue()
+    _listener = QueueListener(_fila, handler_arquivo, console, respect_handler_level=True)
+    _listener.start()
+    fila_handler = _FilaHandler(_fila)
+    fila_handler.addFilter(ContextoFilter())
+    raiz = logging.getLogger()
+    for handler in raiz.handlers[:]:
+        raiz.removeHandler(handler)
+    raiz.addHandler(fila_handler)
+    raiz.setLevel(logging.INFO)
+    for nome, limite in config.LOG_RATE_LIMITS.items():
+        alvo = logging.getLogger(nome)
+        for filtro in [f for f in alvo.filters if isinstance(f, LimiteFilter)]:
+            alvo.removeFilter(filtro)
+        alvo.addFilter(LimiteFilter(**limite))
+    return handler_arquivo, console
+
+
+def parar_logging():
+    """Esvazia a fila e encerra o listener (saída do processo ou reconfiguração)."""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def aguardar_logs(timeout=5):
+    """Espera o listener gravar o que já foi enfileirado e grava os offsets do índice."""
+    if _fila is not None:
+        limite = time.monotonic() + timeout
+        while _fila.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.01)
+    log_index.flush()
+
+
+def setup_logging():
+    """
+    Configura o logging do sistema (gestta_system.log e console). Idempotente; chamado pelos
+    pontos de entrada ou automaticamente na primeira mensagem registrada, nunca na importação.
+    """
+    with _setup_lock:
+        logger.removeHandler(_first_use_handler)
+        if logging.getLogger().handlers:
+            return
+        os.makedirs(config.LOGS_DIR, exist_ok=True)
+        iniciar_logging(os.path.join(config.LOGS_DIR, "gestta_system.log"))
+
+
+class _SetupOnFirstUse(logging.Handler):
+    """Configura o logging na primeira mensagem; o registro segue normalmente para os handlers da raiz."""
+
+    def emit(self, record):
+        setup_logging()
+
+
+atexit.register(parar_logging)
+
 logger = logging.getLogger("GesttaSystem")
+logger.setLevel(logging.INFO)
+_first_use_handler = _SetupOnFirstUse()
+logger.addHandler(_first_use_handler)
@@ -1,7 +1,8 @@
 import logging
 import sys
 import os
-from datetime import datetime
+import config
+from logger_config import iniciar_logging
 
 def configure_logging():
     """Configure logging with proper Unicode support"""
@@ -16,37 +17,11 @@ def configure_logging():
             pass
     
     # Create logs directory if it doesn't exist
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
+    os.makedirs(config.LOGS_DIR, exist_ok=True)
     
-    # Get current date for log filename
-    current_date = datetime.now().strftime('%Y%m%d_%H%M%S')
-    log_file = f'logs/app_{current_date}.log'
+    # Root logger writes through a background queue listener: JSON file (rotated, offsets
+    # indexed per task/run for /logs) and text console. Every entry point (main, daemon, web)
+    # shares gestta_system.log, which is the file the /logs tail reads
+    iniciar_logging(os.path.join(config.LOGS_DIR, "gestta_system.log"))
     
-    # Configure root logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    
-    # Clear existing handlers if any
-    if logger.handlers:
-        for handler in logger.handlers[:]:
-            logger.removeHandler(handler)
-    
-    # File handler - explicitly use UTF-8 encoding
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setLevel(logging.INFO)
-    
-    # Console handler with error handling for encoding issues
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    
-    # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # Add handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+    return logging.getLogger()
@@ -2,28 +2,29 @@
 import os
 import sys
 import argparse
-from logger_config import logger
-from processing import programar_verificacoes, realizar_processamento
-from PyQt5.QtWidgets import QApplication
-from gui import GesttaConfigurador, set_app_style
 from logging_config import configure_logging
-from config import DEBUG_MODE
+from config import DEBUG_MODE, ensure_runtime_dirs
+# PyQt5/gui (configurador) e processing (execução) são importados só no caminho que os usa
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Sistema de processamento de documentos Gestta')
     parser.add_argument('--config', action='store_true', help='Executar configurador')
     parser.add_argument('--start-date', help='Data inicial para busca (formato: YYYY-MM-DD)')
     parser.add_argument('--end-date', help='Data final para busca (formato: YYYY-MM-DD)')
+    parser.add_argument('--shards', type=int, help='Dividir as empresas em N shards processados por vários workers')
     return parser.parse_args()
 
 def main():
     # Configure logging with Unicode support
+    ensure_runtime_dirs()
     logger = configure_logging()
     logger.info("Iniciando aplicação de processamento de documentos Gestta")
     
     args = parse_args()
     
     if args.config:
+        from PyQt5.QtWidgets import QApplication
+        from gui import GesttaConfigurador, set_app_style
         app = QApplication(sys.argv)
         set_app_style(app)
         window = GesttaConfigurador()
@@ -38,11 +39,13 @@ def main():
                 logger.error("Por favor, execute 'python main.py --config' primeiro.")
                 sys.exit(1)
             
+            from processing import programar_verificacoes, realizar_processamento
+            
             if args.start_date or args.end_date:
                 logger.info(f"Executando com datas personalizadas:")
                 logger.info(f"Data inicial: {args.start_date or 'hoje'}")
                 logger.info(f"Data final: {args.end_date or args.start_date or 'hoje'}")
-                realizar_processamento(args.start_date, args.end_date)
+                realizar_processamento(args.start_date, args.end_date, shards=args.shards)
             else:
                 programar_verificacoes()
         except KeyboardInterrupt:
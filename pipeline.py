@@ -0,0 +1,146 @@
+# pipeline.py
+import queue
+import threading
+import time
+
+from logger_config import logger
+
+_STOP = object()
+
+
+class Stage:
+    """
+    Etapa do pipeline: uma fila limitada alimentando `workers` threads que executam `handler`.
+
+    O handler recebe (item, emit) e usa `emit(nome_etapa, item)` para encaminhar o item
+    a uma etapa seguinte. Quando a fila de destino está cheia, `emit` bloqueia (backpressure).
+    Se o handler delega trabalho em segundo plano (que também pode emitir), `drain` é chamado
+    no encerramento para aguardá-lo antes de fechar as etapas seguintes.
+    """
+
+    def __init__(self, name, handler, workers=1, queue_size=100, drain=None):
+        self.name = name
+        self.handler = handler
+        self.drain = drain
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.threads = []
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self, elapsed):
+        with self._lock:
+            return {
+                "fila": self.queue.qsize(),
+                "capacidade_fila": self.queue.maxsize,
+                "workers": self.workers,
+                "ocupados": self.busy,
+                "processados": self.processed,
+                "erros": self.errors,
+                "tempo_ocupado_s": round(self.busy_seconds, 3),
+                "vazao_por_min": round(self.processed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            }
+
+
+class Pipeline:
+    """
+    Pipeline de etapas ligadas por filas limitadas.
+
+    As etapas devem ser registradas na ordem do fluxo e só podem encaminhar itens
+    para etapas posteriores; assim o encerramento pode drenar uma etapa de cada vez.
+    """
+
+    def __init__(self, name="pipeline"):
+        self.name = name
+        self.stages = []
+        self._by_name = {}
+        self.started_at = None
+        self.finished_at = None
+        self._abort = threading.Event()
+
+    def add_stage(self, name, handler, workers=1, queue_size=100, drain=None):
+        stage = Stage(name, handler, workers, queue_size, drain)
+        self.stages.append(stage)
+        self._by_name[name] = stage
+        return stage
+
+    def emit(self, stage_name, item):
+        """Enfileira um item na etapa informada, bloqueando enquanto a fila estiver cheia."""
+        stage = self._by_name[stage_name]
+        while not self._abort.is_set():
+            try:
+                stage.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def abort(self):
+        """Descarta o trabalho pendente: as etapas param de aceitar e de processar itens."""
+        self._abort.set()
+
+    @property
+    def aborted(self):
+        return self._abort.is_set()
+
+    def _worker(self, stage):
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                stage.queue.task_done()
+                return
+            if self._abort.is_set():
+                stage.queue.task_done()
+                continue
+            with stage._lock:
+                stage.busy += 1
+            start = time.monotonic()
+            try:
+                stage.handler(item, self.emit)
+                ok = True
+            except Exception as e:
+                ok = False
+                logger.error(f"[PIPELINE] Erro na etapa '{stage.name}': {e}", exc_info=True)
+            finally:
+                with stage._lock:
+                    stage.busy -= 1
+                    stage.busy_seconds += time.monotonic() - start
+                    if ok:
+                        stage.processed += 1
+                    else:
+                        stage.errors += 1
+                stage.queue.task_done()
+
+    def start(self):
+        self.started_at = time.monotonic()
+        for stage in self.stages:
+            for index in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(stage,),
+                                          name=f"{self.name}-{stage.name}-{index}", daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+        return self
+
+    def close(self):
+        """
+        Chamado depois que a fonte terminou de emitir: drena as etapas em ordem e encerra os workers.
+        """
+        for stage in self.stages:
+            stage.queue.join()
+            if stage.drain is not None:
+                stage.drain()
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for thread in stage.threads:
+                thread.join()
+        self.finished_at = time.monotonic()
+
+    def snapshot(self):
+        """Profundidade de fila, workers ocupados e vazão de cada etapa."""
+        if self.started_at is None:
+            return {}
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return {stage.name: stage.snapshot(elapsed) for stage in self.stages}
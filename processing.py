@@ -1,16 +1,32 @@
 # processing.py
-import os, sys, json, shutil
+import os, sys, json, shutil, threading
 import time as pytime  # Renomeie para evitar conflito
 from datetime import datetime, date, timedelta, time
-import schedule
-from logger_config import logger
+from logger_config import logger, aguardar_logs
 from config import CONFIG_FILE, DOWNLOAD_BASE_DIR, DEBUG_MODE
-from api import (get_token, get_all_companies, get_all_users, search_all_customer_tasks,
-                 get_task_detail, process_task_documents, update_task_status)
+from api import (get_token, get_all_companies, get_all_users, iter_customer_tasks,
+                 get_task_detail, update_task_status, send_task_comment, tarefa_possui_arquivos,
+                 prepare_task_folder, prepare_task_zip, download_task_zip, download_task_files,
+                 extract_task_folder, resolve_task_destination)
 # from dashboard import gerar_dashboard_estatisticas
 import subprocess
 from file_utils import sanitize_filename, truncate_name, iso_to_mes_ano, safe_move_folder, monta_caminho_contabil, monta_caminho_fiscal
 from debug_utils import create_task_debug_folder
+from deadline import RunDeadline, DeadlineExceeded
+from http_utils import hedge_stats
+from api_metrics import api_metrics
+from pipeline import Pipeline
+from share_writer import get_share_writer
+from download_governor import get_download_governor, aplicar_configuracao as aplicar_limites_download
+from scratch import get_scratch_manager, ScratchFull
+from coordinator import get_coordinator, dividir_em_shards, chave_execucao
+import status_registry
+import event_stream
+import log_index
+import run_history
+import tracing
+from scratch import folder_size
+from download_strategy import escolher_estrategia, estimar_bytes, get_download_history, ESTRATEGIA_ARQUIVOS, ESTRATEGIA_ZIP
 import config as config_module
 from pathlib import Path
 
@@ -44,6 +60,19 @@ def carregar_configuracoes():
             if "download_dir" in settings:
                 config_module.DOWNLOAD_BASE_DIR = settings["download_dir"]
                 os.makedirs(config_module.DOWNLOAD_BASE_DIR, exist_ok=True)
+            if "hedge_requests" in settings:
+                config_module.HEDGE_REQUESTS = bool(settings["hedge_requests"])
+            if "pipeline_workers" in settings:
+                config_module.PIPELINE_WORKERS = {**config_module.PIPELINE_WORKERS, **settings["pipeline_workers"]}
+            if "run_deadline_seconds" in settings:
+                config_module.RUN_DEADLINE_SECONDS = settings["run_deadline_seconds"]
+            if "stage_budgets" in settings:
+                config_module.STAGE_BUDGETS = {**config_module.STAGE_BUDGETS, **settings["stage_budgets"]}
+            if "share_sync_mode" in settings:
+                config_module.SHARE_SYNC_MODE = settings["share_sync_mode"]
+            if "run_shards" in settings:
+                config_module.RUN_SHARDS = int(settings["run_shards"])
+            aplicar_limites_download(settings)
         
         if "credentials" in config:
             creds = config["credentials"]
@@ -59,19 +88,426 @@ def carregar_configuracoes():
         logger.error(f"Erro ao carregar configurações: {e}")    
         raise
 
-def realizar_processamento(start_date=None, end_date=None, force_execution=False):
+def ler_credenciais():
+    """Retorna (email, senha) gravados em gestta_config.json."""
+    with open(CONFIG_FILE, 'r') as f:
+        config = json.load(f)
+    credenciais = config.get("credentials", {})
+    return credenciais.get("email", ""), credenciais.get("password", "")
+
+# Pipeline e estatísticas da execução em andamento no processo (publicados no status_registry)
+_pipeline_atual = None
+_estatisticas_atuais = None
+
+def obter_status_pipeline():
+    """Retorna profundidade de fila, workers ocupados e vazão de cada etapa do pipeline em execução."""
+    pipeline = _pipeline_atual
+    return pipeline.snapshot() if pipeline is not None else {}
+
+def _executar_pipeline(pipeline, busca):
+    global _pipeline_atual
+    _pipeline_atual = pipeline
+    parar_monitor = threading.Event()
+    
+    def monitorar():
+        while not parar_monitor.wait(config_module.PIPELINE_LOG_INTERVAL):
+            resumo = ", ".join(f"{nome}: fila={s['fila']} ocupados={s['ocupados']} ok={s['processados']}"
+                               for nome, s in pipeline.snapshot().items())
+            logger.info(f"[PIPELINE] {resumo}")
+    
+    monitor = threading.Thread(target=monitorar, name="pipeline-monitor", daemon=True)
+    pipeline.start()
+    monitor.start()
+    try:
+        pipeline.emit("busca", busca)
+        pipeline.close()
+    except BaseException:
+        pipeline.abort()
+        raise
+    finally:
+        parar_monitor.set()
+
+def _competencia(detail):
+    competencia = "XX/XXXX"
+    if date_field := detail.get("competence_date"):
+        try:
+            data_competencia = datetime.fromisoformat(date_field.replace("Z", "+00:00"))
+            competencia = f"{data_competencia.month:02d}/{data_competencia.year}"
+        except Exception as e:
+            logger.warning(f"Erro ao extrair data de competência: {e}")
+    return competencia
+
+def _enviar_alertas(token, task_id, detail, competencia, descricao, deadline=None):
+    """Envia o comentário de cobrança a cada cliente da tarefa. Retorna o número de alertas enviados."""
+    customers_list = detail.get("customers", [])
+    if not customers_list:
+        customers_list = [{"customer": detail.get("customer", {})}]
+    
+    alertas_enviados = 0
+    
+    for customer_item in customers_list:
+        customer = customer_item.get("customer", {}) if isinstance(customer_item, dict) else {}
+        customer_id = customer.get("_id")
+        
+        company_department = detail.get("company_department", {}).get("_id")
+        if not company_department:
+            company_department = customer.get("department_id")
+            if not company_department and isinstance(customer_item, dict):
+                company_department = customer_item.get("department_id")
+        
+        if not customer_id or not company_department:
+            logger.warning(f"Cliente ignorado: Não foi possível obter customer_id ou company_department")
+            logger.debug(f"Customer ID: {customer_id}, Company Department: {company_department}")
+            continue
+            
+        logger.info(f"Enviando alerta de documentos {descricao} para cliente: {customer.get('name', 'Nome desconhecido')}")
+        resp_comment = send_task_comment(token, task_id, competence=competencia, 
+                                       customer_id=customer_id, company_department=company_department,
+                                       deadline=deadline)
+        
+        if "sucesso" in resp_comment.lower():
+            alertas_enviados += 1
+    
+    logger.info(f"Total de alertas enviados para esta tarefa: {alertas_enviados}")
+    return alertas_enviados
+
+def _com_contexto_tarefa(nome, handler):
+    """
+    Associa as linhas de log da etapa à tarefa do job (índice do log por task_id, usado por /logs)
+    e mede cada item como um span `pipeline.<etapa>` do trace.
+    """
+    def etapa(job, emit):
+        task_id = job.get("task_id")
+        with log_index.contexto_tarefa(task_id), tracing.span(f"pipeline.{nome}", "pipeline", tarefa=task_id):
+            return handler(job, emit)
+    return etapa
+
+def montar_pipeline(token, estatisticas, deadline, fiscal_phrases, contabil_phrases, empresas_com_documentos,
+                    dry_run=False, lease=None):
+    """
+    Monta o pipeline da execução:
+    busca → detalhe → classificar → preparar_zip → download → extrair → mover → comentario (alertas + status).
+
+    Tarefas sem documentos vão direto de classificar para comentario, sem esperar atrás dos downloads.
+    Cada etapa tem seu número de workers e sua fila limitada (PIPELINE_WORKERS / PIPELINE_QUEUE_SIZES).
+    A etapa mover apenas entrega a pasta ao ShareWriter; a cópia para a rede acontece em segundo plano.
+    Com `dry_run`, as tarefas param na classificação: nada é baixado, comentado ou alterado no Gestta.
+    Se o `lease` do shard for perdido, nenhuma etapa com efeito externo (download, cópia para a
+    rede, comentários, status) começa: o shard já está com outro worker.
+    """
+    all_phrases = fiscal_phrases + contabil_phrases
+    lock = threading.Lock()
+    pipeline = Pipeline("processamento")
+    share_writer = get_share_writer()
+    history = get_download_history()
+    scratch = get_scratch_manager()
+    
+    def contar(chave, valor=1):
+        with lock:
+            estatisticas[chave] += valor
+    
+    def lease_valido(job, etapa):
+        if lease is None or not lease.perdida:
+            return True
+        logger.warning(f"[COORDENADOR] Lease perdido: tarefa {job['task_id']} não segue para '{etapa}'.")
+        if job.get("pasta") and not job.get("entregue"):
+            scratch.release(job["pasta"]["task_folder"], remove=True)
+        return False
+    
+    def etapa_busca(busca, emit):
+        for task in iter_customer_tasks(token, busca["company_ids"], busca["user_ids"], busca["inicio"], busca["fim"],
+                                        deadline=deadline):
+            contar("tarefas_verificadas")
+            name_lower = task.get("name", "").lower()
+            if any(phrase in name_lower for phrase in all_phrases):
+                contar("tarefas_filtradas")
+                emit("detalhe", {"task": task, "task_id": task.get("_id"), "task_name": task.get("name", "")})
+        logger.info(f"Total de tarefas coletadas: {estatisticas['tarefas_verificadas']}")
+        logger.info(f"Encontradas {estatisticas['tarefas_filtradas']} tarefas de cobrança de documentos com vencimento hoje")
+    
+    def etapa_detalhe(job, emit):
+        try:
+            deadline.check()
+        except DeadlineExceeded as e:
+            logger.error(f"{e}. Tarefa {job['task_id']} não será processada nesta execução.")
+            contar("tarefas_nao_processadas_por_prazo")
+            return
+        logger.info(f"Processando tarefa: {job['task_name']} (ID: {job['task_id']})")
+        detail = get_task_detail(token, job["task_id"], deadline=deadline)
+        if not detail:
+            logger.error(f"Não foi possível obter detalhes da tarefa {job['task_id']}. Pulando.")
+            return
+        job["detail"] = detail
+        event_stream.emitir("tarefa_iniciada", tarefa=job["task_id"], nome=job["task_name"])
+        emit("classificar", job)
+    
+    def etapa_classificar(job, emit):
+        detail = job["detail"]
+        task_id = job["task_id"]
+        tem_documentos_completos = tarefa_possui_arquivos(detail, verificar_completo=True)
+        tem_alguns_documentos = tarefa_possui_arquivos(detail, verificar_completo=False)
+        job["competencia"] = _competencia(detail)
+        job["documentos_baixados"] = 0
+        
+        if dry_run:
+            acao = ("download" if tem_documentos_completos else
+                    "download parcial + aviso" if tem_alguns_documentos else "aviso de documentos faltantes")
+            logger.info(f"[SIMULAÇÃO] Tarefa {task_id} ({job['task_name']}): {acao}")
+            event_stream.emitir("tarefa_simulada", tarefa=task_id, acao=acao)
+            contar("tarefas_simuladas")
+            return
+        
+        if tem_documentos_completos:
+            logger.info(f"Tarefa {task_id} possui todos os documentos. Realizando download.")
+            job["alerta"] = None
+        elif tem_alguns_documentos:
+            logger.info(f"Tarefa {task_id} possui documentos parciais. Baixando disponíveis e enviando aviso.")
+            job["alerta"] = "incompletos"
+        else:
+            logger.info(f"Tarefa {task_id} não possui documentos. Enviando aviso.")
+            contar("tarefas_sem_documentos")
+            job["alerta"] = "faltantes"
+            emit("comentario", job)
+            return
+        
+        try:
+            job["pasta"] = prepare_task_folder(detail, expected_bytes=estimar_bytes(detail, history), deadline=deadline)
+        except ScratchFull as e:
+            # Sem comentário nem mudança de status: a tarefa volta na próxima execução
+            logger.error(f"{e}. Tarefa {task_id} adiada.")
+            contar("tarefas_adiadas_sem_espaco")
+            return
+        if not job["pasta"]:
+            emit("comentario", job)
+            return
+        if job["pasta"].get("politica") == "arquivo":
+            # Destinos que guardam o arquivo original precisam do ZIP do download/all
+            job["estrategia"], custos = ESTRATEGIA_ZIP, {"politica": "arquivo"}
+        else:
+            job["estrategia"], custos = escolher_estrategia(detail, history)
+        logger.info(f"[DOWNLOAD] Estratégia para tarefa {task_id}: {job['estrategia']} {custos}")
+        contar(f"estrategia_{job['estrategia']}")
+        event_stream.emitir("tarefa_classificada", tarefa=task_id, estrategia=job["estrategia"], alerta=job["alerta"])
+        # Downloads individuais não esperam a preparação do ZIP no servidor
+        emit("download" if job["estrategia"] == ESTRATEGIA_ARQUIVOS else "preparar_zip", job)
+    
+    def etapa_preparar_zip(job, emit):
+        if not lease_valido(job, "preparar_zip"):
+            return
+        logger.info(f"[DOWNLOAD] Solicitando download de todos os documentos da tarefa {job['task_id']}")
+        inicio = pytime.monotonic()
+        job["zip_url"] = prepare_task_zip(token, job["task_id"], deadline=deadline)
+        if job["zip_url"]:
+            history.record("preparo_zip_s", pytime.monotonic() - inicio)
+        if not job["zip_url"]:
+            logger.warning(f"Download em lote falhou para tarefa {job['task_id']}. Não há documentos para processar.")
+            emit("comentario", job)
+            return
+        emit("download", job)
+    
+    def etapa_download(job, emit):
+        if not lease_valido(job, "download"):
+            return
+        inicio = pytime.monotonic()
+        if job["estrategia"] == ESTRATEGIA_ARQUIVOS:
+            job["zip_path"] = None
+            if download_task_files(token, job["pasta"], job["detail"], deadline=deadline):
+                event_stream.emitir("download_concluido", tarefa=job["task_id"], estrategia=job["estrategia"],
+                                    bytes=folder_size(job["pasta"]["task_folder"]),
+                                    segundos=round(pytime.monotonic() - inicio, 2))
+                emit("extrair", job)
+                return
+            # Algum arquivo falhou: tenta o ZIP do download/all aqui mesmo (emitir de volta para
+            # preparar_zip poderia travar as filas limitadas) em vez de concluir a tarefa incompleta
+            logger.warning(f"Download individual falhou para tarefa {job['task_id']}. Tentando o download em lote (ZIP).")
+            contar(f"estrategia_{ESTRATEGIA_ARQUIVOS}", -1)
+            contar(f"estrategia_{ESTRATEGIA_ZIP}")
+            job["estrategia"] = ESTRATEGIA_ZIP
+            job["zip_url"] = prepare_task_zip(token, job["task_id"], deadline=deadline)
+            if not job["zip_url"]:
+                logger.warning(f"Download em lote falhou para tarefa {job['task_id']}. Não há documentos para processar.")
+                emit("comentario", job)
+                return
+        job["zip_path"] = download_task_zip(job["zip_url"], job["task_id"], job["pasta"]["task_folder"],
+                                            deadline=deadline)
+        if job["zip_path"]:
+            decorrido = pytime.monotonic() - inicio
+            tamanho = os.path.getsize(job["zip_path"])
+            if tamanho > 1024 * 1024 and decorrido > 0:
+                history.record("bytes_por_s", tamanho / decorrido)
+            event_stream.emitir("download_concluido", tarefa=job["task_id"], estrategia=job["estrategia"],
+                                bytes=tamanho, segundos=round(decorrido, 2))
+        if not job["zip_path"]:
+            logger.warning(f"Download em lote falhou para tarefa {job['task_id']}. Não há documentos para processar.")
+            emit("comentario", job)
+            return
+        emit("extrair", job)
+    
+    def etapa_extrair(job, emit):
+        job["arquivos"] = extract_task_folder(job["pasta"], job["zip_path"], deadline=deadline)
+        if motivo := job["pasta"].get("erro_extracao"):
+            # Envio suspeito (zip bomb, milhares de arquivos): descarta o staging e não altera a
+            # tarefa no Gestta, que fica pendente para verificação manual
+            scratch.release(job["pasta"]["task_folder"], remove=True)
+            with lock:
+                estatisticas["extracao_recusada"].append({"tarefa": job["task_id"], "nome": job["task_name"],
+                                                          "motivo": motivo})
+            event_stream.emitir("extracao_recusada", tarefa=job["task_id"], motivo=motivo)
+            return
+        event_stream.emitir("extraida", tarefa=job["task_id"], arquivos=job["arquivos"])
+        emit("mover" if job["arquivos"] else "comentario", job)
+    
+    def etapa_mover(job, emit):
+        if not lease_valido(job, "mover"):
+            return
+        job["entregue"] = True
+        
+        def concluido(docs_baixados):
+            # Pasta que continua no staging (cópia falhou ou modo debug) fica retida até a limpeza
+            scratch.release(job["pasta"]["task_folder"])
+            if docs_baixados and job["pasta"].get("politica") == "arquivo":
+                # ZIP + manifesto: o total de documentos é o que está listado no manifesto
+                docs_baixados = job["arquivos"]
+            logger.info(f"Arquivos pós-extração para '{job['task_name']}': {docs_baixados}")
+            job["documentos_baixados"] = docs_baixados
+            contar("documentos_baixados", docs_baixados)
+            event_stream.emitir("movida", tarefa=job["task_id"], documentos=docs_baixados)
+            if docs_baixados > 0:
+                contar("tarefas_processadas_com_sucesso")
+                with lock:
+                    empresas_com_documentos.add(job["pasta"]["customer_id"])
+                    # Documentos por empresa, para o histórico (run_history.documentos_por_empresa)
+                    empresa = estatisticas["documentos_por_empresa"].setdefault(
+                        job["pasta"]["customer_id"], {"codigo": job["pasta"].get("customer_code"), "tarefas": 0, "documentos": 0})
+                    empresa["tarefas"] += 1
+                    empresa["documentos"] += docs_baixados
+            emit("comentario", job)
+        
+        share_writer.submit(job["pasta"]["task_folder"], lambda: resolve_task_destination(job["pasta"]),
+                            concluido, fallback_count=job["arquivos"])
+    
+    def etapa_comentario(job, emit):
+        task_id = job["task_id"]
+        if job.get("pasta") and not job.get("entregue"):
+            # Download ou extração falhou: o conteúdo parcial não é aproveitado
+            scratch.release(job["pasta"]["task_folder"], remove=True)
+        if not lease_valido(job, "comentario"):
+            return
+        if job.get("alerta"):
+            alertas = _enviar_alertas(token, task_id, job["detail"], job["competencia"], job["alerta"], deadline=deadline)
+            contar("alertas_enviados", alertas)
+            event_stream.emitir("alertada", tarefa=task_id, tipo_alerta=job["alerta"], alertas=alertas)
+        resultado_status = update_task_status(token, task_id, deadline=deadline)
+        logger.info(f"Resultado da alteração de status: {resultado_status}")
+        contar("tarefas_concluidas")
+        event_stream.emitir("tarefa_concluida", tarefa=task_id, documentos=job.get("documentos_baixados", 0))
+    
+    workers = config_module.PIPELINE_WORKERS
+    filas = config_module.PIPELINE_QUEUE_SIZES
+    for nome, handler in (("busca", etapa_busca), ("detalhe", etapa_detalhe), ("classificar", etapa_classificar),
+                          ("preparar_zip", etapa_preparar_zip), ("download", etapa_download),
+                          ("extrair", etapa_extrair), ("mover", etapa_mover), ("comentario", etapa_comentario)):
+        pipeline.add_stage(nome, _com_contexto_tarefa(nome, handler), workers=workers.get(nome, 1), queue_size=filas.get(nome, 50),
+                           drain=share_writer.join if nome == "mover" else None)
+    return pipeline
+
+def obter_progresso():
+    """Contadores da execução em andamento no processo e estado do pipeline (publicados no status_registry)."""
+    estatisticas = _estatisticas_atuais or {}
+    return {
+        "contadores": {k: v for k, v in estatisticas.items() if isinstance(v, (int, float)) and not isinstance(v, bool)},
+        "pipeline": obter_status_pipeline(),
+        "downloads": get_download_governor().snapshot(),
+    }
+
+def realizar_processamento(start_date=None, end_date=None, force_execution=False, shards=None,
+                           empresas=None, dry_run=False, job_id=None, cancelamento=None):
+    """
+    Executa o processamento registrando início, progresso e resumo no status_registry
+    (consultado por /processing_status em qualquer processo). Parâmetros como em
+    _realizar_processamento; `job_id` é o job da fila que originou a execução.
+    """
+    execucao = start_date or date.today().strftime("%Y-%m-%d")
+    try:
+        registro = status_registry.registrar_inicio(execucao, job_id=job_id)
+    except Exception as e:
+        logger.warning(f"Registro de status indisponível: {e}")
+        registro = None
+    iniciado_em = pytime.time()
+    tracing.iniciar(execucao)
+    event_stream.definir_contexto(execucao, job_id)
+    event_stream.emitir("execucao_iniciada", simulacao=bool(dry_run))
+    log_index.definir_execucao(registro)
+    anterior = {"bytes": get_download_governor().snapshot()["bytes"], "t": pytime.monotonic()}
+    
+    def coletar():
+        # Progresso periódico: vai para o registro de status e para o stream de eventos (/events)
+        progresso = obter_progresso()
+        agora, baixados = pytime.monotonic(), progresso["downloads"]["bytes"]
+        progresso["bytes_por_s"] = round((baixados - anterior["bytes"]) / max(agora - anterior["t"], 1e-6))
+        anterior.update(bytes=baixados, t=agora)
+        event_stream.emitir("progresso", **progresso)
+        return progresso
+    
+    publicador = status_registry.ProgressPublisher(registro, coletar).start() if registro else None
+    ok = False
+    try:
+        ok = _realizar_processamento(start_date, end_date, force_execution, shards, empresas, dry_run, cancelamento)
+        return ok
+    finally:
+        resumo = _estatisticas_atuais
+        trace = tracing.finalizar()
+        if trace and resumo is not None:
+            resumo["tracing"] = trace
+            if trace["arquivo"]:
+                logger.info(f"Trace da execução salvo em: {trace['arquivo']}")
+            for nome, uso in list(trace["etapas"].items())[:10]:
+                logger.info(f"Span {nome}: {uso['total_s']:.1f}s em {uso['chamadas']} chamadas "
+                            f"(p50 {uso['p50_s']:.2f}s, p95 {uso['p95_s']:.2f}s, máx {uso['max_s']:.2f}s)")
+        if publicador is not None:
+            publicador.stop()
+            try:
+                status_registry.registrar_fim(registro, ok, resumo, mensagem=(resumo or {}).get("error"),
+                                              progresso=obter_progresso())
+            except Exception as e:
+                logger.warning(f"Não foi possível registrar o fim da execução: {e}")
+        if resumo is not None and not resumo.get("nao_iniciada"):
+            try:
+                run_history.registrar(resumo, ok, iniciado_em, chave_execucao(execucao, empresas, dry_run),
+                                      registro_id=registro, job_id=job_id)
+            except Exception as e:
+                logger.warning(f"Não foi possível gravar a execução no histórico: {e}")
+        event_stream.emitir("execucao_concluida", sucesso=bool(ok), mensagem=(resumo or {}).get("error"))
+        try:
+            event_stream.flush()
+        except Exception as e:
+            logger.debug(f"Falha ao gravar eventos: {e}")
+        log_index.definir_execucao(None)
+        aguardar_logs()
+
+def _realizar_processamento(start_date=None, end_date=None, force_execution=False, shards=None,
+                            empresas=None, dry_run=False, cancelamento=None):
     """
     Realiza o processamento de busca e download de documentos do Gestta.
     
+    A execução de uma data é coordenada entre processos (coordinator.py): as empresas são
+    divididas em shards e este processo processa os shards que conseguir reivindicar. Se a
+    data já estiver sendo processada por outro processo sem shards livres, retorna False.
+    
     Args:
         start_date (str, optional): Data inicial no formato YYYY-MM-DD para busca de tarefas.
         end_date (str, optional): Data final no formato YYYY-MM-DD para busca de tarefas.
         force_execution (bool, optional): Parâmetro mantido para compatibilidade, mas não utilizado.
+        shards (int, optional): Número de shards da rodada (padrão: RUN_SHARDS / settings.run_shards).
+        empresas (list, optional): Ids de empresas; restringe as empresas selecionadas a esse subconjunto.
+        dry_run (bool, optional): Apenas busca e classifica as tarefas, sem baixar, comentar ou alterar status.
+        cancelamento (threading.Event, optional): Quando sinalizado, interrompe a execução (lease do job perdido).
     
     Returns:
         bool: True se o processamento foi concluído com sucesso, False caso contrário.
     """
     start_processing_time = pytime.time()  # Aqui mudamos de time.time() para pytime.time()
+    config_module.ensure_runtime_dirs()
     logger.info("===== INICIANDO PROCESSAMENTO =====")
     
     estatisticas = {
@@ -85,29 +521,71 @@ def realizar_processamento(start_date=None, end_date=None, force_execution=False
         "empresas_carregadas": 0,
         "empresas_processadas": 0,
         "tarefas_concluidas": 0,
+        "tarefas_nao_processadas_por_prazo": 0,
+        "tarefas_adiadas_sem_espaco": 0,
+        "extracao_recusada": [],
+        "estrategia_zip": 0,
+        "estrategia_arquivos": 0,
+        "tarefas_simuladas": 0,
+        "documentos_por_empresa": {},
+        "simulacao": bool(dry_run),
         "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
+    global _estatisticas_atuais
+    _estatisticas_atuais = estatisticas
+    deadline = None
+    shard = None
+    
+    alert_date = date.today() 
+    if start_date:
+        try:
+            alert_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+        except ValueError:
+            logger.warning(f"Formato de data inválido: {start_date}. Usando data atual.")
+    # Simulações e execuções restritas a algumas empresas têm rodadas próprias no coordenador
+    execucao = chave_execucao(alert_date.strftime("%Y-%m-%d"), empresas, dry_run)
     
     try:
         selected_companies, selected_users = carregar_configuracoes()
         
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
+        coordenador = get_coordinator()
+        shard = coordenador.claim_shard(execucao, shards or config_module.RUN_SHARDS)
+        if shard is None:
+            ativos = coordenador.ativos(execucao)
+            estatisticas["error"] = (f"Processamento de {alert_date.strftime('%d/%m/%Y')} não iniciado: "
+                                     + (f"em execução por {', '.join(ativos)}" if ativos else "sem shards disponíveis"))
+            logger.warning(f"[COORDENADOR] {estatisticas['error']}")
+            estatisticas["nao_iniciada"] = True
+            return False
         
-        email = config.get("credentials", {}).get("email", "")
-        password = config.get("credentials", {}).get("password", "")
+        email, password = ler_credenciais()
         
         logger.info(f"Modo DEBUG: {'Ativado' if DEBUG_MODE else 'Desativado'}")
         logger.info(f"Diretório de download: {DOWNLOAD_BASE_DIR}")
 
-        token = get_token(email=email, password=password)
+        deadline = RunDeadline.from_config(cancelamento)
+        hedge_stats.reset()
+        api_metrics.reset()
+        # Writer, governador e staging vivem enquanto o processo (daemon); contadores são por execução
+        get_share_writer().reset()
+        get_download_governor().reset()
+        get_scratch_manager().reset()
+        get_scratch_manager().collect_orphans()
+        logger.info(f"Prazo da execução: {config_module.RUN_DEADLINE_SECONDS}s")
+
+        token = get_token(email=email, password=password, deadline=deadline)
         
         if not token:
             logger.error("Erro ao obter token. Encerrando.")
+            estatisticas["error"] = "Erro ao obter token"
             return False
 
-        companies = get_all_companies(token, selected_companies)
-        users = get_all_users(token, selected_users)
+        companies = get_all_companies(token, selected_companies, deadline=deadline)
+        if empresas:
+            empresas = set(empresas)
+            companies = [c for c in companies if c.get("_id") in empresas]
+            logger.info(f"Execução restrita a {len(companies)} de {len(empresas)} empresas pedidas")
+        users = get_all_users(token, selected_users, deadline=deadline)
         
         estatisticas["empresas_carregadas"] = len(companies)
         
@@ -116,159 +594,58 @@ def realizar_processamento(start_date=None, end_date=None, force_execution=False
         logger.info(f"Processando {len(companies)} empresas e {len(users)} usuários")
         if not companies or not users:
             logger.error("Nenhuma empresa ou usuário selecionado. Execute o Configurador Gestta primeiro.")
+            estatisticas["error"] = "Nenhuma empresa ou usuário selecionado"
             return False
         company_ids = [c["_id"] for c in companies if "_id" in c]
         user_ids = [u["_id"] for u in users if "_id" in u]
 
-        alert_date = date.today() 
-        if start_date:
-            try:
-                alert_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-            except ValueError:
-                logger.warning(f"Formato de data inválido: {start_date}. Usando data atual.")
-        
         alert_date_str_ini = alert_date.strftime("%Y-%m-%d") + "T00:00:00-03:00"
         alert_date_str_fim = alert_date.strftime("%Y-%m-%d") + "T23:59:59-03:00"
         
         logger.info(f"[PROCESSAMENTO] Buscando tarefas com vencimento hoje: {alert_date.strftime('%d/%m/%Y')}")
         
-        tasks_today = search_all_customer_tasks(token, company_ids, user_ids, alert_date_str_ini, alert_date_str_fim)
-        estatisticas["tarefas_verificadas"] = len(tasks_today)
-
         fiscal_phrases, contabil_phrases = load_task_phrases()
-        all_phrases = fiscal_phrases + contabil_phrases
-        filtered_tasks = []
         
-        for task in tasks_today:
-            name_lower = task.get("name", "").lower()
-            if any(phrase in name_lower for phrase in all_phrases):
-                filtered_tasks.append(task)
-        
-        logger.info(f"Encontradas {len(filtered_tasks)} tarefas de cobrança de documentos com vencimento hoje")
-        estatisticas["tarefas_filtradas"] = len(filtered_tasks)
-        
-        for task in filtered_tasks:
-            task_id = task.get("_id")
-            task_name = task.get("name", "")
-            
-            logger.info(f"Processando tarefa: {task_name} (ID: {task_id})")
-            
-            detail = get_task_detail(token, task_id)
-            if not detail:
-                logger.error(f"Não foi possível obter detalhes da tarefa {task_id}. Pulando.")
-                continue
-            
-            from api import tarefa_possui_arquivos
-            tem_documentos_completos = tarefa_possui_arquivos(detail, verificar_completo=True)
-            tem_alguns_documentos = tarefa_possui_arquivos(detail, verificar_completo=False)
-            
-            competencia = "XX/XXXX"
-            if date_field := detail.get("competence_date"):
-                try:
-                    data_competencia = datetime.fromisoformat(date_field.replace("Z", "+00:00"))
-                    competencia = f"{data_competencia.month:02d}/{data_competencia.year}"
-                except Exception as e:
-                    logger.warning(f"Erro ao extrair data de competência: {e}")
-            
-            if tem_documentos_completos:
-                logger.info(f"Tarefa {task_id} possui todos os documentos. Realizando download.")
-                docs_baixados = process_task_documents(token, detail, debug_mode=DEBUG_MODE)
-                estatisticas["documentos_baixados"] += docs_baixados
-                estatisticas["tarefas_processadas_com_sucesso"] += 1 if docs_baixados > 0 else 0
-                
-            elif tem_alguns_documentos:
-                logger.info(f"Tarefa {task_id} possui documentos parciais. Baixando disponíveis e enviando aviso.")
-                docs_baixados = process_task_documents(token, detail, debug_mode=DEBUG_MODE)
-                estatisticas["documentos_baixados"] += docs_baixados
-                estatisticas["tarefas_processadas_com_sucesso"] += 1 if docs_baixados > 0 else 0
-                
-                from api import send_task_comment
-                
-                tipo_fechamento = "contábil"
-                if any(phrase in task_name.lower() for phrase in fiscal_phrases):
-                    tipo_fechamento = "fiscal"
-                    
-                customers_list = detail.get("customers", [])
-                if not customers_list:
-                    customers_list = [{"customer": detail.get("customer", {})}]
-                
-                alertas_enviados = 0
-                
-                for customer_item in customers_list:
-                    customer = customer_item.get("customer", {}) if isinstance(customer_item, dict) else {}
-                    customer_id = customer.get("_id")
-                    
-                    company_department = detail.get("company_department", {}).get("_id")
-                    if not company_department:
-                        company_department = customer.get("department_id")
-                        if not company_department and isinstance(customer_item, dict):
-                            company_department = customer_item.get("department_id")
-                    
-                    if not customer_id or not company_department:
-                        logger.warning(f"Cliente ignorado: Não foi possível obter customer_id ou company_department")
-                        logger.debug(f"Customer ID: {customer_id}, Company Department: {company_department}")
-                        continue
-                        
-                    logger.info(f"Enviando alerta de documentos incompletos para cliente: {customer.get('name', 'Nome desconhecido')}")
-                    resp_comment = send_task_comment(token, task_id, competence=competencia, 
-                                                   customer_id=customer_id, company_department=company_department)
-                    
-                    if "sucesso" in resp_comment.lower():
-                        alertas_enviados += 1
-                
-                estatisticas["alertas_enviados"] += alertas_enviados
-                logger.info(f"Total de alertas enviados para esta tarefa: {alertas_enviados}")
-                
-            else:
-                logger.info(f"Tarefa {task_id} não possui documentos. Enviando aviso.")
-                estatisticas["tarefas_sem_documentos"] += 1
-                
-                tipo_fechamento = "contábil"
-                if any(phrase in task_name.lower() for phrase in fiscal_phrases):
-                    tipo_fechamento = "fiscal"
-                    
-                from api import send_task_comment
-                
-                customers_list = detail.get("customers", [])
-                if not customers_list:
-                    customers_list = [{"customer": detail.get("customer", {})}]
-                
-                alertas_enviados = 0
-                
-                for customer_item in customers_list:
-                    customer = customer_item.get("customer", {}) if isinstance(customer_item, dict) else {}
-                    customer_id = customer.get("_id")
-                    
-                    company_department = detail.get("company_department", {}).get("_id")
-                    if not company_department:
-                        company_department = customer.get("department_id")
-                        if not company_department and isinstance(customer_item, dict):
-                            company_department = customer_item.get("department_id")
-                    
-                    if not customer_id or not company_department:
-                        logger.warning(f"Cliente ignorado: Não foi possível obter customer_id ou company_department")
-                        logger.debug(f"Customer ID: {customer_id}, Company Department: {company_department}")
-                        continue
-                        
-                    logger.info(f"Enviando alerta de documentos faltantes para cliente: {customer.get('name', 'Nome desconhecido')}")
-                    resp_comment = send_task_comment(token, task_id, competence=competencia, 
-                                                   customer_id=customer_id, company_department=company_department)
-                    
-                    if "sucesso" in resp_comment.lower():
-                        alertas_enviados += 1
-                
-                estatisticas["alertas_enviados"] += alertas_enviados
-                logger.info(f"Total de alertas enviados para esta tarefa: {alertas_enviados}")
-            
-            resultado_status = update_task_status(token, task_id)
-            logger.info(f"Resultado da alteração de status: {resultado_status}")
-            estatisticas["tarefas_concluidas"] += 1
+        estatisticas["shards"] = []
+        while shard is not None:
+            with shard:
+                ids_shard = dividir_em_shards(company_ids, shard.shard, shard.total)
+                if shard.total > 1:
+                    logger.info(f"[COORDENADOR] Processando {shard!r}: {len(ids_shard)} de {len(company_ids)} empresas")
+                if not ids_shard:
+                    # Menos empresas que shards: sem empresas, a busca não tem o que filtrar; o shard é concluído vazio
+                    logger.info(f"[COORDENADOR] {shard!r} sem empresas; concluído sem busca")
+                else:
+                    pipeline = montar_pipeline(token, estatisticas, deadline, fiscal_phrases, contabil_phrases,
+                                               empresas_com_documentos, dry_run=dry_run, lease=shard)
+                    # Lease perdido: outro worker já retomou o shard; a execução é interrompida
+                    shard.ao_perder(pipeline.abort)
+                    shard.ao_perder(deadline.cancel)
+                    _executar_pipeline(pipeline, {
+                        "company_ids": ids_shard,
+                        "user_ids": user_ids,
+                        "inicio": alert_date_str_ini,
+                        "fim": alert_date_str_fim,
+                    })
+                    estatisticas["pipeline"] = pipeline.snapshot()
+                estatisticas["shards"].append({"shard": shard.shard, "total": shard.total,
+                                               "empresas": len(ids_shard), "lease_perdido": shard.perdida})
+                shard.check()
+            shard = coordenador.claim_shard(execucao, shard.total, rodada=shard.rodada)
+        estatisticas["share_writer"] = dict(get_share_writer().stats)
+        estatisticas["downloads"] = get_download_governor().snapshot()
+        estatisticas["staging"] = get_scratch_manager().snapshot()
+        get_download_history().save()
         
         estatisticas["empresas_processadas"] = len(empresas_com_documentos)
         
         end_processing_time = pytime.time()  # Aqui também
         total_time = end_processing_time - start_processing_time
         estatisticas["tempo_total"] = total_time
+        estatisticas["orcamento_etapas"] = deadline.summary()
+        estatisticas["hedging"] = hedge_stats.snapshot()
+        estatisticas["http"] = api_metrics.snapshot()
+        estatisticas["http_lentas"] = api_metrics.chamadas_lentas()
         if total_time < 60:
             tempo_total_str = f"{total_time:.2f} seg"
         else:
@@ -282,6 +659,17 @@ def realizar_processamento(start_date=None, end_date=None, force_execution=False
         logger.info(f"Alertas Enviados: {estatisticas['alertas_enviados']}")
         logger.info(f"Tarefas Processadas com Sucesso: {estatisticas['tarefas_processadas_com_sucesso']}")
         logger.info(f"Documentos Baixados: {estatisticas['documentos_baixados']}")
+        if dry_run:
+            logger.info(f"Tarefas Simuladas (sem alterações no Gestta): {estatisticas['tarefas_simuladas']}")
+        for etapa, uso in estatisticas["orcamento_etapas"]["etapas"].items():
+            logger.info(f"Etapa {etapa}: {uso['usado_s']:.1f}s de {uso['orcamento_s'] or '-'}s "
+                        f"({uso['chamadas']} chamadas, p95 {uso['p95_s']:.2f}s, máx {uso['max_s']:.2f}s)")
+        for endpoint, uso in estatisticas["http"].items():
+            logger.info(f"HTTP {endpoint}: {uso['chamadas']} chamadas, p50 {uso['p50_s']}s, p95 {uso['p95_s']}s, "
+                        f"máx {uso['max_s']}s, {uso['erros']} erros, {uso['retentativas']} repetições, "
+                        f"{uso['lentas']} lentas, status {uso['status']}")
+        for recusa in estatisticas["extracao_recusada"]:
+            logger.warning(f"Extração recusada: tarefa {recusa['tarefa']} ({recusa['nome']}) - {recusa['motivo']}")
         # imagem_path = gerar_dashboard_estatisticas(estatisticas)
         # logger.info(f"Dashboard de estatísticas salvo em: {imagem_path}")
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -296,47 +684,40 @@ def realizar_processamento(start_date=None, end_date=None, force_execution=False
             f.write(f"Alertas Enviados: {estatisticas['alertas_enviados']}\n")
             f.write(f"Tarefas Processadas com Sucesso: {estatisticas['tarefas_processadas_com_sucesso']}\n")
             f.write(f"Documentos Baixados: {estatisticas['documentos_baixados']}\n")
+            for etapa, uso in estatisticas["orcamento_etapas"]["etapas"].items():
+                f.write(f"Etapa {etapa}: {uso['usado_s']:.1f}s de {uso['orcamento_s'] or '-'}s "
+                        f"({uso['chamadas']} chamadas, p95 {uso['p95_s']:.2f}s, máx {uso['max_s']:.2f}s)\n")
+            for recusa in estatisticas["extracao_recusada"]:
+                f.write(f"Extração recusada: tarefa {recusa['tarefa']} ({recusa['nome']}) - {recusa['motivo']}\n")
         logger.info(f"Log de execução salvo em: {log_path}")
         logger.info("Execução finalizada com sucesso.")
-        # Persist a JSON summary so frontend can display it
-        summary_path = os.path.join("logs", f"last_run_summary_{timestamp}.json")
-        try:
-            with open(summary_path, 'w', encoding='utf-8') as sf:
-                json.dump(estatisticas, sf, default=str, indent=2)
-            logger.info(f"Resumo da execução salvo em: {summary_path}")
-        except Exception as e:
-            logger.warning(f"Não foi possível salvar resumo da execução: {e}")
+        # O resumo completo (com tempos por etapa e documentos por empresa) vai para o run_history
         return True
     except Exception as e:
         logger.error(f"Erro durante o processamento: {str(e)}", exc_info=True)
-        # write a minimal summary even on error
-        try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            summary_path = os.path.join("logs", f"last_run_summary_{timestamp}.json")
-            with open(summary_path, 'w', encoding='utf-8') as sf:
-                err_summary = {"error": str(e), "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-                json.dump(err_summary, sf, default=str, indent=2)
-            logger.info(f"Resumo (erro) salvo em: {summary_path}")
-        except Exception:
-            logger.debug('Falha ao gravar resumo de erro')
+        estatisticas["error"] = str(e)
+        estatisticas["tempo_total"] = pytime.time() - start_processing_time
+        if deadline is not None:
+            estatisticas["orcamento_etapas"] = deadline.summary()
         return False
+    finally:
+        # Saída antecipada (sem token, sem empresas) ou erro fora do shard: devolve-o à fila
+        if shard is not None and shard.ativa:
+            shard.fail("execução interrompida")
 
 # The hourly verification function was removed — use realizar_processamento directly.
 
 def programar_verificacoes():
-    # Configurar para executar todos os dias às 8:30 com data atual
-    schedule.every().day.at("08:30").do(lambda: realizar_processamento(
-        start_date=datetime.now().strftime("%Y-%m-%d"),
-        end_date=datetime.now().strftime("%Y-%m-%d")
-    ))
-    
-    logger.info("🤖 Sistema iniciado com processamento automático às 08:30 diariamente")
-    logger.info("📅 O robô processará tarefas da data atual automaticamente")
-    logger.info("⏰ Próxima execução: todos os dias às 08:30")
+    """
+    Executa agora (com as datas de --start-date/--end-date, se informadas, ou a data atual) e
+    segue como worker daemon: execuções diárias no próprio processo, com token, catálogos e
+    conexões mantidos entre elas, e socket de controle para execuções pedidas pelo app web.
+    """
+    from worker_daemon import main as iniciar_worker
     
-    import sys
     start_date = None
     end_date = None
+    shards = None
     
     # Verificar se foram passadas datas via argumentos de linha de comando
     if len(sys.argv) > 1:
@@ -345,20 +726,9 @@ def programar_verificacoes():
                 start_date = sys.argv[i + 1]
             elif arg == "--end-date" and i < len(sys.argv) - 1:
                 end_date = sys.argv[i + 1]
+            elif arg == "--shards" and i < len(sys.argv) - 1:
+                shards = int(sys.argv[i + 1])
     
-    # Se foram fornecidas datas, executar com essas datas
-    if start_date or end_date:
-        logger.info(f"🎯 Executando AGORA com datas personalizadas: {start_date or 'hoje'} até {end_date or start_date or 'hoje'}")
-        realizar_processamento(start_date, end_date)
-    else:
-        # Senão, executar uma vez com a data atual
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        logger.info(f"🚀 Executando AGORA com data atual: {current_date}")
-        realizar_processamento(start_date=current_date, end_date=current_date)
-    
-    logger.info("⏱️ Aguardando próxima execução programada...")
-    
-    # Loop principal do scheduler
-    while True:
-        schedule.run_pending()
-        pytime.sleep(60)  # Verificar a cada minuto
+    logger.info("🤖 Sistema iniciado com processamento automático diário (worker daemon)")
+    logger.info(f"🚀 Executando AGORA: {start_date or 'hoje'} até {end_date or start_date or 'hoje'}")
+    iniciar_worker(executar_agora=True, start_date=start_date, end_date=end_date, shards=shards)
@@ -0,0 +1,272 @@
+# run_history.py
+"""
+Histórico das execuções no banco de estado compartilhado (SQLite), com índices para as consultas
+de tendência usadas por /historico:
+
+- últimas N execuções;
+- p95 (e mediana) do tempo de execução por semana;
+- documentos baixados por empresa por mês.
+
+Cada execução grava uma linha com os totais, os tempos por etapa (orçamento do RunDeadline, spans
+do tracing.py e latência por endpoint da API) e os documentos por empresa, em tabelas separadas.
+`exportar()` gera um arquivo colunar compacto (JSON com uma lista por coluna, gzip) para análise
+fora do sistema.
+
+Uso pela linha de comando:
+    python run_history.py --importar          # importa os logs/last_run_summary_*.json antigos
+    python run_history.py --exportar arquivo  # exporta o histórico (padrão: logs/historico_<ts>.json.gz)
+"""
+import glob
+import gzip
+import json
+import math
+import os
+import time
+import uuid
+from datetime import datetime
+
+import config as config_module
+import state_db
+from logger_config import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS historico_execucoes (
+    id TEXT PRIMARY KEY,
+    execucao TEXT NOT NULL,
+    data TEXT,
+    job_id INTEGER,
+    iniciado_em REAL NOT NULL,
+    concluido_em REAL NOT NULL,
+    semana TEXT NOT NULL,
+    mes TEXT NOT NULL,
+    sucesso INTEGER NOT NULL,
+    simulacao INTEGER NOT NULL DEFAULT 0,
+    duracao_s REAL,
+    tarefas_verificadas INTEGER,
+    tarefas_filtradas INTEGER,
+    tarefas_processadas INTEGER,
+    documentos_baixados INTEGER,
+    alertas_enviados INTEGER,
+    empresas_processadas INTEGER,
+    erro TEXT,
+    resumo TEXT
+);
+CREATE INDEX IF NOT EXISTS historico_execucoes_inicio ON historico_execucoes (iniciado_em);
+CREATE INDEX IF NOT EXISTS historico_execucoes_semana ON historico_execucoes (semana, sucesso, simulacao, duracao_s);
+CREATE TABLE IF NOT EXISTS historico_etapas (
+    execucao_id TEXT NOT NULL,
+    etapa TEXT NOT NULL,
+    usado_s REAL,
+    chamadas INTEGER,
+    p95_s REAL,
+    max_s REAL,
+    esgotado INTEGER,
+    PRIMARY KEY (execucao_id, etapa)
+);
+CREATE TABLE IF NOT EXISTS historico_empresas (
+    execucao_id TEXT NOT NULL,
+    mes TEXT NOT NULL,
+    empresa TEXT NOT NULL,
+    codigo TEXT,
+    tarefas INTEGER NOT NULL,
+    documentos INTEGER NOT NULL,
+    PRIMARY KEY (execucao_id, empresa)
+);
+CREATE INDEX IF NOT EXISTS historico_empresas_mes ON historico_empresas (mes, empresa, codigo, tarefas, documentos);
+"""
+
+_COLUNAS_EXECUCOES = ("id", "execucao", "data", "job_id", "iniciado_em", "concluido_em", "semana", "mes", "sucesso",
+                      "simulacao", "duracao_s", "tarefas_verificadas", "tarefas_filtradas", "tarefas_processadas",
+                      "documentos_baixados", "alertas_enviados", "empresas_processadas", "erro")
+
+
+def _conn():
+    return state_db.ensure_schema("run_history", SCHEMA)
+
+
+def _semana(ts):
+    ano, semana, _ = datetime.fromtimestamp(ts).isocalendar()
+    return f"{ano}-W{semana:02d}"
+
+
+def registrar(estatisticas, sucesso, iniciado_em, execucao, registro_id=None, job_id=None, concluido_em=None):
+    """
+    Grava o resumo de uma execução (dicionário de estatísticas de _realizar_processamento).
+    `execucao` é a data processada (YYYY-MM-DD); o mês dos documentos por empresa é o dessa data.
+    """
+    estatisticas = estatisticas or {}
+    registro_id = registro_id or uuid.uuid4().hex
+    concluido_em = concluido_em or time.time()
+    data = execucao.split(":")[0] if execucao else datetime.fromtimestamp(iniciado_em).strftime("%Y-%m-%d")
+    mes = data[:7]
+    etapas = dict((estatisticas.get("orcamento_etapas") or {}).get("etapas", {}))
+    # Spans do trace (pipeline.*, share.*) entram como etapas; os de mesmo nome já vêm do orçamento
+    for nome, uso in ((estatisticas.get("tracing") or {}).get("etapas") or {}).items():
+        etapas.setdefault(nome, dict(uso, usado_s=uso.get("total_s")))
+    # Latência por endpoint da API (api_metrics) como etapas http.<endpoint>
+    for nome, uso in (estatisticas.get("http") or {}).items():
+        etapas[f"http.{nome}"] = dict(uso, usado_s=uso.get("total_s"), esgotado=False)
+    empresas = estatisticas.get("documentos_por_empresa") or {}
+    conn = _conn()
+    with state_db.transaction(conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO historico_execucoes (id, execucao, data, job_id, iniciado_em, concluido_em, "
+            "semana, mes, sucesso, simulacao, duracao_s, tarefas_verificadas, tarefas_filtradas, tarefas_processadas, "
+            "documentos_baixados, alertas_enviados, empresas_processadas, erro, resumo) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (registro_id, execucao or data, data, job_id, iniciado_em, concluido_em, _semana(iniciado_em), mes,
+             1 if sucesso else 0, 1 if estatisticas.get("simulacao") else 0,
+             estatisticas.get("tempo_total") or round(concluido_em - iniciado_em, 3),
+             estatisticas.get("tarefas_verificadas"), estatisticas.get("tarefas_filtradas"),
+             estatisticas.get("tarefas_processadas_com_sucesso"), estatisticas.get("documentos_baixados"),
+             estatisticas.get("alertas_enviados"), estatisticas.get("empresas_processadas"),
+             estatisticas.get("error"), json.dumps(estatisticas, default=str)))
+        conn.executemany(
+            "INSERT OR REPLACE INTO historico_etapas (execucao_id, etapa, usado_s, chamadas, p95_s, max_s, esgotado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(registro_id, etapa, uso.get("usado_s"), uso.get("chamadas"), uso.get("p95_s"), uso.get("max_s"),
+              1 if uso.get("esgotado") else 0) for etapa, uso in etapas.items()])
+        conn.executemany(
+            "INSERT OR REPLACE INTO historico_empresas (execucao_id, mes, empresa, codigo, tarefas, documentos) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(registro_id, mes, empresa, dados.get("codigo"), dados.get("tarefas", 0), dados.get("documentos", 0))
+             for empresa, dados in empresas.items()])
+    return registro_id
+
+
+# Consultas ----------------------------------------------------------------
+
+def _formatar(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else None
+
+
+def ultimas(n=20, incluir_simulacoes=False):
+    """Últimas `n` execuções (mais recentes primeiro), com os tempos por etapa."""
+    conn = _conn()
+    rows = conn.execute(
+        f"SELECT {', '.join(_COLUNAS_EXECUCOES)} FROM historico_execucoes "
+        + ("" if incluir_simulacoes else "WHERE simulacao = 0 ")
+        + "ORDER BY iniciado_em DESC LIMIT ?", (n,)).fetchall()
+    execucoes = [dict(row) for row in rows]
+    if execucoes:
+        marcadores = ", ".join("?" * len(execucoes))
+        etapas = {}
+        for row in conn.execute(f"SELECT * FROM historico_etapas WHERE execucao_id IN ({marcadores})",
+                                [e["id"] for e in execucoes]):
+            etapas.setdefault(row["execucao_id"], {})[row["etapa"]] = {
+                "usado_s": row["usado_s"], "chamadas": row["chamadas"], "p95_s": row["p95_s"], "max_s": row["max_s"],
+                "esgotado": bool(row["esgotado"])}
+        for execucao in execucoes:
+            execucao["etapas"] = etapas.get(execucao["id"], {})
+            execucao["sucesso"] = bool(execucao["sucesso"])
+            execucao["simulacao"] = bool(execucao["simulacao"])
+            execucao["iniciado_em"] = _formatar(execucao["iniciado_em"])
+            execucao["concluido_em"] = _formatar(execucao["concluido_em"])
+    return execucoes
+
+
+def _percentil(valores_ordenados, pct):
+    if not valores_ordenados:
+        return None
+    return valores_ordenados[max(0, math.ceil(pct / 100 * len(valores_ordenados)) - 1)]
+
+
+def tempo_por_semana(semanas=12):
+    """
+    p50/p95/máximo do tempo de execução (segundos) por semana ISO, das execuções reais concluídas
+    com sucesso nas últimas `semanas` semanas (mais antigas primeiro).
+    """
+    desde = time.time() - semanas * 7 * 86400
+    por_semana = {}
+    for row in _conn().execute(
+            "SELECT semana, duracao_s FROM historico_execucoes INDEXED BY historico_execucoes_semana "
+            "WHERE semana >= ? AND sucesso = 1 AND simulacao = 0 AND duracao_s IS NOT NULL "
+            "ORDER BY semana, duracao_s", (_semana(desde),)):
+        por_semana.setdefault(row["semana"], []).append(row["duracao_s"])
+    return [{"semana": semana, "execucoes": len(duracoes), "p50_s": round(_percentil(duracoes, 50), 3),
+             "p95_s": round(_percentil(duracoes, 95), 3), "max_s": round(duracoes[-1], 3)}
+            for semana, duracoes in por_semana.items()]
+
+
+def documentos_por_empresa(meses=6, empresa=None):
+    """Documentos baixados e tarefas com documentos por empresa e mês (mês da data processada)."""
+    hoje = datetime.now()
+    indice = hoje.year * 12 + hoje.month - 1 - (meses - 1)
+    desde = f"{indice // 12:04d}-{indice % 12 + 1:02d}"
+    parametros = [desde]
+    filtro = ""
+    if empresa:
+        filtro = "AND (empresa = ? OR codigo = ?) "
+        parametros += [empresa, empresa]
+    # Simulações não baixam documentos: só execuções reais têm linhas em historico_empresas
+    rows = _conn().execute(
+        "SELECT mes, empresa, MAX(codigo) AS codigo, SUM(tarefas) AS tarefas, SUM(documentos) AS documentos "
+        "FROM historico_empresas WHERE mes >= ? " + filtro +
+        "GROUP BY mes, empresa ORDER BY mes, documentos DESC", parametros).fetchall()
+    return [dict(row) for row in rows]
+
+
+# Exportação e importação ----------------------------------------------------
+
+def _colunas(cursor):
+    nomes = [d[0] for d in cursor.description]
+    colunas = {nome: [] for nome in nomes}
+    for row in cursor:
+        for nome, valor in zip(nomes, row):
+            colunas[nome].append(valor)
+    return colunas
+
+
+def exportar(caminho=None):
+    """
+    Exporta o histórico em formato colunar compacto: um JSON gzip com, por tabela, uma lista de
+    valores por coluna (sem o resumo JSON completo de cada execução). Retorna o caminho gerado.
+    """
+    caminho = caminho or os.path.join(config_module.LOGS_DIR,
+                                      f"historico_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json.gz")
+    conn = _conn()
+    tabelas = {
+        "execucoes": _colunas(conn.execute(
+            f"SELECT {', '.join(_COLUNAS_EXECUCOES)} FROM historico_execucoes ORDER BY iniciado_em")),
+        "etapas": _colunas(conn.execute("SELECT * FROM historico_etapas ORDER BY execucao_id, etapa")),
+        "empresas": _colunas(conn.execute("SELECT * FROM historico_empresas ORDER BY mes, empresa")),
+    }
+    with gzip.open(caminho, "wt", encoding="utf-8") as f:
+        json.dump({"gerado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "tabelas": tabelas}, f,
+                  separators=(",", ":"), default=str)
+    return caminho
+
+
+def importar_resumos(padrao=None):
+    """Importa os resumos antigos (logs/last_run_summary_*.json); arquivos já importados são ignorados."""
+    padrao = padrao or os.path.join(config_module.LOGS_DIR, "last_run_summary_*.json")
+    importados = 0
+    for caminho in sorted(glob.glob(padrao)):
+        registro_id = "arquivo:" + os.path.basename(caminho)
+        if _conn().execute("SELECT 1 FROM historico_execucoes WHERE id = ?", (registro_id,)).fetchone():
+            continue
+        try:
+            with open(caminho, "r", encoding="utf-8") as f:
+                estatisticas = json.load(f)
+            concluido_em = datetime.strptime(os.path.basename(caminho)[len("last_run_summary_"):-len(".json")],
+                                             "%Y%m%d_%H%M%S").timestamp()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Resumo ignorado ({caminho}): {e}")
+            continue
+        iniciado_em = concluido_em - (estatisticas.get("tempo_total") or 0)
+        registrar(estatisticas, "error" not in estatisticas, iniciado_em, None, registro_id=registro_id,
+                  concluido_em=concluido_em)
+        importados += 1
+    return importados
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Histórico de execuções")
+    parser.add_argument("--importar", action="store_true", help="Importa os resumos JSON antigos da pasta de logs")
+    parser.add_argument("--exportar", nargs="?", const="", metavar="ARQUIVO", help="Exporta o histórico (JSON gzip colunar)")
+    args = parser.parse_args()
+    if args.importar:
+        print(f"{importar_resumos()} resumo(s) importado(s)")
+    if args.exportar is not None:
+        print(f"Histórico exportado em {exportar(args.exportar or None)}")
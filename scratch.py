@@ -0,0 +1,313 @@
+# scratch.py
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+import config as config_module
+from logger_config import logger
+
+REGISTRY_DIRNAME = ".scratch"
+
+# Pastas de staging criadas pelo sistema (pastas de tarefa com timestamp, ZIPs e fallbacks)
+_STAGING_PATTERN = re.compile(r"^(task_.+|gestta_download_.+|gestta_task_.+|.+_\d{8}_\d{6})$")
+
+
+class ScratchFull(Exception):
+    """Sem espaço de staging disponível dentro do tempo de espera: a tarefa deve ser adiada."""
+
+
+def folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchManager:
+    """
+    Controle das pastas de staging locais (downloads antes da cópia para a rede).
+
+    - toda pasta entregue por `allocate()` fica registrada em `<base>/.scratch/<dono>.json`, onde o
+      dono é único por processo (host, pid e um sufixo aleatório) e o registro é renovado a cada
+      SCRATCH_HEARTBEAT_SECONDS; PIDs não servem de dono entre containers nem após reinícios;
+    - admissão: só entrega uma pasta se houver espaço livre (SCRATCH_MIN_FREE_BYTES) e cota
+      (SCRATCH_QUOTA_BYTES) para a reserva pedida; senão aguarda até SCRATCH_ADMISSION_WAIT
+      segundos e levanta ScratchFull (a tarefa é adiada para a próxima execução);
+    - `collect_orphans()` remove pastas de donos sem renovação há SCRATCH_OWNER_TIMEOUT_SECONDS e
+      sobras antigas não registradas;
+    - tarefas pequenas podem ir para um tmpfs (SCRATCH_TMPFS_DIR).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._folders = {}
+        self.dono = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._heartbeat = None
+        self.reset()
+
+    # Registro persistente -------------------------------------------------
+
+    def _registry_dir(self):
+        return os.path.join(config_module.DOWNLOAD_BASE_DIR, REGISTRY_DIRNAME)
+
+    def _save_registry(self):
+        registry_dir = self._registry_dir()
+        path = os.path.join(registry_dir, f"{self.dono}.json")
+        try:
+            os.makedirs(registry_dir, exist_ok=True)
+            with self._cond:
+                if self._heartbeat is None:
+                    self._heartbeat = threading.Thread(target=self._renew_registry, name="scratch-heartbeat",
+                                                       daemon=True)
+                    self._heartbeat.start()
+                data = {"dono": self.dono, "pid": os.getpid(), "renovado_em": time.time(),
+                        "pastas": {p: dict(info) for p, info in self._folders.items()}}
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"[SCRATCH] Não foi possível salvar o registro de staging: {e}")
+
+    def _renew_registry(self):
+        while True:
+            time.sleep(config_module.SCRATCH_HEARTBEAT_SECONDS)
+            self._save_registry()
+
+    # Admissão -------------------------------------------------------------
+
+    def _in_use(self):
+        """Reserva de cada pasta em uso (chamar com o lock)."""
+        return {path: info["reserva"] for path, info in self._folders.items() if not info.get("retida")}
+
+    @staticmethod
+    def _measure(base_dir, folders):
+        """
+        Espaço ocupado e parte das reservas ainda não ocupada pelas pastas em uso, e espaço livre
+        em base_dir. Percorre o disco: chamar sem o lock.
+        """
+        used = 0
+        pending = 0
+        for path, reserve in folders.items():
+            size = folder_size(path)
+            used += size
+            pending += max(0, reserve - size)
+        try:
+            free = shutil.disk_usage(base_dir).free
+        except OSError:
+            free = None
+        return used, pending, free
+
+    def _admissible(self, base_dir, reserve, measured, used, pending, free):
+        # Pastas entregues depois da medição ainda não foram medidas: contam a reserva inteira
+        pending += sum(r for path, r in self._in_use().items() if path not in measured)
+        quota = config_module.SCRATCH_QUOTA_BYTES
+        if quota and self._folders and used + pending + reserve > quota:
+            return False, f"cota de staging ({used + pending} de {quota} bytes em uso/reservados)"
+        if free is None:
+            return True, ""
+        if free - pending - reserve < config_module.SCRATCH_MIN_FREE_BYTES:
+            return False, f"espaço livre insuficiente em {base_dir} ({free} bytes livres)"
+        return True, ""
+
+    def base_dir_for(self, expected_bytes, default_dir):
+        """tmpfs para tarefas pequenas (quando configurado e com espaço), senão o diretório padrão."""
+        tmpfs_dir = config_module.SCRATCH_TMPFS_DIR
+        if not tmpfs_dir or not expected_bytes or expected_bytes > config_module.SCRATCH_TMPFS_MAX_BYTES:
+            return default_dir
+        try:
+            os.makedirs(tmpfs_dir, exist_ok=True)
+            if shutil.disk_usage(tmpfs_dir).free - expected_bytes >= config_module.SCRATCH_TMPFS_MIN_FREE_BYTES:
+                return tmpfs_dir
+        except OSError as e:
+            logger.warning(f"[SCRATCH] tmpfs indisponível ({tmpfs_dir}): {e}")
+        return default_dir
+
+    def allocate(self, path, expected_bytes=None, deadline=None, wait=True):
+        """
+        Cria e registra a pasta de staging `path`, reservando `expected_bytes`
+        (SCRATCH_DEFAULT_RESERVE_BYTES quando desconhecido).
+        Levanta ScratchFull se não houver espaço dentro do tempo de espera.
+        """
+        path = os.path.abspath(path)
+        reserve = int(expected_bytes) if expected_bytes else config_module.SCRATCH_DEFAULT_RESERVE_BYTES
+        base_dir = os.path.dirname(path) or "."
+        os.makedirs(base_dir, exist_ok=True)
+        start = time.monotonic()
+        limit = start + (config_module.SCRATCH_ADMISSION_WAIT if wait else 0)
+        warned = False
+        while True:
+            # O tamanho das pastas é medido fora do lock para não travar release() e outras admissões
+            with self._cond:
+                measured = self._in_use()
+            used, pending, free = self._measure(base_dir, measured)
+            with self._cond:
+                ok, reason = self._admissible(base_dir, reserve, measured, used, pending, free)
+                if ok:
+                    os.makedirs(path, exist_ok=True)
+                    self._folders[path] = {"reserva": reserve, "criada": time.time()}
+                    self.stats["pastas"] += 1
+                    self.stats["espera_s"] += time.monotonic() - start
+                    if config_module.SCRATCH_TMPFS_DIR and path.startswith(os.path.abspath(config_module.SCRATCH_TMPFS_DIR)):
+                        self.stats["tmpfs"] += 1
+                    break
+                if time.monotonic() >= limit:
+                    self.stats["adiadas"] += 1
+                    raise ScratchFull(f"Sem espaço de staging para {os.path.basename(path)}: {reason}")
+                if not warned:
+                    logger.warning(f"[SCRATCH] Aguardando espaço de staging: {reason}")
+                    warned = True
+                if deadline is not None:
+                    deadline.check()
+                self._cond.wait(timeout=min(5.0, max(0.1, limit - time.monotonic())))
+        self._save_registry()
+        return path
+
+    def track(self, path, expected_bytes=None):
+        """Registra uma pasta de staging criada fora de `allocate()` (fallbacks), sem admissão."""
+        path = os.path.abspath(path)
+        with self._cond:
+            self._folders.setdefault(path, {"reserva": int(expected_bytes or 0), "criada": time.time()})
+        self._save_registry()
+
+    def release(self, path, remove=False):
+        """
+        Devolve a pasta. Se ainda existir (cópia para a rede falhou ou modo debug) e `remove`
+        for False, fica retida no registro até SCRATCH_RETENTION_HOURS e é removida pela limpeza.
+        """
+        path = os.path.abspath(path)
+        if remove and os.path.exists(path):
+            size = folder_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            with self._cond:
+                self.stats["bytes_liberados"] += size
+        with self._cond:
+            if os.path.exists(path):
+                info = self._folders.setdefault(path, {"reserva": 0, "criada": time.time()})
+                info["retida"] = time.time()
+            else:
+                self._folders.pop(path, None)
+            self._cond.notify_all()
+        self._save_registry()
+
+    # Limpeza --------------------------------------------------------------
+
+    def _remove(self, path, reason):
+        if not os.path.exists(path):
+            return
+        size = folder_size(path) if os.path.isdir(path) else os.path.getsize(path)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"[SCRATCH] Não foi possível remover {path}: {e}")
+            return
+        logger.info(f"[SCRATCH] Removido ({reason}): {path}")
+        self.stats["orfas_removidas"] += 1
+        self.stats["bytes_liberados"] += size
+
+    def collect_orphans(self):
+        """
+        Remove pastas em uso registradas por donos cujo registro não é renovado há mais de
+        SCRATCH_OWNER_TIMEOUT_SECONDS, pastas retidas além do prazo e pastas de staging não
+        registradas mais antigas que SCRATCH_RETENTION_HOURS.
+        Pastas retidas de donos encerrados passam para o registro deste processo.
+        """
+        retention = config_module.SCRATCH_RETENTION_HOURS * 3600
+        now = time.time()
+        registered = set()
+        registry_dir = self._registry_dir()
+        if os.path.isdir(registry_dir):
+            for name in os.listdir(registry_dir):
+                if not name.endswith(".json"):
+                    continue
+                registry_path = os.path.join(registry_dir, name)
+                try:
+                    with open(registry_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    # Registros antigos (por pid) não têm renovado_em: vale a data do arquivo
+                    renovado_em = data.get("renovado_em") or os.path.getmtime(registry_path)
+                except Exception as e:
+                    logger.warning(f"[SCRATCH] Registro ilegível ignorado ({registry_path}): {e}")
+                    continue
+                dono = data.get("dono") or f"pid {data.get('pid')}"
+                pastas = data.get("pastas", {})
+                if dono == self.dono or now - renovado_em < config_module.SCRATCH_OWNER_TIMEOUT_SECONDS:
+                    registered.update(pastas)
+                    continue
+                # Outro processo pode estar coletando o mesmo registro: só quem o renomear segue
+                claimed_path = f"{registry_path}.{self.dono}.coletando"
+                try:
+                    os.replace(registry_path, claimed_path)
+                except OSError:
+                    continue
+                for path, info in pastas.items():
+                    if info.get("retida"):
+                        # Cópia para a rede falhou e a tarefa já foi concluída: a pasta é a única
+                        # cópia local, então segue retida (agora por este processo) até o prazo
+                        if os.path.isdir(path):
+                            with self._cond:
+                                self._folders.setdefault(path, dict(info))
+                        continue
+                    self._remove(path, f"{dono} sem renovação há {(now - renovado_em) / 60:.0f} min")
+                os.remove(claimed_path)
+
+        with self._cond:
+            for path, info in list(self._folders.items()):
+                if info.get("retida") and now - info["retida"] > retention:
+                    self._remove(path, "retida além do prazo")
+                    self._folders.pop(path, None)
+
+        for base_dir in filter(None, {config_module.DOWNLOAD_BASE_DIR, config_module.SCRATCH_TMPFS_DIR}):
+            if not os.path.isdir(base_dir):
+                continue
+            for name in os.listdir(base_dir):
+                path = os.path.abspath(os.path.join(base_dir, name))
+                if name == REGISTRY_DIRNAME or path in registered or path in self._folders:
+                    continue
+                if not _STAGING_PATTERN.match(name):
+                    continue
+                try:
+                    age = now - os.path.getmtime(path)
+                except OSError:
+                    continue
+                if age > retention:
+                    self._remove(path, f"sobra sem registro há {age / 3600:.0f}h")
+        self._save_registry()
+        return self.stats["orfas_removidas"]
+
+    def reset(self):
+        with self._cond:
+            self.stats = {"pastas": 0, "adiadas": 0, "espera_s": 0.0, "orfas_removidas": 0, "bytes_liberados": 0,
+                          "tmpfs": 0}
+
+    def snapshot(self):
+        with self._cond:
+            data = dict(self.stats)
+            data["em_uso"] = sum(1 for info in self._folders.values() if not info.get("retida"))
+            data["retidas"] = sum(1 for info in self._folders.values() if info.get("retida"))
+            data["espera_s"] = round(self.stats["espera_s"], 3)
+            return data
+
+
+_scratch = None
+_scratch_lock = threading.Lock()
+
+
+def get_scratch_manager():
+    global _scratch
+    with _scratch_lock:
+        if _scratch is None:
+            _scratch = ScratchManager()
+        return _scratch
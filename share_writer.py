@@ -0,0 +1,180 @@
+# share_writer.py
+import errno
+import os
+import queue
+import threading
+import time
+
+import config as config_module
+from file_utils import safe_move_folder
+from logger_config import logger
+import tracing
+
+# Erros que indicam compartilhamento de rede temporariamente indisponível
+_TRANSIENT_ERRNOS = {errno.ENOENT, errno.EIO, errno.ESTALE, errno.ENOTCONN, errno.EHOSTDOWN,
+                     errno.EHOSTUNREACH, errno.ETIMEDOUT, errno.EAGAIN, errno.EBUSY}
+
+
+def share_root(path):
+    """Ponto de montagem que contém `path` (usado como chave do limite por compartilhamento)."""
+    path = os.path.abspath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class ShareWriter:
+    """
+    Serviço em segundo plano que copia pastas prontas do staging local para o compartilhamento de rede.
+
+    - `SHARE_WRITER_WORKERS` cópias em paralelo, no máximo `SHARE_MAX_STREAMS` por compartilhamento;
+    - cache dos diretórios de destino que já sabemos existir (evita `makedirs` no SMB a cada tarefa);
+    - quando o compartilhamento está indisponível, aguarda e tenta de novo com backoff, sem
+      bloquear quem enviou o trabalho.
+    """
+
+    def __init__(self, workers=None, max_streams=None):
+        self.workers = workers or config_module.SHARE_WRITER_WORKERS
+        self.max_streams = max_streams or config_module.SHARE_MAX_STREAMS
+        self._queue = queue.Queue()
+        self._threads = []
+        self._known_dirs = set()
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return self
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"share-writer-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"[SHARE] Writer iniciado com {self.workers} workers ({self.max_streams} por compartilhamento)")
+        return self
+
+    def submit(self, src_folder, resolve_dest, on_done=None, fallback_count=0):
+        """
+        Agenda a cópia de `src_folder` para o caminho retornado por `resolve_dest()`.
+
+        `resolve_dest` roda no worker (a resolução também acessa a rede). Se retornar None a
+        pasta fica no staging e `on_done(fallback_count)` é chamado; caso contrário
+        `on_done` recebe o número de arquivos movidos.
+        """
+        self.start()
+        self._queue.put((src_folder, resolve_dest, on_done, fallback_count))
+
+    def reset(self):
+        """Zera os contadores (a cada execução); o cache de diretórios é mantido."""
+        with self._lock:
+            self.stats = {"pastas": 0, "arquivos": 0, "tentativas_repetidas": 0, "falhas": 0, "mkdirs_evitados": 0,
+                          "arquivos_copiados": 0, "arquivos_ignorados": 0, "bytes_copiados": 0, "bytes_ignorados": 0}
+
+    def join(self):
+        """Aguarda todas as cópias enfileiradas terminarem."""
+        self._queue.join()
+
+    def ensure_dir(self, path):
+        """`makedirs` com cache: diretórios já vistos não são recriados no compartilhamento."""
+        with self._lock:
+            if path in self._known_dirs:
+                self.stats["mkdirs_evitados"] += 1
+                return
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._known_dirs.add(path)
+
+    def forget_dir(self, path):
+        with self._lock:
+            self._known_dirs.discard(path)
+
+    def _semaphore(self, root):
+        with self._lock:
+            if root not in self._semaphores:
+                self._semaphores[root] = threading.BoundedSemaphore(self.max_streams)
+            return self._semaphores[root]
+
+    def _wait_for_share(self):
+        """Bloqueia (com backoff) enquanto a base da rede não estiver montada."""
+        wait = 5
+        waited = 0
+        while not os.path.isdir(config_module.SHARE_BASE_DIR):
+            if waited >= config_module.SHARE_RETRY_MAX_WAIT:
+                return False
+            logger.warning(f"[SHARE] Compartilhamento indisponível ({config_module.SHARE_BASE_DIR}). "
+                           f"Nova tentativa em {wait}s.")
+            time.sleep(wait)
+            waited += wait
+            wait = min(wait * 2, 60)
+        return True
+
+    def _worker(self):
+        while True:
+            src_folder, resolve_dest, on_done, fallback_count = self._queue.get()
+            result = fallback_count
+            try:
+                result = self._copy(src_folder, resolve_dest, fallback_count)
+            except Exception as e:
+                logger.error(f"[SHARE] Erro inesperado ao copiar {src_folder}: {e}", exc_info=True)
+            finally:
+                try:
+                    if on_done is not None:
+                        on_done(result)
+                except Exception as e:
+                    logger.error(f"[SHARE] Erro no callback de conclusão de {src_folder}: {e}", exc_info=True)
+                self._queue.task_done()
+
+    def _copy(self, src_folder, resolve_dest, fallback_count):
+        attempts = config_module.SHARE_RETRY_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            if not self._wait_for_share():
+                logger.error(f"[SHARE] Compartilhamento continua indisponível. Pasta mantida no staging: {src_folder}")
+                break
+            with tracing.span("share.resolver_destino", "rede"):
+                dest_path = resolve_dest()
+            if not dest_path:
+                return fallback_count
+            parent = os.path.dirname(dest_path)
+            try:
+                self.ensure_dir(parent)
+                report = {}
+                with self._semaphore(share_root(parent)), tracing.span("share.copiar", "rede", pasta=src_folder):
+                    moved = safe_move_folder(src_folder, dest_path, config_module.DEBUG_MODE, raise_errors=True,
+                                             report=report)
+                with self._lock:
+                    self.stats["pastas"] += 1
+                    self.stats["arquivos"] += moved
+                    for key, value in report.items():
+                        self.stats[key] += value
+                return moved
+            except OSError as e:
+                self.forget_dir(parent)
+                if e.errno not in _TRANSIENT_ERRNOS or attempt == attempts:
+                    logger.error(f"[SHARE] Falha ao copiar {src_folder} para {dest_path}: {e}")
+                    break
+                with self._lock:
+                    self.stats["tentativas_repetidas"] += 1
+                backoff = min(5 * 2 ** (attempt - 1), 60)
+                logger.warning(f"[SHARE] Erro transitório ao copiar {src_folder} ({e}). "
+                               f"Tentativa {attempt}/{attempts}, nova tentativa em {backoff}s.")
+                time.sleep(backoff)
+        with self._lock:
+            self.stats["falhas"] += 1
+        return fallback_count
+
+
+_share_writer = None
+_share_writer_lock = threading.Lock()
+
+
+def get_share_writer():
+    """Writer compartilhado pelo processo (mantém o cache de diretórios entre execuções)."""
+    global _share_writer
+    with _share_writer_lock:
+        if _share_writer is None:
+            _share_writer = ShareWriter()
+        return _share_writer
@@ -0,0 +1,57 @@
+# state_db.py
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import config as config_module
+
+_local = threading.local()
+_schemas_lock = threading.Lock()
+_schemas_ready = set()
+
+
+def connect(path=None):
+    """
+    Conexão SQLite da thread atual com o banco de estado compartilhado entre processos
+    (STATE_DB_FILE). WAL permite leitores concorrentes com um escritor; `busy_timeout`
+    faz processos concorrentes aguardarem o lock em vez de falhar.
+    """
+    path = os.path.abspath(path or config_module.STATE_DB_FILE)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conns[path] = conn
+    return conn
+
+
+def ensure_schema(name, ddl, path=None):
+    """Executa o DDL (`CREATE ... IF NOT EXISTS`) de um módulo uma vez por processo e banco."""
+    conn = connect(path)
+    key = (os.path.abspath(path or config_module.STATE_DB_FILE), name)
+    with _schemas_lock:
+        if key in _schemas_ready:
+            return conn
+        conn.executescript(ddl)
+        _schemas_ready.add(key)
+    return conn
+
+
+@contextmanager
+def transaction(conn, immediate=True):
+    """Transação explícita; IMMEDIATE reserva a escrita já no início (evita corrida entre processos)."""
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
@@ -0,0 +1,156 @@
+# status_registry.py
+"""
+Registro do estado das execuções no banco de estado compartilhado (SQLite), legível por qualquer
+processo: workers do servidor WSGI, worker daemon, scheduler e execuções manuais.
+
+Cada chamada de realizar_processamento registra uma linha com o progresso (publicado a cada
+STATUS_PROGRESS_SECONDS) e o resumo final. Execuções cujo processo parou de publicar há mais de
+STATUS_STALE_SECONDS deixam de ser consideradas em andamento.
+"""
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import config as config_module
+import state_db
+from logger_config import logger
+
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+FALHOU = "falhou"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS execucoes (
+    id TEXT PRIMARY KEY,
+    execucao TEXT NOT NULL,
+    job_id INTEGER,
+    dono TEXT,
+    estado TEXT NOT NULL,
+    iniciado_em REAL NOT NULL,
+    atualizado_em REAL NOT NULL,
+    concluido_em REAL,
+    mensagem TEXT,
+    progresso TEXT,
+    resumo TEXT
+);
+CREATE INDEX IF NOT EXISTS execucoes_atualizado ON execucoes (atualizado_em);
+"""
+
+
+def _conn():
+    return state_db.ensure_schema("status_registry", SCHEMA)
+
+
+def _json(valor):
+    return json.dumps(valor, default=str) if valor is not None else None
+
+
+def _como_dict(row):
+    registro = dict(row)
+    registro["progresso"] = json.loads(registro["progresso"]) if registro["progresso"] else {}
+    registro["resumo"] = json.loads(registro["resumo"]) if registro["resumo"] else None
+    for campo in ("iniciado_em", "atualizado_em", "concluido_em"):
+        if registro[campo]:
+            registro[campo] = datetime.fromtimestamp(registro[campo]).strftime("%Y-%m-%d %H:%M:%S")
+    return registro
+
+
+def registrar_inicio(execucao, job_id=None):
+    """Registra uma execução em andamento e retorna seu id."""
+    from coordinator import get_coordinator
+    registro_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _conn()
+    conn.execute(
+        "INSERT INTO execucoes (id, execucao, job_id, dono, estado, iniciado_em, atualizado_em, mensagem) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (registro_id, execucao, job_id, get_coordinator().dono, EXECUTANDO, now, now, "Em execução"))
+    conn.execute("DELETE FROM execucoes WHERE id NOT IN "
+                 "(SELECT id FROM execucoes ORDER BY iniciado_em DESC LIMIT ?)", (config_module.STATUS_HISTORY_SIZE,))
+    return registro_id
+
+
+def publicar_progresso(registro_id, progresso):
+    _conn().execute("UPDATE execucoes SET progresso = ?, atualizado_em = ? WHERE id = ? AND estado = ?",
+                    (_json(progresso), time.time(), registro_id, EXECUTANDO))
+
+
+def registrar_fim(registro_id, sucesso, resumo=None, mensagem=None, progresso=None):
+    now = time.time()
+    _conn().execute(
+        "UPDATE execucoes SET estado = ?, concluido_em = ?, atualizado_em = ?, mensagem = ?, resumo = ?, "
+        "progresso = COALESCE(?, progresso) WHERE id = ?",
+        (CONCLUIDO if sucesso else FALHOU, now, now, mensagem or ("Concluído" if sucesso else "Concluído com erros"),
+         _json(resumo), _json(progresso), registro_id))
+
+
+def execucoes_ativas():
+    """Execuções em andamento com progresso publicado recentemente (mais recentes primeiro)."""
+    limite = time.time() - config_module.STATUS_STALE_SECONDS
+    rows = _conn().execute("SELECT * FROM execucoes WHERE estado = ? AND atualizado_em >= ? ORDER BY iniciado_em DESC",
+                           (EXECUTANDO, limite)).fetchall()
+    return [_como_dict(row) for row in rows]
+
+
+def ultima_execucao():
+    row = _conn().execute("SELECT * FROM execucoes WHERE estado != ? ORDER BY concluido_em DESC LIMIT 1",
+                          (EXECUTANDO,)).fetchone()
+    return _como_dict(row) if row is not None else None
+
+
+def status_atual():
+    """
+    Status no formato de /processing_status: execuções em andamento (com o progresso do pipeline),
+    jobs na fila ou o resumo da última execução concluída.
+    """
+    import job_queue
+    ativas = execucoes_ativas()
+    if ativas:
+        atual = ativas[0]
+        status = {
+            'running': True, 'success': None, 'job': atual['job_id'], 'execucao': atual['execucao'], 'id': atual['id'],
+            'message': f"Em execução ({atual['execucao']})", 'inicio': atual['iniciado_em'],
+            'pipeline': atual['progresso'].get('pipeline', {}),
+            'progresso': atual['progresso'].get('contadores', {}),
+        }
+        if len(ativas) > 1:
+            status['execucoes'] = [{'execucao': a['execucao'], 'dono': a['dono'], 'job': a['job_id'],
+                                    'progresso': a['progresso'].get('contadores', {})} for a in ativas]
+        return status
+    fila = job_queue.listar_jobs(estados=(job_queue.PENDENTE, job_queue.EXECUTANDO))
+    if fila:
+        proximo = fila[-1]
+        return {'running': True, 'success': None, 'job': proximo['id'], 'fila': fila,
+                'message': f"Na fila (job #{proximo['id']}, {len(fila)} pendente(s))"}
+    ultima = ultima_execucao()
+    if ultima is None:
+        return {'running': False, 'success': None, 'message': 'Nenhuma execução'}
+    return {'running': False, 'success': ultima['estado'] == CONCLUIDO, 'job': ultima['job_id'],
+            'execucao': ultima['execucao'], 'id': ultima['id'], 'message': ultima['mensagem'], 'summary': ultima['resumo']}
+
+
+class ProgressPublisher:
+    """Thread que publica `coletar()` no registro a cada STATUS_PROGRESS_SECONDS."""
+
+    def __init__(self, registro_id, coletar):
+        self.registro_id = registro_id
+        self.coletar = coletar
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="status-progresso", daemon=True)
+
+    def _loop(self):
+        while not self._parar.wait(config_module.STATUS_PROGRESS_SECONDS):
+            try:
+                publicar_progresso(self.registro_id, self.coletar())
+            except Exception as e:
+                logger.debug(f"Falha ao publicar progresso: {e}")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._parar.set()
+        self._thread.join(timeout=5)
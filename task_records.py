@@ -0,0 +1,87 @@
+# task_records.py
+import json
+import sys
+import zlib
+
+
+class TaskRecord:
+    """
+    Representação compacta de uma tarefa retornada por task/search.
+
+    Guarda apenas os campos usados no processamento (projeção) em `__slots__`, em vez
+    do JSON completo de cada tarefa. Mantém a interface `get()` de dicionário para os
+    chamadores existentes. O documento original da busca fica guardado como JSON compactado
+    (zlib), bem menor que o dict, e é decodificado sob demanda com `raw()`.
+    """
+
+    __slots__ = ("_id", "name", "customer_id", "customer_code", "customer_name",
+                 "due_date", "competence_date", "status", "_raw")
+
+    def __init__(self, _id, name="", customer_id=None, customer_code=None, customer_name=None,
+                 due_date=None, competence_date=None, status=None, raw_json=None):
+        self._id = _id
+        self.name = name
+        self.customer_id = customer_id
+        self.customer_code = customer_code
+        self.customer_name = customer_name
+        self.due_date = due_date
+        self.competence_date = competence_date
+        self.status = status
+        self._raw = raw_json
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Projeta um documento JSON de tarefa nos campos usados pelo processamento."""
+        customer = doc.get("customer") or {}
+        if not isinstance(customer, dict):
+            customer = {"_id": customer}
+        return cls(
+            _intern(doc.get("_id")),
+            doc.get("name", ""),
+            _intern(customer.get("_id")),
+            _intern(customer.get("code")),
+            customer.get("name"),
+            doc.get("due_date"),
+            doc.get("competence_date"),
+            _intern(doc.get("status")),
+            zlib.compress(json.dumps(doc, separators=(",", ":")).encode("utf-8"), 1),
+        )
+
+    @property
+    def customer(self):
+        return {"_id": self.customer_id, "code": self.customer_code, "name": self.customer_name or ""}
+
+    def get(self, key, default=None):
+        """Acesso no estilo dict (`task.get("name", "")`) para compatibilidade com o código existente."""
+        if key == "customer":
+            return self.customer
+        if key in self.__slots__ and key != "_raw":
+            value = getattr(self, key)
+            return default if value is None else value
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def raw(self):
+        """
+        Documento completo da tarefa como veio da busca (o mesmo snapshot que gerou o registro),
+        ou None se o registro não veio de `from_doc()`. Um dict novo a cada chamada.
+        """
+        if self._raw is None:
+            return None
+        return json.loads(zlib.decompress(self._raw))
+
+    def __repr__(self):
+        return f"TaskRecord(_id={self._id!r}, name={self.name!r}, customer_code={self.customer_code!r})"
+
+
+def _intern(value):
+    # ids e status se repetem muito entre tarefas (mesmo cliente, mesmo status)
+    return sys.intern(value) if isinstance(value, str) else value
@@ -0,0 +1,76 @@
+# test_coordinator.py - Divisão de empresas em shards e leases do coordenador
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from coordinator import LeaseLost, RunCoordinator, dividir_em_shards
+
+
+def test_mais_shards_que_empresas():
+    ids = ["empresa_a", "empresa_b"]
+    total = 5
+    shards = [dividir_em_shards(ids, shard, total) for shard in range(total)]
+
+    # Cada empresa cai em exatamente um shard; os demais ficam vazios
+    assert sorted(i for ids_shard in shards for i in ids_shard) == sorted(ids)
+    assert sum(1 for ids_shard in shards if not ids_shard) >= total - len(ids)
+
+
+def test_shards_vazios_concluem_a_rodada(tmp_path):
+    coordenador = RunCoordinator(path=str(tmp_path / "state.db"))
+    ids = ["empresa_a"]
+    total = 3
+    processadas = []
+
+    shard = coordenador.claim_shard("2026-10-19", total)
+    while shard is not None:
+        with shard:
+            ids_shard = dividir_em_shards(ids, shard.shard, shard.total)
+            if ids_shard:
+                processadas.extend(ids_shard)
+        shard = coordenador.claim_shard("2026-10-19", total, rodada=shard.rodada)
+
+    situacao = coordenador.situacao("2026-10-19")
+    assert processadas == ids
+    assert situacao["pendentes"] == 0
+    assert [s["estado"] for s in situacao["shards"]] == ["concluido"] * total
+
+
+def test_lease_perdido_interrompe_o_shard(tmp_path, monkeypatch):
+    monkeypatch.setattr("config.RUN_LEASE_HEARTBEAT_SECONDS", 0.01)
+    coordenador = RunCoordinator(path=str(tmp_path / "state.db"))
+    shard = coordenador.claim_shard("2026-10-19", 1)
+    interrompido = threading.Event()
+    shard.ao_perder(interrompido.set)
+
+    # Outro worker retomou o shard: a renovação não encontra mais o lease deste processo
+    monkeypatch.setattr(coordenador, "_renovar", lambda lease: False)
+
+    assert interrompido.wait(2)
+    assert shard.perdida
+    with pytest.raises(LeaseLost):
+        shard.check()
+
+
+def test_falha_ao_renovar_e_repetida(tmp_path, monkeypatch):
+    monkeypatch.setattr("config.RUN_LEASE_HEARTBEAT_SECONDS", 0.01)
+    coordenador = RunCoordinator(path=str(tmp_path / "state.db"))
+    shard = coordenador.claim_shard("2026-10-19", 1)
+    renovar = coordenador._renovar
+    tentativas = []
+
+    def banco_ocupado(lease):
+        tentativas.append(1)
+        if len(tentativas) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        return renovar(lease)
+
+    monkeypatch.setattr(coordenador, "_renovar", banco_ocupado)
+    while len(tentativas) < 5:
+        time.sleep(0.01)
+
+    assert not shard.perdida
+    assert shard.complete()
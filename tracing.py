@@ -0,0 +1,127 @@
+# tracing.py
+"""
+Spans de tempo das unidades de trabalho de uma execução: chamadas à API por etapa do
+RunDeadline (login, catálogo, busca, detalhe, preparo do ZIP, download, extração, comentário,
+status), cada item das etapas do pipeline e a resolução/cópia das pastas na rede.
+
+`iniciar()` liga o registro para a execução do processo; `span()` é um no-op fora dela.
+`finalizar()` grava um trace no formato Chrome (logs/traces/trace_<ts>.json, abre em
+chrome://tracing ou ui.perfetto.dev) e devolve totais e percentis por span para o resumo.
+"""
+import glob
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import config as config_module
+from logger_config import logger
+
+
+class Tracer:
+    """Spans de uma execução. Além de TRACE_MAX_SPANS só os totais continuam sendo contabilizados."""
+
+    def __init__(self, nome, max_spans=None):
+        self.nome = nome
+        self.max_spans = config_module.TRACE_MAX_SPANS if max_spans is None else max_spans
+        self.inicio = time.perf_counter()
+        self.spans = []
+        self.descartados = 0
+        self.duracoes = {}
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nome, categoria, inicio, fim, args):
+        thread = threading.current_thread()
+        with self._lock:
+            self.duracoes.setdefault(nome, []).append(fim - inicio)
+            if len(self.spans) >= self.max_spans:
+                self.descartados += 1
+                return
+            self.threads.setdefault(thread.ident, thread.name)
+            self.spans.append((nome, categoria, inicio, fim, thread.ident, args))
+
+    def resumo(self):
+        """Total, chamadas e p50/p95/máximo (segundos) por span."""
+        with self._lock:
+            duracoes = {nome: sorted(valores) for nome, valores in self.duracoes.items()}
+        return {nome: {"total_s": round(sum(valores), 3), "chamadas": len(valores),
+                       "p50_s": round(_percentil(valores, 50), 3), "p95_s": round(_percentil(valores, 95), 3),
+                       "max_s": round(valores[-1], 3)}
+                for nome, valores in sorted(duracoes.items(), key=lambda item: -sum(item[1]))}
+
+    def chrome_trace(self):
+        """Eventos no formato Trace Event (fases "X" com duração, em microssegundos)."""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+            threads = dict(self.threads)
+        eventos = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.nome}}]
+        eventos += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": nome}}
+                    for tid, nome in threads.items()]
+        for nome, categoria, inicio, fim, tid, args in spans:
+            evento = {"name": nome, "cat": categoria, "ph": "X", "pid": pid, "tid": tid,
+                      "ts": round((inicio - self.inicio) * 1e6), "dur": round((fim - inicio) * 1e6)}
+            if args:
+                evento["args"] = args
+            eventos.append(evento)
+        return {"traceEvents": eventos, "displayTimeUnit": "ms",
+                "otherData": {"execucao": self.nome, "spans_descartados": self.descartados}}
+
+
+def _percentil(valores_ordenados, pct):
+    if not valores_ordenados:
+        return 0.0
+    return valores_ordenados[max(0, math.ceil(pct / 100 * len(valores_ordenados)) - 1)]
+
+
+_tracer = None
+
+
+def iniciar(nome):
+    """Começa a registrar spans da execução `nome` no processo."""
+    global _tracer
+    if config_module.TRACE_ENABLED:
+        _tracer = Tracer(nome)
+    return _tracer
+
+
+@contextmanager
+def span(nome, categoria="execucao", **args):
+    """Mede o bloco como um span `nome` da execução em andamento (sem execução, não faz nada)."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.registrar(nome, categoria, inicio, time.perf_counter(), args)
+
+
+def finalizar():
+    """
+    Encerra o registro, grava o trace e retorna {"arquivo", "spans", "spans_descartados", "etapas"}
+    (None se o tracing estiver desligado).
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    resultado = {"arquivo": None, "spans": len(tracer.spans), "spans_descartados": tracer.descartados,
+                 "etapas": tracer.resumo()}
+    try:
+        os.makedirs(config_module.TRACE_DIR, exist_ok=True)
+        caminho = os.path.join(config_module.TRACE_DIR, f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json")
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(tracer.chrome_trace(), f, separators=(",", ":"), default=str)
+        resultado["arquivo"] = caminho
+        for antigo in sorted(glob.glob(os.path.join(config_module.TRACE_DIR, "trace_*.json")))[:-config_module.TRACE_KEEP]:
+            os.remove(antigo)
+    except OSError as e:
+        logger.warning(f"Não foi possível gravar o trace da execução: {e}")
+    return resultado
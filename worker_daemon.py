@@ -0,0 +1,203 @@
+# worker_daemon.py
+"""
+Worker de longa duração: mantém o processo aquecido (imports, conexões HTTP, token, catálogos
+e índice de pastas da rede) e executa o processamento no próprio processo, nos horários do
+cron (DAEMON_CRON) ou sob demanda pelo socket de controle (usado pelo app web).
+
+As execuções passam pela fila persistente (job_queue.py), consumida pelo runner do daemon.
+
+Protocolo do socket (TCP em DAEMON_HOST:DAEMON_PORT): uma linha JSON por requisição,
+{"comando": "ping" | "status" | "executar", ...}, e uma linha JSON de resposta.
+"""
+import json
+import socket
+import socketserver
+import sys
+import threading
+from datetime import datetime
+
+import config as config_module
+import job_queue
+import status_registry
+from logger_config import logger
+
+
+def enviar_comando(comando, timeout=5.0, **dados):
+    """
+    Envia um comando ao worker daemon e retorna a resposta (dict), ou None se o daemon
+    não estiver rodando. Usado pelo app web; não importa o restante do sistema.
+    """
+    pedido = dict(dados, comando=comando)
+    try:
+        with socket.create_connection((config_module.DAEMON_HOST, config_module.DAEMON_PORT), timeout=timeout) as sock:
+            sock.sendall((json.dumps(pedido) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as resposta:
+                linha = resposta.readline()
+        return json.loads(linha) if linha else None
+    except (OSError, ValueError):
+        return None
+
+
+class WorkerDaemon:
+    """Processo aquecido com agendamento cron e socket de controle."""
+
+    def __init__(self, shards=None):
+        self.runner = job_queue.JobRunner(shards=shards)
+        self.scheduler = None
+        self.server = None
+
+    # Aquecimento ----------------------------------------------------------
+
+    def aquecer(self):
+        """Login, catálogos e índice de pastas da rede carregados antes de precisarem deles."""
+        from processing import carregar_configuracoes, ler_credenciais
+        from api import get_token, get_all_companies, get_all_users
+        from file_utils import empresa_dir_name_for
+        try:
+            carregar_configuracoes()
+            email, password = ler_credenciais()
+            token = get_token(email=email, password=password)
+            if not token:
+                logger.warning("[DAEMON] Falha ao aquecer caches: login com as credenciais de gestta_config.json falhou")
+                return
+            get_all_companies(token)
+            get_all_users(token)
+            empresa_dir_name_for(config_module.SHARE_BASE_DIR, "")
+            logger.info("[DAEMON] Token, catálogos e índice de pastas aquecidos")
+        except Exception as e:
+            logger.warning(f"[DAEMON] Falha ao aquecer caches: {e}")
+
+    # Execuções ------------------------------------------------------------
+
+    def iniciar_execucao(self, start_date=None, end_date=None, origem="sob demanda", empresas=None, dry_run=False):
+        """
+        Enfileira uma execução para o runner do daemon. Retorna (job, novo); `novo` é False
+        quando um pedido idêntico já estava pendente. Levanta ValueError para datas inválidas.
+        """
+        job, novo = job_queue.enfileirar(start_date, end_date, empresas=empresas, dry_run=dry_run, origem=origem)
+        self.runner.notificar()
+        return job, novo
+
+    def _execucao_agendada(self):
+        hoje = datetime.now().strftime("%Y-%m-%d")
+        job, novo = self.iniciar_execucao(hoje, hoje, origem="agendada")
+        if not novo:
+            logger.warning(f"[DAEMON] Execução agendada ignorada: job #{job['id']} idêntico já está na fila.")
+
+    def proxima_execucao(self):
+        job = self.scheduler.get_job("processamento_diario") if self.scheduler else None
+        return job.next_run_time.strftime("%Y-%m-%d %H:%M:%S") if job and job.next_run_time else None
+
+    def estado(self):
+        status = status_registry.status_atual()
+        status['proxima_execucao'] = self.proxima_execucao()
+        status['fila'] = job_queue.listar_jobs(estados=(job_queue.PENDENTE, job_queue.EXECUTANDO))
+        try:
+            from coordinator import get_coordinator
+            status['coordenacao'] = get_coordinator().situacao(datetime.now().strftime("%Y-%m-%d"))
+        except Exception as e:
+            logger.debug(f"Situação da coordenação indisponível: {e}")
+        return status
+
+    # Socket de controle ---------------------------------------------------
+
+    def atender(self, pedido):
+        comando = pedido.get("comando")
+        if comando == "ping":
+            return {"ok": True}
+        if comando == "status":
+            return {"ok": True, "status": self.estado()}
+        if comando == "metricas_http":
+            from api_metrics import api_metrics
+            return {"ok": True, "endpoints": api_metrics.snapshot(), "lentas": api_metrics.chamadas_lentas()}
+        if comando == "limites_download":
+            from download_governor import get_download_governor, limites_atuais
+            if pedido.get("limites"):
+                get_download_governor().configure(**pedido["limites"])
+            return dict(limites_atuais(), ok=True)
+        if comando == "executar":
+            try:
+                job, novo = self.iniciar_execucao(pedido.get("start_date"), pedido.get("end_date"),
+                                                  origem=pedido.get("origem", "sob demanda"),
+                                                  empresas=pedido.get("empresas"), dry_run=bool(pedido.get("dry_run")))
+            except ValueError as e:
+                return {"ok": False, "erro": str(e)}
+            return {"ok": True, "job": job, "novo": novo}
+        return {"ok": False, "erro": f"Comando desconhecido: {comando}"}
+
+    def _criar_servidor(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    pedido = json.loads(self.rfile.readline().decode("utf-8") or "{}")
+                    resposta = daemon.atender(pedido)
+                except Exception as e:
+                    resposta = {"ok": False, "erro": str(e)}
+                self.wfile.write((json.dumps(resposta, default=str) + "\n").encode("utf-8"))
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        return Server((config_module.DAEMON_HOST, config_module.DAEMON_PORT), Handler)
+
+    # Ciclo de vida --------------------------------------------------------
+
+    def start(self):
+        from apscheduler.schedulers.background import BackgroundScheduler
+        from apscheduler.triggers.cron import CronTrigger
+
+        config_module.TOKEN_REUSE_SECONDS = config_module.DAEMON_TOKEN_REUSE_SECONDS
+        config_module.CATALOG_CACHE_SECONDS = config_module.DAEMON_CATALOG_CACHE_SECONDS
+        self.aquecer()
+
+        self.scheduler = BackgroundScheduler()
+        self.scheduler.add_job(self._execucao_agendada, CronTrigger(**config_module.DAEMON_CRON),
+                               id="processamento_diario", name="Processamento diário de documentos Gestta",
+                               replace_existing=True)
+        self.scheduler.add_job(self.aquecer, "interval", minutes=config_module.DAEMON_WARM_INTERVAL_MINUTES,
+                               id="aquecimento", replace_existing=True)
+        self.scheduler.start()
+        self.runner.start()
+
+        self.server = self._criar_servidor()
+        threading.Thread(target=self.server.serve_forever, name="daemon-controle", daemon=True).start()
+        logger.info(f"[DAEMON] Worker pronto. Controle em {config_module.DAEMON_HOST}:{config_module.DAEMON_PORT}, "
+                    f"próxima execução: {self.proxima_execucao()}")
+        return self
+
+    def stop(self):
+        self.runner.stop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.scheduler is not None:
+            self.scheduler.shutdown(wait=False)
+
+    def serve_forever(self):
+        try:
+            threading.Event().wait()
+        except (KeyboardInterrupt, SystemExit):
+            logger.info("[DAEMON] Encerrando worker.")
+        finally:
+            self.stop()
+
+
+def main(executar_agora=False, start_date=None, end_date=None, shards=None):
+    config_module.ensure_runtime_dirs()
+    daemon = WorkerDaemon(shards=shards).start()
+    if executar_agora or start_date or end_date:
+        hoje = datetime.now().strftime("%Y-%m-%d")
+        try:
+            daemon.iniciar_execucao(start_date or hoje, end_date or start_date or hoje, origem="inicialização")
+        except ValueError as e:
+            logger.error(f"[DAEMON] Execução inicial não enfileirada: {e}")
+    daemon.serve_forever()
+
+
+if __name__ == "__main__":
+    from logging_config import configure_logging
+    configure_logging()
+    main(executar_agora="--executar-agora" in sys.argv)